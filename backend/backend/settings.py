@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     'caretakers',
     'clinics',
     'user_settings',
+    'device_config',
 ]
 
 MIDDLEWARE = [
@@ -147,6 +148,23 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Patient similarity model artifact (built offline with PatientSimilarity.save);
+# workers share incremental updates through a journal in the same directory,
+# so it must be on storage every worker can write to
+SIMILARITY_INDEX_PATH = os.path.join(BASE_DIR, 'ml', 'artifacts', 'patient_similarity')
+SIMILARITY_WARM_ON_STARTUP = True  # load the model when the app starts, not on the first request
+SIMILARITY_CACHE_SIZE = 10000  # cached top-k results per worker
+SIMILARITY_CACHE_TTL = 300  # seconds
+
+# Wearable activity recognition model (sensor_model.tflite from lstm-model.py;
+# point at sensor_model_int8.tflite or sensor_model_float16.tflite on gateways)
+ACTIVITY_MODEL_PATH = os.path.join(BASE_DIR, 'ml', 'artifacts', 'sensor_model.tflite')
+
+# Endpoint device configurations are pushed to, formatted with the device_id
+# (required for device syncs; device_config.fake_devices serves fake devices
+# at http://127.0.0.1:9100/devices/{device_id}/config for development)
+DEVICE_CONFIG_DEVICE_SYNC_URL_TEMPLATE = os.environ.get('DEVICE_CONFIG_DEVICE_SYNC_URL_TEMPLATE')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -25,6 +25,7 @@ urlpatterns = [
     path('api/patients/', include('patients.urls')),
     path('api/caretakers/', include('caretakers.urls')),
     path('api/clinics/', include('clinics.urls')),
+    path('device-config/', include('device_config.urls')),
 ]
 
 # Serve media files during development
@@ -24,6 +24,7 @@ from .serializers import (
     ClinicStatisticsSerializer, AppointmentFilterSerializer, MedicalRecordFilterSerializer
 )
 from patients.models import Patient
+from ml.engine import update_patient_index
 
 class IsClinic(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -196,7 +197,9 @@ class ClinicPatientView(generics.ListCreateAPIView):
         return queryset.order_by('-registration_date')
     
     def perform_create(self, serializer):
-        serializer.save(clinic=self.request.user)
+        clinic_patient = serializer.save(clinic=self.request.user)
+        # Make the newly registered patient searchable by similarity
+        update_patient_index(clinic_patient.patient_id)
 
 class ClinicPatientDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ClinicPatientSerializer
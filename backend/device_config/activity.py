@@ -0,0 +1,348 @@
+"""
+Activity recognition for wearable devices.
+
+Devices stream IMU samples over a WebSocket (routed by backend/asgi.py) to
+/ws/devices/<device_id>/activity/. Each connection keeps a fixed-size ring
+buffer of the latest seq_length samples and classifies a window every
+HOP_SIZE samples with the shared micro-batched TFLite model, so windows of
+many devices are run in the same interpreter invocations. Memory per
+stream is bounded by the ring buffer, and the number of streams per
+process by MAX_STREAMS.
+
+Connections are authenticated before they are accepted, with the API's
+credentials: a JWT (or DRF token) in an "Authorization: Bearer <token>"
+(or "Token <key>") header, or, for clients that cannot set headers, a
+?token=<jwt> query parameter, which takes JWT access tokens only. Only staff and the users a device
+configuration is created by or assigned to may stream for the device.
+
+Protocol (JSON text frames):
+    device -> server  {"samples": [[channel, ...], ...]}
+    server -> device  {"type": "activity", ...} for every classified window
+                      {"type": "alert", ...} when an alert activity persists
+                      {"type": "error", "error": ...} for rejected messages
+"""
+
+import asyncio
+import json
+import logging
+import re
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+from urllib.parse import parse_qs
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .config import ACTIVITY_INFERENCE_SETTINGS, ACTIVITY_STREAM_SETTINGS, LOGGING_CONFIG, get_error_message
+
+logger = logging.getLogger(LOGGING_CONFIG['LOGGER_NAME'])
+
+STREAM_PATH = re.compile(r'^/ws/devices/(?P<device_id>[a-zA-Z0-9_-]+)/activity/$')
+
+# WebSocket close codes sent after the connection is accepted
+CLOSE_CODES = {
+    'UNAUTHORIZED': 4401,
+    'FORBIDDEN': 4403,
+    'NOT_FOUND': 4404,
+    'CONFLICT': 4409,
+    'IDLE': 4408,
+    'UNAVAILABLE': 4503,
+}
+
+
+def get_activity_batcher():
+    """Return the worker's micro-batched activity model, or None if no model is deployed"""
+    from ml.activity_inference import get_activity_batcher as load_batcher
+    return load_batcher(
+        getattr(settings, 'ACTIVITY_MODEL_PATH', None),
+        num_threads=ACTIVITY_INFERENCE_SETTINGS['NUM_THREADS'],
+        max_batch_size=ACTIVITY_INFERENCE_SETTINGS['MAX_BATCH_SIZE'],
+        max_wait_ms=ACTIVITY_INFERENCE_SETTINGS['MAX_BATCH_WAIT_MS']
+    )
+
+
+class DeviceStream:
+    """
+    Ring buffer of one device's latest samples, cut into hopped windows.
+
+    Every sample is written twice, at position p and p + seq_length of a
+    buffer of 2 * seq_length rows, so the latest window is always the
+    contiguous slice buffer[p:p + seq_length] and never has to be
+    reassembled.
+    """
+
+    def __init__(self, device_id: str, seq_length: int, n_channels: int, hop_size: int):
+        self.device_id = device_id
+        self.seq_length = seq_length
+        self.hop_size = hop_size
+        self.buffer = np.zeros((2 * seq_length, n_channels), dtype=np.float32)
+        self.position = 0
+        self.samples = 0
+        # The first window is due once the buffer is full
+        self.until_window = seq_length
+        self.alert_streak = 0
+        self.alert_activity = None
+
+    def _write(self, block: np.ndarray) -> None:
+        rows = (self.position + np.arange(len(block))) % self.seq_length
+        self.buffer[rows] = block
+        self.buffer[rows + self.seq_length] = block
+        self.position = (self.position + len(block)) % self.seq_length
+
+    def push(self, samples: np.ndarray) -> List[Tuple[int, np.ndarray]]:
+        """
+        Append samples and return the windows that became due.
+
+        Args:
+            samples (np.ndarray): Samples of shape (n_samples, n_channels)
+
+        Returns:
+            List[Tuple[int, np.ndarray]]: (samples received up to the end of
+            the window, copy of the window) of each due window, oldest first
+        """
+        windows = []
+        offset = 0
+        while offset < len(samples):
+            block = samples[offset:offset + self.until_window]
+            self._write(block)
+            offset += len(block)
+            self.samples += len(block)
+            self.until_window -= len(block)
+            if self.until_window == 0:
+                windows.append((self.samples, self.buffer[self.position:self.position + self.seq_length].copy()))
+                self.until_window = self.hop_size
+        return windows
+
+    def check_alert(self, prediction: Dict[str, Any]) -> bool:
+        """
+        Track consecutive alert-worthy predictions.
+
+        Returns True once per episode, when an alert activity has been
+        predicted with enough confidence for ALERT_CONSECUTIVE_WINDOWS
+        windows in a row.
+        """
+        if (prediction['activity_id'] in ACTIVITY_STREAM_SETTINGS['ALERT_ACTIVITIES']
+                and prediction['confidence'] >= ACTIVITY_STREAM_SETTINGS['ALERT_MIN_CONFIDENCE']):
+            if prediction['activity_id'] != self.alert_activity:
+                self.alert_activity = prediction['activity_id']
+                self.alert_streak = 0
+            self.alert_streak += 1
+            return self.alert_streak == ACTIVITY_STREAM_SETTINGS['ALERT_CONSECUTIVE_WINDOWS']
+
+        self.alert_activity = None
+        self.alert_streak = 0
+        return False
+
+    @property
+    def nbytes(self) -> int:
+        return self.buffer.nbytes
+
+
+class StreamRegistry:
+    """Open device streams of this process, one per device, up to max_streams"""
+
+    def __init__(self, max_streams: int):
+        self.max_streams = max_streams
+        self._streams = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._streams
+
+    def open(self, device_id: str, seq_length: int, n_channels: int, hop_size: int) -> Optional[DeviceStream]:
+        """Register a stream, or return None when the process is at capacity"""
+        if len(self._streams) >= self.max_streams:
+            return None
+        stream = DeviceStream(device_id, seq_length, n_channels, hop_size)
+        self._streams[device_id] = stream
+        return stream
+
+    def close(self, device_id: str) -> None:
+        self._streams.pop(device_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'streams': len(self._streams),
+            'max_streams': self.max_streams,
+            'buffer_bytes': sum(stream.nbytes for stream in self._streams.values())
+        }
+
+
+streams = StreamRegistry(ACTIVITY_STREAM_SETTINGS['MAX_STREAMS'])
+
+
+def _authenticate(scope) -> Optional[Any]:
+    """The active user whose JWT or API token the connection carries, or None"""
+    from rest_framework.authtoken.models import Token
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import TokenError
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    headers = dict(scope.get('headers', []))
+    credentials = headers.get(b'authorization', b'').decode('latin-1').split()
+    authentication = JWTAuthentication()
+
+    if len(credentials) != 2:
+        # Query strings end up in proxy and access logs, so only short-lived
+        # JWT access tokens are accepted there, never API tokens
+        token = (parse_qs(scope.get('query_string', b'').decode('latin-1')).get('token') or [''])[0]
+        if not token:
+            return None
+        try:
+            return authentication.get_user(AccessToken(token))
+        except (TokenError, AuthenticationFailed):
+            return None
+
+    keyword, token = credentials[0].lower(), credentials[1]
+    if keyword == 'bearer':
+        try:
+            return authentication.get_user(authentication.get_validated_token(token))
+        except AuthenticationFailed:
+            return None
+    if keyword == 'token':
+        token = Token.objects.select_related('user').filter(key=token).first()
+        if token is not None and token.user.is_active:
+            return token.user
+    return None
+
+
+def _device_access(device_id: str, user) -> Optional[str]:
+    """
+    Check that user may stream for device_id.
+
+    Returns:
+        None if allowed, else the CLOSE_CODES key to reject the stream with
+    """
+    from django.db.models import Q
+    from .models import DeviceConfiguration
+    device_configs = DeviceConfiguration.objects.filter(
+        device_id=device_id,
+        is_enabled=True,
+        status__in=['active', 'testing']
+    )
+    if not device_configs.exists():
+        return 'NOT_FOUND'
+    if user.is_staff or device_configs.filter(Q(created_by=user) | Q(assigned_to=user)).exists():
+        return None
+    return 'FORBIDDEN'
+
+
+def _parse_samples(text: Optional[str], n_channels: int) -> np.ndarray:
+    """Decode a {"samples": [...]} frame; raises ValueError if it is malformed"""
+    try:
+        samples = np.asarray(json.loads(text or '')['samples'], dtype=np.float32)
+    except (TypeError, KeyError, ValueError):
+        raise ValueError('Expected {"samples": [[channel, ...], ...]}') from None
+    if samples.ndim != 2 or samples.shape[1] != n_channels:
+        raise ValueError(f'Each sample must have {n_channels} channel values')
+    if len(samples) > ACTIVITY_STREAM_SETTINGS['MAX_SAMPLES_PER_MESSAGE']:
+        raise ValueError(f"At most {ACTIVITY_STREAM_SETTINGS['MAX_SAMPLES_PER_MESSAGE']} samples per message")
+    if not np.isfinite(samples).all():
+        raise ValueError('Samples must be finite numbers')
+    return samples
+
+
+async def _send_json(send, data: Dict[str, Any]) -> None:
+    await send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+
+async def _close(send, reason: str, code: int) -> None:
+    await _send_json(send, {'type': 'error', 'error': reason})
+    await send({'type': 'websocket.close', 'code': code})
+
+
+async def _classify(stream: DeviceStream, batcher, windows: List[Tuple[int, np.ndarray]], send) -> None:
+    """Run due windows through the shared model and send predictions and alerts"""
+    future = batcher.submit(np.stack([window for _, window in windows]))
+    try:
+        probabilities = await asyncio.wait_for(
+            asyncio.wrap_future(future), ACTIVITY_INFERENCE_SETTINGS['REQUEST_TIMEOUT']
+        )
+    except asyncio.TimeoutError:
+        await _send_json(send, {'type': 'error', 'error': get_error_message('TIMEOUT')})
+        return
+
+    for (sample, _), prediction in zip(windows, batcher.classifier.describe(probabilities)):
+        del prediction['probabilities']
+        prediction.update(device_id=stream.device_id, sample=sample)
+        await _send_json(send, dict(type='activity', **prediction))
+        if stream.check_alert(prediction):
+            logger.warning(
+                "Activity alert for device %s: %s (confidence %.2f)",
+                stream.device_id, prediction['activity'], prediction['confidence']
+            )
+            await _send_json(send, dict(prediction, type='alert', windows=stream.alert_streak))
+
+
+async def activity_stream_application(scope, receive, send) -> None:
+    """ASGI application for /ws/devices/<device_id>/activity/ WebSocket streams"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    match = STREAM_PATH.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': 1000})
+        return
+    device_id = match.group('device_id')
+    user = await sync_to_async(_authenticate)(scope)
+
+    # Accepted only so that the close code reaches the client; no frame is
+    # read from a connection that is not authorised
+    await send({'type': 'websocket.accept'})
+    if user is None:
+        await _close(send, 'Authentication credentials were not provided or are invalid', CLOSE_CODES['UNAUTHORIZED'])
+        return
+    denied = await sync_to_async(_device_access)(device_id, user)
+    if denied == 'NOT_FOUND':
+        await _close(send, get_error_message('CONFIGURATION_NOT_FOUND'), CLOSE_CODES['NOT_FOUND'])
+        return
+    if denied:
+        await _close(send, get_error_message('PERMISSION_DENIED'), CLOSE_CODES['FORBIDDEN'])
+        return
+
+    try:
+        batcher = await sync_to_async(get_activity_batcher, thread_sensitive=False)()
+    except ImportError as e:
+        batcher = None
+        logger.error("Activity model could not be loaded: %s", e)
+    if batcher is None:
+        await _close(send, 'Activity model is not deployed', CLOSE_CODES['UNAVAILABLE'])
+        return
+    if device_id in streams:
+        await _close(send, 'Device is already streaming', CLOSE_CODES['CONFLICT'])
+        return
+
+    classifier = batcher.classifier
+    stream = streams.open(device_id, classifier.seq_length, classifier.n_channels,
+                          ACTIVITY_STREAM_SETTINGS['HOP_SIZE'])
+    if stream is None:
+        await _close(send, 'Too many device streams', CLOSE_CODES['UNAVAILABLE'])
+        return
+
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(receive(), ACTIVITY_STREAM_SETTINGS['IDLE_TIMEOUT'])
+            except asyncio.TimeoutError:
+                await _close(send, get_error_message('TIMEOUT'), CLOSE_CODES['IDLE'])
+                return
+            if message['type'] == 'websocket.disconnect':
+                return
+
+            try:
+                samples = _parse_samples(message.get('text'), classifier.n_channels)
+            except ValueError as e:
+                await _send_json(send, {'type': 'error', 'error': str(e)})
+                continue
+
+            windows = stream.push(samples)
+            if windows:
+                # Inference is awaited before the next frame is read, so each
+                # device has at most one batch in flight
+                await _classify(stream, batcher, windows, send)
+    finally:
+        streams.close(device_id)
@@ -5,3 +5,6 @@ class DeviceConfigConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'device_config'
     verbose_name = 'Device Configuration'
+
+    def ready(self):
+        import device_config.signals
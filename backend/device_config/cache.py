@@ -0,0 +1,116 @@
+"""
+Cache layer for device configuration reads.
+
+Serialized device types, parameters and configurations are kept in
+Django's cache under CACHE_KEYS for CACHE_TIMEOUTS seconds. Entries are
+dropped by the signal handlers in signals.py when the underlying rows
+change, and explicitly by the bulk paths that bypass signals.
+
+Every key is versioned: values live under '<key>:<version>', where the
+version is a random token stored at '<key>:version'. Invalidating a key
+replaces its token rather than deleting the value, so a computation that
+read the rows before an invalidation stores its result under the old
+version, where no later read looks. A version token that is evicted is
+simply replaced, which can only cause a miss, never a stale hit.
+
+Misses are single-flight: the first request to miss takes a short lock
+with cache.add() (atomic on every backend) and computes the value, while
+concurrent requests for the same key wait for it instead of all querying
+the database at once.
+"""
+
+import time
+import uuid
+from typing import Any, Callable, Iterable
+
+from django.core.cache import cache
+
+from .config import CACHE_KEYS, get_cache_timeout
+
+# Seconds a miss holds its lock, and how often waiting requests poll
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.02
+
+_MISSING = object()
+
+
+def cache_key(name: str, **kwargs) -> str:
+    """Build the cache key registered as CACHE_KEYS[name]"""
+    return CACHE_KEYS[name].format(**kwargs)
+
+
+def _version_key(key: str) -> str:
+    return f'{key}:version'
+
+
+def _current_version(key: str) -> str:
+    """Version token of a key, creating one if it has none"""
+    version_key = _version_key(key)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, None)
+        version = cache.get(version_key)
+    return version
+
+
+def get_or_compute(name: str, compute: Callable[[], Any], **kwargs) -> Any:
+    """
+    Return a cached value, computing it at most once across concurrent misses.
+
+    Args:
+        name: CACHE_KEYS entry (also selects the CACHE_TIMEOUTS entry)
+        compute: Produces the value on a miss; must return a picklable value
+        **kwargs: Fields of the key template
+
+    Returns:
+        The cached or freshly computed value
+    """
+    # The version is read before computing, so a value computed from rows
+    # that are invalidated meanwhile is stored under a retired version
+    key = cache_key(name, **kwargs)
+    key = f'{key}:{_current_version(key)}'
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            value = compute()
+            cache.set(key, value, get_cache_timeout(name))
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    # Another request is computing the value; wait for it rather than
+    # stampeding the database, but never longer than the lock lasts
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if cache.get(lock_key) is None:
+            break
+    return compute()
+
+
+def _retire(keys: Iterable[str]) -> None:
+    """Give keys new version tokens, orphaning their cached values and any in-flight computation"""
+    versions = {_version_key(key): uuid.uuid4().hex for key in keys}
+    if versions:
+        cache.set_many(versions, None)
+
+
+def invalidate(name: str, **kwargs) -> None:
+    """Drop one cached entry"""
+    _retire([cache_key(name, **kwargs)])
+
+
+def invalidate_configurations(device_configs: Iterable[Any]) -> None:
+    """Drop the cached entries of several configurations (anything with pk and device_id) at once"""
+    keys = []
+    for device_config in device_configs:
+        keys.append(cache_key('DEVICE_CONFIG_DETAIL', pk=device_config.pk))
+        keys.append(cache_key('DEVICE_CONFIG', device_id=device_config.device_id))
+    _retire(keys)
@@ -33,6 +33,10 @@ DEVICE_CONFIG_SETTINGS = {
     'DEFAULT_SYNC_TIMEOUT': 30,  # seconds
     'MAX_SYNC_RETRIES': 3,
     'SYNC_BATCH_SIZE': 100,
+    # Device endpoint for configuration pushes, formatted with the device_id;
+    # required for syncs (DEVICE_CONFIG_DEVICE_SYNC_URL_TEMPLATE), e.g.
+    # 'http://127.0.0.1:9100/devices/{device_id}/config' for fake_devices.py
+    'DEVICE_SYNC_URL_TEMPLATE': None,
     
     # History and logging
     'MAX_HISTORY_ENTRIES': 1000,
@@ -41,6 +45,7 @@ DEVICE_CONFIG_SETTINGS = {
     
     # Export settings
     'MAX_EXPORT_RECORDS': 10000,
+    'EXPORT_CHUNK_SIZE': 500,  # configurations read (and prefetched for) per query
     'SUPPORTED_EXPORT_FORMATS': ['json', 'csv', 'xml'],
     
     # Security settings
@@ -190,6 +195,7 @@ CACHE_KEYS = {
     'DEVICE_TYPE_LIST': 'device_config:device_types',
     'DEVICE_PARAMETERS': 'device_config:parameters:{device_type_id}',
     'DEVICE_CONFIG': 'device_config:config:{device_id}',
+    'DEVICE_CONFIG_DETAIL': 'device_config:config_detail:{pk}',
     'DEVICE_HISTORY': 'device_config:history:{device_id}',
     'SYNC_STATUS': 'device_config:sync:{device_id}',
     'VALIDATION_RULES': 'device_config:validation_rules',
@@ -200,6 +206,7 @@ CACHE_TIMEOUTS = {
     'DEVICE_TYPE_LIST': 3600,  # 1 hour
     'DEVICE_PARAMETERS': 1800,  # 30 minutes
     'DEVICE_CONFIG': 900,       # 15 minutes
+    'DEVICE_CONFIG_DETAIL': 900,  # 15 minutes
     'DEVICE_HISTORY': 1800,     # 30 minutes
     'SYNC_STATUS': 300,         # 5 minutes
     'VALIDATION_RULES': 86400,  # 24 hours
@@ -246,12 +253,32 @@ PERFORMANCE_SETTINGS = {
     'ENABLE_QUERY_CACHING': True,
     'ENABLE_RESULT_CACHING': True,
     'BATCH_SIZE': 100,
-    'MAX_CONCURRENT_SYNCS': 10,
+    'MAX_CONCURRENT_SYNCS': 100,
     'SYNC_TIMEOUT': 30,
     'QUERY_TIMEOUT': 10,
     'ENABLE_ASYNC_PROCESSING': True,
 }
 
+# Activity Inference Settings (wearable IMU windows, see ml.activity_inference)
+ACTIVITY_INFERENCE_SETTINGS = {
+    'NUM_THREADS': 2,             # TFLite interpreter threads per worker
+    'MAX_BATCH_SIZE': 64,         # windows per interpreter invocation
+    'MAX_BATCH_WAIT_MS': 5,       # how long a request waits for others to join its batch
+    'MAX_WINDOWS_PER_REQUEST': 256,
+    'REQUEST_TIMEOUT': 10,        # seconds
+}
+
+# Activity Streaming Settings (WebSocket IMU streams, see device_config.activity)
+ACTIVITY_STREAM_SETTINGS = {
+    'HOP_SIZE': 25,               # samples between classified windows
+    'MAX_STREAMS': 5000,          # concurrent device streams per process
+    'MAX_SAMPLES_PER_MESSAGE': 500,
+    'IDLE_TIMEOUT': 60,           # seconds without a message before the stream is closed
+    'ALERT_ACTIVITIES': [5, 12, 13],  # running, ascending and descending stairs
+    'ALERT_MIN_CONFIDENCE': 0.8,
+    'ALERT_CONSECUTIVE_WINDOWS': 3,
+}
+
 # Security Settings
 SECURITY_SETTINGS = {
     'ENABLE_IP_WHITELISTING': False,
@@ -0,0 +1,213 @@
+"""
+Streaming export of device configurations.
+
+Configurations are read with iterator(chunk_size=EXPORT_CHUNK_SIZE), with
+their history and sync logs prefetched once per chunk, and every record is
+rendered and sent as soon as it is read. An export therefore holds at most
+one chunk in memory however large the fleet is, and the first bytes reach
+the client before the last rows are queried.
+
+Under ASGI the rendering generator is driven from the event loop with
+sync_to_async, one batch of EXPORT_CHUNK_SIZE pieces per thread hop;
+Django would otherwise consume a synchronous iterator in full before
+sending anything.
+
+Formats (SUPPORTED_EXPORT_FORMATS):
+    json  [{...}, ...] with the fields of DeviceConfigurationSerializer,
+          plus 'history' and 'sync_logs' when requested
+    csv   one summary row per configuration
+    xml   <device_configurations><configuration>...</configuration>...
+"""
+
+import csv
+import json
+import re
+from typing import Dict, Any, AsyncIterator, Iterator, Iterable
+from xml.etree import ElementTree
+
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch, QuerySet
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from .config import DEVICE_CONFIG_SETTINGS
+from .models import DeviceConfigurationHistory
+from .serializers import (
+    DeviceConfigurationExportRowSerializer,
+    DeviceConfigurationHistorySerializer,
+    DeviceSyncLogSerializer
+)
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'xml': 'application/xml',
+}
+
+CSV_HEADERS = ['Device ID', 'Name', 'Device Type', 'Status', 'Version', 'Created At']
+
+# Keys that can be used as XML element names as they are
+XML_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_.-]*$')
+
+# Characters XML 1.0 cannot represent, even as character references
+XML_ILLEGAL = re.compile(r'[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+
+
+def export_records(
+    configurations: QuerySet,
+    include_history: bool = False,
+    include_sync_logs: bool = False
+) -> Iterator[Dict[str, Any]]:
+    """
+    Serialized configurations, read chunk by chunk.
+
+    Args:
+        configurations: Configurations to export
+        include_history: Add each configuration's 'history'
+        include_sync_logs: Add each configuration's 'sync_logs'
+
+    Yields:
+        One dict per configuration
+    """
+    configurations = configurations.select_related('device_type', 'created_by', 'assigned_to')
+    if include_history:
+        configurations = configurations.prefetch_related(
+            Prefetch('history', queryset=DeviceConfigurationHistory.objects.select_related('changed_by'))
+        )
+    if include_sync_logs:
+        configurations = configurations.prefetch_related('sync_logs')
+
+    serializer = DeviceConfigurationExportRowSerializer(context={'device_types': {}})
+    history_serializer = DeviceConfigurationHistorySerializer()
+    sync_log_serializer = DeviceSyncLogSerializer()
+
+    for device_config in configurations.iterator(chunk_size=DEVICE_CONFIG_SETTINGS['EXPORT_CHUNK_SIZE']):
+        record = serializer.to_representation(device_config)
+        if include_history:
+            record['history'] = [history_serializer.to_representation(entry) for entry in device_config.history.all()]
+        if include_sync_logs:
+            record['sync_logs'] = [sync_log_serializer.to_representation(log) for log in device_config.sync_logs.all()]
+        yield record
+
+
+def stream_json(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Render records as a JSON array, one record at a time"""
+    yield '['
+    separator = ''
+    for record in records:
+        yield separator + json.dumps(record, cls=JSONEncoder)
+        separator = ','
+    yield ']'
+
+
+class _Echo:
+    """File-like object handing csv.writer's output straight back"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def stream_csv(configurations: QuerySet) -> Iterator[str]:
+    """Render one summary row per configuration"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADERS)
+    configurations = configurations.select_related('device_type')
+    for config in configurations.iterator(chunk_size=DEVICE_CONFIG_SETTINGS['EXPORT_CHUNK_SIZE']):
+        yield writer.writerow([
+            config.device_id,
+            config.name,
+            config.device_type.name if config.device_type else '',
+            config.status,
+            config.version,
+            config.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        ])
+
+
+def _xml_element(tag: str, value: Any) -> ElementTree.Element:
+    """
+    Build an element from a JSON-like value.
+
+    Dict keys that are not valid element names (config_data keys are
+    arbitrary) become <entry key="..."> elements; list items become <item>.
+    Characters XML cannot represent are dropped from keys and text.
+    """
+    if XML_NAME.match(tag) and not tag.lower().startswith('xml'):
+        element = ElementTree.Element(tag)
+    else:
+        element = ElementTree.Element('entry', key=XML_ILLEGAL.sub('', tag))
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            element.append(_xml_element(str(key), item))
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            element.append(_xml_element('item', item))
+    elif isinstance(value, bool):
+        element.text = 'true' if value else 'false'
+    elif value is not None:
+        element.text = XML_ILLEGAL.sub('', str(value))
+    return element
+
+
+def stream_xml(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Render records as <configuration> elements of one document"""
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<device_configurations>'
+    for record in records:
+        yield ElementTree.tostring(_xml_element('configuration', record), encoding='unicode')
+    yield '</device_configurations>\n'
+
+
+def _batches(content: Iterable[str], size: int) -> Iterator[str]:
+    """Join the pieces of content into strings of up to size pieces"""
+    batch = []
+    for piece in content:
+        batch.append(piece)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+async def aiterate(content: Iterable[str]) -> AsyncIterator[str]:
+    """
+    Drive a blocking content iterator from the event loop.
+
+    Each batch is produced in the thread-sensitive executor, where the
+    iterator's database cursor lives, while the loop stays free to send
+    the previous batch.
+    """
+    batches = _batches(content, DEVICE_CONFIG_SETTINGS['EXPORT_CHUNK_SIZE'])
+    next_batch = sync_to_async(lambda: next(batches, None))
+    while (batch := await next_batch()) is not None:
+        yield batch
+
+
+def streaming_export(
+    configurations: QuerySet,
+    export_format: str,
+    include_history: bool = False,
+    include_sync_logs: bool = False,
+    asynchronous: bool = False
+) -> StreamingHttpResponse:
+    """
+    Stream configurations as an attachment in one of SUPPORTED_EXPORT_FORMATS.
+
+    Args:
+        configurations: Configurations to export
+        export_format: 'json', 'csv' or 'xml'
+        include_history: Add each configuration's history (json and xml)
+        include_sync_logs: Add each configuration's sync logs (json and xml)
+        asynchronous: Stream with an async iterator, for requests served over ASGI
+    """
+    if export_format == 'csv':
+        content = stream_csv(configurations)
+    else:
+        records = export_records(configurations, include_history, include_sync_logs)
+        content = stream_json(records) if export_format == 'json' else stream_xml(records)
+    if asynchronous:
+        content = aiterate(content)
+
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="device_configurations.{export_format}"'
+    return response
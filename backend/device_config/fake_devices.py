@@ -0,0 +1,174 @@
+"""
+Local fake device server for developing and testing device syncs.
+
+One asyncio server stands in for any number of devices: a POST to
+/devices/<device_id>/config is answered as that device would, after a
+configurable latency, with configurable rates of errors and hangs. Run
+
+    python -m device_config.fake_devices --port 9100 --latency-ms 50 --failure-rate 0.05
+
+and point DEVICE_CONFIG_DEVICE_SYNC_URL_TEMPLATE at the printed template.
+
+Django is not needed.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+from typing import Dict, Any, Optional, List
+
+CONFIG_PATH = re.compile(r'^/devices/(?P<device_id>[a-zA-Z0-9_-]+)/config$')
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 503: 'Service Unavailable'}
+
+
+class FakeDeviceServer:
+    """HTTP server answering configuration pushes for fake devices"""
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 9100,
+        latency_ms: float = 20,
+        failure_rate: float = 0.0,
+        hang_rate: float = 0.0,
+        fail_first: int = 0,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free one)
+            latency_ms: Mean response time; actual times vary by +/-50%
+            failure_rate: Fraction of pushes answered with HTTP 503
+            hang_rate: Fraction of pushes that are never answered
+            fail_first: Pushes answered with HTTP 503 before each device
+                accepts one, e.g. to exercise retries deterministically
+            seed: Seed for the random latencies and failures
+        """
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.fail_first = fail_first
+        self.attempts = {}
+        self._handlers = set()
+        self.random = random.Random(seed)
+        self.configs = {}
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._server = None
+
+    @property
+    def url_template(self) -> str:
+        """DEVICE_SYNC_URL_TEMPLATE value pointing at this server"""
+        return f'http://{self.host}:{self.port}/devices/{{device_id}}/config'
+
+    async def start(self) -> 'FakeDeviceServer':
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Hung requests would otherwise outlive the server
+            for handler in list(self._handlers):
+                handler.cancel()
+            await self._server.wait_closed()
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, data: Dict[str, Any]) -> None:
+        body = json.dumps(data).encode()
+        writer.write(
+            f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            parts = request_line.decode('latin-1').split()
+            match = CONFIG_PATH.match(parts[1]) if len(parts) == 3 and parts[0] == 'POST' else None
+            if match is None:
+                await self._respond(writer, 404, {'error': 'not found'})
+                return
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                await self._respond(writer, 400, {'error': 'invalid JSON'})
+                return
+
+            device_id = match.group('device_id')
+            self.attempts[device_id] = self.attempts.get(device_id, 0) + 1
+            roll = self.random.random()
+            if roll < self.hang_rate:
+                # Never answer; the client's timeout has to deal with it
+                await asyncio.sleep(3600)
+                return
+            await asyncio.sleep(self.latency_ms * self.random.uniform(0.5, 1.5) / 1000)
+            if roll < self.hang_rate + self.failure_rate or self.attempts[device_id] <= self.fail_first:
+                await self._respond(writer, 503, {'error': 'device busy'})
+                return
+
+            self.configs[device_id] = payload.get('config_data', {})
+            await self._respond(writer, 200, {
+                'status': 'synced',
+                'device_id': device_id,
+                'applied_version': payload.get('version')
+            })
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.in_flight -= 1
+            self._handlers.discard(handler)
+            writer.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve fake devices for configuration syncs")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--fail-first', type=int, default=0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    server = FakeDeviceServer(args.host, args.port, args.latency_ms, args.failure_rate, args.hang_rate,
+                              args.fail_first, args.seed)
+    print(f"Fake devices at {server.url_template}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
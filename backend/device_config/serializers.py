@@ -86,6 +86,21 @@ class DeviceConfigurationSerializer(serializers.ModelSerializer):
         return value
 
 
+class DeviceConfigurationExportRowSerializer(DeviceConfigurationSerializer):
+    """
+    DeviceConfigurationSerializer for exports, serializing each device type once.
+    
+    The context must hold a 'device_types' dict shared by all rows of an export.
+    """
+    device_type = serializers.SerializerMethodField()
+
+    def get_device_type(self, obj):
+        device_types = self.context['device_types']
+        if obj.device_type_id not in device_types:
+            device_types[obj.device_type_id] = DeviceTypeSerializer(obj.device_type).data
+        return device_types[obj.device_type_id]
+
+
 class DeviceConfigurationDetailSerializer(DeviceConfigurationSerializer):
     """Detailed serializer for DeviceConfiguration with full parameter validation"""
     parameters = DeviceParameterSerializer(source='device_type.parameters', many=True, read_only=True)
@@ -165,6 +180,15 @@ class DeviceConfigurationBulkUpdateSerializer(serializers.Serializer):
         return value
 
 
+class DeviceConfigurationBulkSyncSerializer(serializers.Serializer):
+    """Serializer for syncing many device configurations at once"""
+    device_ids = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+        help_text="List of device IDs to sync (defaults to all enabled devices)"
+    )
+
+
 class DeviceConfigurationTemplateSerializer(serializers.Serializer):
     """Serializer for creating device configuration templates"""
     template_name = serializers.CharField(max_length=200)
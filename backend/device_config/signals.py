@@ -0,0 +1,33 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .cache import invalidate, invalidate_configurations
+from .models import DeviceType, DeviceParameter, DeviceConfiguration
+
+
+def _invalidate_device_type(device_type_id):
+    """Drop everything derived from a device type: the type list, its parameters and its configurations"""
+    invalidate('DEVICE_TYPE_LIST')
+    invalidate('DEVICE_PARAMETERS', device_type_id=device_type_id)
+    invalidate_configurations(
+        DeviceConfiguration.objects.filter(device_type_id=device_type_id).only('pk', 'device_id')
+    )
+
+
+@receiver([post_save, post_delete], sender=DeviceType)
+@receiver([post_save, post_delete], sender=DeviceParameter)
+def invalidate_device_type(sender, instance, **kwargs):
+    """Drop cached device type data when a type or one of its parameters changes"""
+    device_type_id = instance.pk if sender is DeviceType else instance.device_type_id
+    # Invalidate once the change is committed, so a reload sees it
+    transaction.on_commit(lambda: _invalidate_device_type(device_type_id))
+
+
+@receiver([post_save, post_delete], sender=DeviceConfiguration)
+def invalidate_configuration(sender, instance, **kwargs):
+    """Drop a configuration's cached entries, and the type list whose counts include it"""
+    def run():
+        invalidate_configurations([instance])
+        invalidate('DEVICE_TYPE_LIST')
+
+    transaction.on_commit(run)
@@ -0,0 +1,334 @@
+"""
+Asynchronous device synchronisation engine.
+
+Configurations are pushed to devices concurrently on one asyncio event
+loop. At most MAX_CONCURRENT_SYNCS pushes are in flight, each attempt is
+bounded by SYNC_TIMEOUT, and failed attempts are retried up to
+MAX_SYNC_RETRIES times with exponential backoff. DeviceSyncLog rows are
+written in batches of SYNC_BATCH_SIZE as results come in, so a fleet-wide
+sync costs a handful of queries rather than several per device.
+
+Each device is reached at DEVICE_SYNC_URL_TEMPLATE formatted with its
+device_id, by an HTTP POST of {"device_id", "version", "config_data"}.
+The template is required and only ever comes from the server's settings,
+never from user-editable configuration data. For development and tests,
+device_config.fake_devices serves any number of fake devices locally.
+"""
+
+import asyncio
+import ipaddress
+import json
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple, Callable, Awaitable
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .cache import invalidate_configurations
+from .config import DEVICE_CONFIG_SETTINGS, LOGGING_CONFIG, PERFORMANCE_SETTINGS, get_setting
+from .models import DeviceConfiguration, DeviceSyncLog
+
+logger = logging.getLogger(LOGGING_CONFIG['LOGGER_NAME'])
+
+# Fields loaded for each device that is synced
+SYNC_FIELDS = ['id', 'device_id', 'config_data', 'version']
+
+
+class DeviceSyncError(Exception):
+    """A device rejected or failed a configuration push"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+async def post_json(url: str, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """
+    POST a JSON payload with a minimal HTTP/1.1 client on asyncio streams.
+
+    The connection is closed after each request; responses must carry a
+    Content-Length or end at connection close. Chunked responses are not
+    supported and, like a 2xx body that is not a JSON object, raise
+    DeviceSyncError rather than being recorded as a successful sync.
+
+    Args:
+        url: http:// or https:// URL of the device endpoint
+        payload: JSON-serialisable request body
+
+    Returns:
+        (HTTP status, decoded JSON body or {})
+    """
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    body = json.dumps(payload).encode()
+    path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, parts.port or (443 if secure else 80), ssl=secure or None
+    )
+    try:
+        writer.write(
+            f'POST {path} HTTP/1.1\r\n'
+            f'Host: {parts.netloc}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+
+        status_line = await reader.readline()
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            raise DeviceSyncError(f'Invalid HTTP response: {status_line[:100]!r}') from None
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', 'identity').lower() != 'identity':
+            raise DeviceSyncError(
+                f"Unsupported Transfer-Encoding: {headers['transfer-encoding']} (HTTP {status})", retryable=False
+            )
+        if 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data = await reader.read()
+    finally:
+        writer.close()
+
+    try:
+        decoded = json.loads(data) if data else {}
+    except ValueError:
+        decoded = None
+    if isinstance(decoded, dict):
+        return status, decoded
+    if 200 <= status < 300:
+        raise DeviceSyncError(f'Device returned a body that is not a JSON object (HTTP {status})')
+    return status, {'body': data[:1000].decode('utf-8', 'replace')}
+
+
+def device_sync_url(device_config: DeviceConfiguration, url_template: str) -> str:
+    """Endpoint a device receives its configuration at"""
+    return url_template.format(device_id=device_config.device_id)
+
+
+def sync_url_template(url_template: Optional[str] = None) -> str:
+    """
+    The validated DEVICE_SYNC_URL_TEMPLATE.
+
+    Raises:
+        ImproperlyConfigured: When it is unset or not an http(s) URL with a
+            {device_id} field
+    """
+    url_template = url_template or get_setting('DEVICE_SYNC_URL_TEMPLATE')
+    if not url_template:
+        raise ImproperlyConfigured(
+            "DEVICE_SYNC_URL_TEMPLATE is not set; set DEVICE_CONFIG_DEVICE_SYNC_URL_TEMPLATE "
+            "(e.g. https://devices.example.com/{device_id}/config) to sync devices"
+        )
+    try:
+        url = urlsplit(url_template.format(device_id='device'))
+    except (KeyError, IndexError, ValueError):
+        url = None
+    if url is None or '{device_id}' not in url_template or url.scheme not in ('http', 'https') or not url.hostname:
+        raise ImproperlyConfigured(
+            f"DEVICE_SYNC_URL_TEMPLATE must be an http(s) URL with a {{device_id}} field, got {url_template!r}"
+        )
+    return url_template
+
+
+def _device_ip(url: str) -> Optional[str]:
+    """IP address of an endpoint URL, or None for host names"""
+    try:
+        return str(ipaddress.ip_address(urlsplit(url).hostname))
+    except ValueError:
+        return None
+
+
+class SyncEngine:
+    """Pushes device configurations concurrently and records DeviceSyncLog rows"""
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff: float = 0.5,
+        batch_size: Optional[int] = None,
+        transport: Callable[[str, Dict[str, Any]], Awaitable[Tuple[int, Dict[str, Any]]]] = post_json,
+        url_template: Optional[str] = None
+    ):
+        """
+        Args:
+            max_concurrency: Pushes in flight at once (MAX_CONCURRENT_SYNCS)
+            timeout: Seconds allowed per attempt (SYNC_TIMEOUT)
+            max_retries: Retries after a failed attempt (MAX_SYNC_RETRIES)
+            backoff: Seconds before the first retry; doubled for every retry
+            batch_size: Sync logs written per query (SYNC_BATCH_SIZE)
+            transport: Coroutine function sending a payload to a URL
+            url_template: Device endpoint (DEVICE_SYNC_URL_TEMPLATE)
+
+        Raises:
+            ImproperlyConfigured: When no valid URL template is configured
+        """
+        self.max_concurrency = max_concurrency or PERFORMANCE_SETTINGS['MAX_CONCURRENT_SYNCS']
+        self.timeout = timeout or PERFORMANCE_SETTINGS['SYNC_TIMEOUT']
+        self.max_retries = DEVICE_CONFIG_SETTINGS['MAX_SYNC_RETRIES'] if max_retries is None else max_retries
+        self.backoff = backoff
+        self.batch_size = batch_size or DEVICE_CONFIG_SETTINGS['SYNC_BATCH_SIZE']
+        self.transport = transport
+        self.url_template = sync_url_template(url_template)
+
+    async def _attempt(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        status_code, data = await asyncio.wait_for(self.transport(url, payload), self.timeout)
+        if status_code >= 500:
+            raise DeviceSyncError(f'Device returned HTTP {status_code}')
+        if status_code >= 400:
+            raise DeviceSyncError(f'Device rejected the configuration (HTTP {status_code})', retryable=False)
+        return data
+
+    async def push(self, device_config: DeviceConfiguration, semaphore: asyncio.Semaphore) -> DeviceSyncLog:
+        """
+        Push one configuration, retrying with backoff.
+
+        The semaphore is held only while an attempt is in flight, not
+        while waiting to retry.
+
+        Returns:
+            Unsaved DeviceSyncLog describing the outcome
+        """
+        url = device_sync_url(device_config, self.url_template)
+        payload = {
+            'device_id': device_config.device_id,
+            'version': device_config.version,
+            'config_data': device_config.config_data
+        }
+        sync_started = started = None
+        sync_status, data, error = 'failed', {}, ''
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                # Exponential backoff with jitter, so a fleet does not retry in lockstep
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            try:
+                async with semaphore:
+                    if started is None:
+                        # Timed from the first attempt, not from queueing for the semaphore
+                        sync_started, started = timezone.now(), time.monotonic()
+                    data = await self._attempt(url, payload)
+                sync_status, error = 'success', ''
+                break
+            except asyncio.TimeoutError:
+                sync_status, error = 'timeout', f'No response within {self.timeout}s'
+            except DeviceSyncError as e:
+                sync_status, error = 'failed', str(e)
+                if not e.retryable:
+                    break
+            except (OSError, asyncio.IncompleteReadError) as e:
+                sync_status, error = 'failed', f'{type(e).__name__}: {e}'
+            except Exception as e:
+                # e.g. a malformed response; fails this device, not the whole sync
+                logger.warning("Sync of device %s failed unexpectedly", device_config.device_id, exc_info=True)
+                sync_status, error = 'failed', f'{type(e).__name__}: {e}'
+                break
+
+        if error:
+            error = f'{error} (after {attempt + 1} attempt{"s" if attempt else ""})'
+        return DeviceSyncLog(
+            device_config=device_config,
+            sync_status=sync_status,
+            sync_started=sync_started,
+            sync_completed=timezone.now(),
+            duration_ms=int((time.monotonic() - started) * 1000),
+            data_sent=payload,
+            data_received=data if isinstance(data, dict) else {'response': data},
+            error_message=error,
+            device_ip=_device_ip(url),
+            device_version=device_config.version
+        )
+
+    def _save(self, logs: List[DeviceSyncLog]) -> None:
+        """Write a batch of sync logs and stamp each synced device with its own sync time"""
+        synced = []
+        for log in logs:
+            if log.sync_status == 'success':
+                # sync_started is overwritten on save (auto_now_add)
+                log.device_config.last_sync = log.sync_completed
+                synced.append(log.device_config)
+        with transaction.atomic():
+            DeviceSyncLog.objects.bulk_create(logs)
+            DeviceConfiguration.objects.bulk_update(synced, ['last_sync'])
+        # bulk_update() sends no post_save signals
+        invalidate_configurations(synced)
+
+    async def sync(self, device_configs: List[DeviceConfiguration]) -> Dict[str, Any]:
+        """
+        Push configurations to all devices concurrently.
+
+        Args:
+            device_configs: Devices to sync (SYNC_FIELDS must be loaded)
+
+        Returns:
+            Counts per sync status and the total duration in ms
+        """
+        semaphore = asyncio.BoundedSemaphore(self.max_concurrency)
+        save = sync_to_async(self._save)
+        started = time.monotonic()
+        summary = {'total': len(device_configs), 'success': 0, 'failed': 0, 'timeout': 0}
+
+        pending = []
+        for result in asyncio.as_completed([self.push(device_config, semaphore) for device_config in device_configs]):
+            sync_log = await result
+            summary[sync_log.sync_status] += 1
+            pending.append(sync_log)
+            if len(pending) >= self.batch_size:
+                await save(pending)
+                pending = []
+        if pending:
+            await save(pending)
+
+        summary['duration_ms'] = int((time.monotonic() - started) * 1000)
+        logger.info(
+            "Synced %d devices in %dms: %d succeeded, %d failed, %d timed out",
+            summary['total'], summary['duration_ms'], summary['success'], summary['failed'], summary['timeout']
+        )
+        return summary
+
+    def run(self, device_configs: List[DeviceConfiguration]) -> Dict[str, Any]:
+        """Run sync() from synchronous code such as a view"""
+        return async_to_sync(self.sync)(device_configs)
+
+    def sync_one(self, device_config: DeviceConfiguration) -> DeviceSyncLog:
+        """Push one configuration and return its saved sync log"""
+        async def push():
+            return await self.push(device_config, asyncio.BoundedSemaphore(1))
+
+        sync_log = async_to_sync(push)()
+        self._save([sync_log])
+        return sync_log
+
+
+def start_background_sync(engine: SyncEngine, device_configs: List[DeviceConfiguration]) -> threading.Thread:
+    """Sync devices in a daemon thread, so the request can return immediately"""
+    def run():
+        try:
+            engine.run(device_configs)
+        except Exception:
+            logger.exception("Background device sync failed")
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=run, name='device-sync', daemon=True)
+    thread.start()
+    return thread
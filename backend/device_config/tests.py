@@ -0,0 +1,473 @@
+import asyncio
+import json
+import time
+from unittest import mock
+from xml.etree import ElementTree
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .activity import activity_stream_application
+from .cache import get_or_compute, invalidate
+from .fake_devices import FakeDeviceServer
+from .models import DeviceType, DeviceParameter, DeviceConfiguration, DeviceConfigurationHistory, DeviceSyncLog
+from .serializers import DeviceConfigurationSerializer
+from .sync_engine import SYNC_FIELDS, SyncEngine, post_json
+from .views import DEVICE_CONFIG_SETTINGS
+
+User = get_user_model()
+
+
+async def open_stream(device_id, headers=(), query_string=b''):
+    """Connect to the activity stream and return the messages sent before it closed"""
+    sent = []
+    messages = [{'type': 'websocket.connect'}]
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'websocket.disconnect', 'code': 1000}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'websocket',
+        'path': f'/ws/devices/{device_id}/activity/',
+        'headers': list(headers),
+        'query_string': query_string,
+    }
+    await activity_stream_application(scope, receive, send)
+    return sent
+
+
+def close_code(sent):
+    return sent[-1]['code'] if sent and sent[-1]['type'] == 'websocket.close' else None
+
+
+class ActivityStreamAuthTests(TransactionTestCase):
+    def setUp(self):
+        self.owner = User.objects.create(email='owner@example.com', first_name='O', last_name='W')
+        self.other = User.objects.create(email='other@example.com', first_name='O', last_name='T')
+        device_type = DeviceType.objects.create(name='wrist')
+        DeviceConfiguration.objects.create(
+            device_type=device_type, name='watch', device_id='dev-1', config_data={}, assigned_to=self.owner
+        )
+
+    async def test_unauthenticated_connection_is_closed(self):
+        self.assertEqual(close_code(await open_stream('dev-1')), 4401)
+        self.assertEqual(close_code(await open_stream('dev-1', [(b'authorization', b'Bearer bogus')])), 4401)
+
+    async def test_other_users_device_is_forbidden(self):
+        token = str(AccessToken.for_user(self.other))
+        sent = await open_stream('dev-1', [(b'authorization', f'Bearer {token}'.encode())])
+        self.assertEqual(close_code(sent), 4403)
+
+    async def test_unknown_device_is_not_found(self):
+        sent = await open_stream('dev-unknown', query_string=f'token={AccessToken.for_user(self.owner)}'.encode())
+        self.assertEqual(close_code(sent), 4404)
+
+    async def test_query_string_takes_access_tokens_only(self):
+        token = await sync_to_async(Token.objects.create)(user=self.owner)
+        for query_token in (token.key, RefreshToken.for_user(self.owner)):
+            sent = await open_stream('dev-1', query_string=f'token={query_token}'.encode())
+            self.assertEqual(close_code(sent), 4401)
+
+    async def test_owner_is_admitted(self):
+        token = await sync_to_async(Token.objects.create)(user=self.owner)
+        access_token = AccessToken.for_user(self.owner)
+        for headers, query_string in (
+            ([(b'authorization', f'Token {token.key}'.encode())], b''),
+            ([(b'authorization', f'token {token.key}'.encode())], b''),
+            ([(b'authorization', f'bearer {access_token}'.encode())], b''),
+            ([], f'token={access_token}'.encode()),
+        ):
+            sent = await open_stream('dev-1', headers, query_string)
+            # Past authentication; no activity model is deployed in tests
+            self.assertEqual(close_code(sent), 4503)
+            self.assertEqual(json.loads(sent[-2]['text'])['error'], 'Activity model is not deployed')
+
+
+class ActivityPredictionTests(TestCase):
+    url = '/device-config/api/activity/predict/'
+
+    def setUp(self):
+        batcher = mock.Mock()
+        batcher.classifier.seq_length, batcher.classifier.n_channels = 4, 2
+        patcher = mock.patch('device_config.views.get_activity_batcher', return_value=batcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(email='device@example.com', first_name='D', last_name='V'))
+
+    def test_malformed_bodies_are_bad_requests(self):
+        for body in ([[[0.0, 0.0]] * 4], {'windows': [[0.0, 0.0]] * 4}, {'windows': 'walk'}, {}):
+            with self.subTest(body=body):
+                response = self.client.post(self.url, body, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('4 x 2', response.data['error'])
+
+
+async def raw_device(response):
+    """A device endpoint that answers every request with the given raw HTTP response"""
+    async def handle(reader, writer):
+        headers = await reader.readuntil(b'\r\n\r\n')
+        length = int(next(
+            line.split(b':')[1] for line in headers.split(b'\r\n') if line.lower().startswith(b'content-length')
+        ))
+        await reader.readexactly(length)
+        writer.write(response)
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+class SyncEngineTests(TransactionTestCase):
+    def setUp(self):
+        device_type = DeviceType.objects.create(name='wrist')
+        DeviceConfiguration.objects.bulk_create([
+            DeviceConfiguration(
+                device_type=device_type, name=f'watch {i}', device_id=f'dev-{i}',
+                config_data={'rate': i, 'sync_url': 'http://169.254.169.254/latest/meta-data/'}
+            )
+            for i in range(3)
+        ])
+
+    async def sync(self, server, url_template=None, **kwargs):
+        device_configs = await sync_to_async(list)(DeviceConfiguration.objects.only(*SYNC_FIELDS).order_by('device_id'))
+        engine = SyncEngine(url_template=url_template or server.url_template, **kwargs)
+        summary = await engine.sync(device_configs)
+        logs = await sync_to_async(list)(DeviceSyncLog.objects.select_related('device_config').order_by('device_config__device_id'))
+        return summary, logs
+
+    async def test_push_success(self):
+        server = await FakeDeviceServer(port=0, latency_ms=1).start()
+        try:
+            summary, logs = await self.sync(server)
+        finally:
+            await server.stop()
+
+        self.assertEqual((summary['total'], summary['success']), (3, 3))
+        # Pushed to the configured endpoint, never to config_data['sync_url']
+        self.assertEqual(server.configs['dev-2']['rate'], 2)
+        for log in logs:
+            self.assertEqual(log.sync_status, 'success')
+            self.assertEqual(log.data_received['applied_version'], '1.0.0')
+            # Each device is stamped with its own sync time
+            self.assertEqual(log.device_config.last_sync, log.sync_completed)
+
+    async def test_retries_with_backoff(self):
+        server = await FakeDeviceServer(port=0, latency_ms=1, fail_first=2).start()
+        try:
+            started = time.monotonic()
+            summary, logs = await self.sync(server, max_retries=2, backoff=0.05)
+            elapsed = time.monotonic() - started
+        finally:
+            await server.stop()
+
+        self.assertEqual(summary['success'], 3)
+        self.assertEqual(server.attempts, {'dev-0': 3, 'dev-1': 3, 'dev-2': 3})
+        # Jittered backoff of at least 0.5 * (0.05 + 0.1) seconds
+        self.assertGreaterEqual(elapsed, 0.075)
+
+    async def test_retries_exhausted(self):
+        server = await FakeDeviceServer(port=0, latency_ms=1, fail_first=10).start()
+        try:
+            summary, logs = await self.sync(server, max_retries=1, backoff=0.01)
+        finally:
+            await server.stop()
+
+        self.assertEqual(summary['failed'], 3)
+        self.assertIn('HTTP 503 (after 2 attempts)', logs[0].error_message)
+        self.assertIsNone(logs[0].device_config.last_sync)
+
+    async def test_timeout(self):
+        server = await FakeDeviceServer(port=0, hang_rate=1.0).start()
+        try:
+            summary, logs = await self.sync(server, timeout=0.1, max_retries=0)
+        finally:
+            await server.stop()
+
+        self.assertEqual(summary['timeout'], 3)
+        self.assertEqual({log.sync_status for log in logs}, {'timeout'})
+
+    async def test_non_retryable_failure(self):
+        server = await FakeDeviceServer(port=0, latency_ms=1).start()
+        try:
+            # The fake devices answer unknown paths with 404
+            url_template = f'http://{server.host}:{server.port}/unknown/{{device_id}}'
+            summary, logs = await self.sync(server, url_template=url_template, max_retries=3, backoff=0.01)
+        finally:
+            await server.stop()
+
+        self.assertEqual(summary['failed'], 3)
+        self.assertEqual(server.requests, 3)
+        self.assertTrue(logs[0].error_message.endswith('(HTTP 404) (after 1 attempt)'))
+
+    async def test_unexpected_error_fails_only_that_device(self):
+        async def transport(url, payload):
+            if payload['device_id'] == 'dev-1':
+                raise ValueError('invalid literal for int(): Content-Length')
+            return 200, {'status': 'synced'}
+
+        summary, logs = await self.sync(None, url_template='http://devices.test/{device_id}', transport=transport)
+
+        self.assertEqual((summary['success'], summary['failed']), (2, 1))
+        self.assertEqual([log.sync_status for log in logs], ['success', 'failed', 'success'])
+        self.assertIn('ValueError', logs[1].error_message)
+
+    async def test_unreadable_success_bodies_fail_the_attempt(self):
+        responses = {
+            'chunked': b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n11\r\n{"status": "ok"}\n\r\n0\r\n\r\n',
+            'not JSON': b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok',
+            'not an object': b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n[]',
+        }
+        for name, response in responses.items():
+            with self.subTest(name):
+                server = await raw_device(response)
+                port = server.sockets[0].getsockname()[1]
+                try:
+                    summary, logs = await self.sync(
+                        None, url_template=f'http://127.0.0.1:{port}/{{device_id}}', max_retries=0, transport=post_json
+                    )
+                finally:
+                    server.close()
+                    await server.wait_closed()
+                self.assertEqual(summary['failed'], 3)
+                self.assertIn('HTTP 200', logs[0].error_message)
+                await sync_to_async(DeviceSyncLog.objects.all().delete)()
+
+        server = await raw_device(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 4\r\n\r\nbusy')
+        port = server.sockets[0].getsockname()[1]
+        try:
+            self.assertEqual(await post_json(f'http://127.0.0.1:{port}/', {}), (503, {'body': 'busy'}))
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    @override_settings(DEVICE_CONFIG_DEVICE_SYNC_URL_TEMPLATE=None)
+    def test_url_template_is_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SyncEngine()
+        for url_template in ('file:///tmp/{device_id}', 'http://devices.test/config', 'http://devices.test/{id}'):
+            with self.assertRaises(ImproperlyConfigured):
+                SyncEngine(url_template=url_template)
+
+
+class CacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='staff@example.com', first_name='S', last_name='T', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.device_type = DeviceType.objects.create(name='wrist')
+        self.device_config = DeviceConfiguration.objects.create(
+            device_type=self.device_type, name='watch', device_id='dev-1', config_data={'rate': 50}
+        )
+
+    def test_value_computed_across_an_invalidation_is_not_stored(self):
+        def compute_stale():
+            # The rows change, and the key is invalidated, while this computes
+            invalidate('DEVICE_TYPE_LIST')
+            return 'stale'
+
+        self.assertEqual(get_or_compute('DEVICE_TYPE_LIST', compute_stale), 'stale')
+        self.assertEqual(get_or_compute('DEVICE_TYPE_LIST', lambda: 'fresh'), 'fresh')
+        self.assertEqual(get_or_compute('DEVICE_TYPE_LIST', lambda: 'recomputed'), 'fresh')
+
+    def test_cached_detail_still_applies_queryset_filtering(self):
+        url = f'/device-config/api/configurations/{self.device_config.pk}/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url, {'status': 'maintenance'}).status_code, 404)
+
+    def test_cached_detail_has_current_device_type_counts(self):
+        url = f'/device-config/api/configurations/{self.device_config.pk}/'
+        self.assertEqual(self.client.get(url).data['device_type']['configurations_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DeviceConfiguration.objects.create(device_type=self.device_type, name='band', device_id='dev-2')
+        self.assertEqual(self.client.get(url).data['device_type']['configurations_count'], 2)
+
+
+class PullTests(TestCase):
+    url = '/device-config/api/configurations/pull/dev-1/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.device_user = User.objects.create(email='device@example.com', first_name='D', last_name='V')
+        self.client.force_authenticate(self.device_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device_config = DeviceConfiguration.objects.create(
+                device_type=DeviceType.objects.create(name='wrist'), name='watch', device_id='dev-1',
+                config_data={'rate': 50, 'mode': 'walk'}, assigned_to=self.device_user
+            )
+            self.record('created')
+
+    def record(self, action):
+        """Write the history entry the API writes with every change"""
+        DeviceConfigurationHistory.objects.create(
+            device_config=self.device_config, action=action,
+            new_values=DeviceConfigurationSerializer(self.device_config).data
+        )
+
+    def test_unchanged_configuration_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['config_data'], {'rate': 50, 'mode': 'walk'})
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+    def test_changed_configuration_returns_a_delta(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device_config.config_data = {'rate': 100}
+            self.device_config.save()
+            self.record('updated')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertTrue(response.data['delta'])
+        self.assertEqual((response.data['changed'], response.data['removed']), ({'rate': 100}, ['mode']))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_unknown_device_is_not_found(self):
+        self.assertEqual(self.client.get('/device-config/api/configurations/pull/dev-2/').status_code, 404)
+
+    def test_only_staff_creator_and_assignee_may_pull(self):
+        etag = self.client.get(self.url)['ETag']
+        other = User.objects.create(email='other@example.com', first_name='O', last_name='T')
+        self.client.force_authenticate(other)
+        # Neither the configuration nor whether the device holds the current one is revealed
+        for headers in ({}, {'HTTP_IF_NONE_MATCH': etag}):
+            response = self.client.get(self.url, **headers)
+            self.assertEqual(response.status_code, 403)
+            self.assertNotIn('ETag', response)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device_config.created_by = other
+            self.device_config.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.client.force_authenticate(User.objects.create(
+            email='staff@example.com', first_name='S', last_name='T', is_staff=True
+        ))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+@mock.patch.dict(DEVICE_CONFIG_SETTINGS, SYNC_BATCH_SIZE=2)
+class BulkUpdateTests(TestCase):
+    url = '/device-config/api/configurations/bulk_update/'
+
+    def setUp(self):
+        self.user = User.objects.create(email='staff@example.com', first_name='S', last_name='T')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.wrist = DeviceType.objects.create(name='wrist')
+        self.belt = DeviceType.objects.create(name='belt')
+        DeviceParameter.objects.create(
+            device_type=self.wrist, name='rate', display_name='Rate', parameter_type='integer', max_value=100
+        )
+        self.device_ids = []
+        for i in range(5):
+            DeviceConfiguration.objects.create(
+                device_type=self.wrist if i < 3 else self.belt, name=f'watch {i}', device_id=f'dev-{i}',
+                config_data={'rate': 50, 'mode': 'walk'}
+            )
+            self.device_ids.append(f'dev-{i}')
+
+    def bulk_update(self, config_updates, **params):
+        return self.client.post(
+            self.url, {'device_ids': self.device_ids, 'config_updates': config_updates, **params}, format='json'
+        )
+
+    def test_chunks_merge_updates_and_record_history(self):
+        # Id check, targets, parameters, then savepoint, update, history and
+        # release for each of the three chunks
+        with self.assertNumQueries(3 + 3 * 4):
+            response = self.bulk_update({'rate': 80, 'alert': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['updated_count'], response.data['errors']), (5, []))
+
+        for device_config in DeviceConfiguration.objects.all():
+            self.assertEqual(device_config.config_data, {'rate': 80, 'mode': 'walk', 'alert': True})
+            history = device_config.history.get()
+            self.assertEqual((history.action, history.changed_by), ('updated', self.user))
+            self.assertEqual(history.old_values, {'rate': 50, 'alert': None})
+            self.assertEqual(history.new_values['config_data'], device_config.config_data)
+
+    def test_invalid_values_skip_devices_unless_forced(self):
+        response = self.bulk_update({'rate': 500})
+        self.assertEqual(response.data['updated_count'], 2)
+        self.assertEqual(response.data['errors'], [
+            f"Device dev-{i}: Parameter 'Rate': Value must be at most 100.0" for i in range(3)
+        ])
+        rates = dict(DeviceConfiguration.objects.values_list('device_id', 'config_data__rate'))
+        self.assertEqual(rates, {'dev-0': 50, 'dev-1': 50, 'dev-2': 50, 'dev-3': 500, 'dev-4': 500})
+
+        response = self.bulk_update({'rate': 500}, force_update=True)
+        self.assertEqual((response.data['updated_count'], response.data['errors']), (5, []))
+        self.assertEqual(DeviceConfiguration.objects.get(device_id='dev-0').config_data['rate'], 500)
+
+
+class ExportTests(TestCase):
+    url = '/device-config/api/configurations/export/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(email='staff@example.com', first_name='S', last_name='T'))
+        device_type = DeviceType.objects.create(name='wrist')
+        for i in range(3):
+            DeviceConfiguration.objects.create(
+                device_type=device_type, name=f'watch {i}', device_id=f'dev-{i}',
+                config_data={'label': f'bell\x07 {i}', 'bad key\x00': i, 'modes': ['walk', 'run']}
+            )
+
+    def export(self, export_format):
+        response = self.client.post(self.url, {'format': export_format}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Disposition'], f'attachment; filename="device_configurations.{export_format}"'
+        )
+        return b''.join(response.streaming_content).decode()
+
+    def test_json(self):
+        # Newest first, the model's default ordering
+        records = json.loads(self.export('json'))
+        self.assertEqual([record['device_id'] for record in records], ['dev-2', 'dev-1', 'dev-0'])
+        self.assertEqual(records[0]['config_data']['label'], 'bell\x07 2')
+
+    def test_csv(self):
+        rows = self.export('csv').splitlines()
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(rows[1].startswith('dev-2,watch 2,wrist,active'))
+
+    def test_xml_drops_characters_xml_cannot_represent(self):
+        root = ElementTree.fromstring(self.export('xml'))
+        configurations = root.findall('configuration')
+        self.assertEqual(len(configurations), 3)
+        config_data = configurations[0].find('config_data')
+        self.assertEqual(config_data.find('label').text, 'bell 2')
+        self.assertEqual(config_data.find('entry').get('key'), 'bad key')
+        self.assertEqual([item.text for item in config_data.find('modes')], ['walk', 'run'])
+
+    async def test_asgi_requests_stream_asynchronously(self):
+        user = await sync_to_async(User.objects.create)(email='asgi@example.com', first_name='A', last_name='S')
+        token = await sync_to_async(Token.objects.create)(user=user)
+        response = await self.async_client.post(
+            self.url, {'format': 'json'}, content_type='application/json',
+            headers={'Authorization': f'Token {token.key}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(json.loads(content)), 3)
@@ -18,4 +18,5 @@ urlpatterns = [
     
     # Additional custom endpoints can be added here if needed
     path('api/health/', views.DeviceConfigurationViewSet.as_view({'get': 'list'}), name='health-check'),
+    path('api/activity/predict/', views.ActivityPredictionView.as_view(), name='activity-predict'),
 ]
@@ -1,13 +1,20 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django.db import transaction
 from django.utils import timezone
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import get_object_or_404
 from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
+from collections import defaultdict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import quote
 import json
-import csv
-from io import StringIO
+import numpy as np
 
 from .models import (
     DeviceType, 
@@ -24,9 +31,105 @@ from .serializers import (
     DeviceConfigurationHistorySerializer,
     DeviceSyncLogSerializer,
     DeviceConfigurationBulkUpdateSerializer,
+    DeviceConfigurationBulkSyncSerializer,
     DeviceConfigurationTemplateSerializer,
     DeviceConfigurationExportSerializer
 )
+from .config import (
+    ACTIVITY_INFERENCE_SETTINGS,
+    DEVICE_CONFIG_SETTINGS,
+    PERFORMANCE_SETTINGS,
+    get_error_message,
+    get_success_message,
+    get_supported_formats
+)
+from .activity import get_activity_batcher
+from .cache import get_or_compute, invalidate_configurations
+from .export import streaming_export
+from .sync_engine import SYNC_FIELDS, SyncEngine, start_background_sync
+
+
+def get_device_types():
+    """Serialized device types, with their counts, cached as one list"""
+    return get_or_compute(
+        'DEVICE_TYPE_LIST',
+        lambda: list(DeviceTypeSerializer(DeviceType.objects.all(), many=True).data)
+    )
+
+
+def get_device_parameters(device_type_id):
+    """Serialized parameters of a device type, cached per type"""
+    return get_or_compute(
+        'DEVICE_PARAMETERS',
+        lambda: list(DeviceParameterSerializer(
+            DeviceParameter.objects.filter(device_type_id=device_type_id), many=True
+        ).data),
+        device_type_id=device_type_id
+    )
+
+
+
+def configuration_etag(pk, version, updated_at):
+    """Strong ETag of a configuration state; changes whenever the row is saved"""
+    micros = int(updated_at.timestamp()) * 10 ** 6 + updated_at.microsecond
+    return quote_etag(f'{pk}-{micros}-{quote(version)}')
+
+
+def parse_configuration_etag(etag):
+    """(pk, updated_at) of the state an ETag was issued for, or None if it is not one of ours"""
+    try:
+        pk, micros, _ = etag.strip('"').split('-', 2)
+        seconds, micros = divmod(int(micros), 10 ** 6)
+        return int(pk), datetime.fromtimestamp(seconds, tz=dt_timezone.utc).replace(microsecond=micros)
+    except (ValueError, OverflowError):
+        return None
+
+
+def get_configuration_state(device_id):
+    """
+    ETag, pk and the users with access (creator and assignee) of a device's
+    current configuration, cached per device; None if it has none
+    """
+    def load():
+        device_config = (
+            DeviceConfiguration.objects
+            .filter(device_id=device_id, is_enabled=True)
+            .order_by('-updated_at', '-pk')
+            .only('id', 'version', 'updated_at', 'created_by_id', 'assigned_to_id')
+            .first()
+        )
+        if device_config is None:
+            return None
+        return {
+            'pk': device_config.pk,
+            'etag': configuration_etag(device_config.pk, device_config.version, device_config.updated_at),
+            'user_ids': [device_config.created_by_id, device_config.assigned_to_id]
+        }
+    
+    return get_or_compute('DEVICE_CONFIG', load, device_id=device_id)
+
+
+def get_config_snapshot(pk, updated_at):
+    """
+    config_data of a configuration as it was at updated_at, from its history.
+    
+    The state is recorded by the history entry written with it, which is the
+    first one from updated_at on. Returns None when that entry is missing,
+    e.g. after an edit that bypassed the API.
+    """
+    entry = (
+        DeviceConfigurationHistory.objects
+        .filter(device_config_id=pk, action__in=['created', 'updated'], timestamp__gte=updated_at)
+        .order_by('timestamp', 'pk')
+        .values_list('new_values', flat=True)
+        .first()
+    )
+    if not entry or 'config_data' not in entry:
+        return None
+    recorded_at = parse_datetime(entry.get('updated_at') or '')
+    if recorded_at is None or recorded_at != updated_at:
+        return None
+    return entry['config_data']
 
 
 class DeviceTypeViewSet(viewsets.ModelViewSet):
@@ -51,6 +154,17 @@ class DeviceTypeViewSet(viewsets.ModelViewSet):
         
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """List device types, served from the cache when unfiltered"""
+        if request.query_params.get('is_active') is not None or request.query_params.get('manufacturer'):
+            return super().list(request, *args, **kwargs)
+        
+        data = get_device_types()
+        page = self.paginate_queryset(data)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(data)
+
     @action(detail=True, methods=['get'])
     def configurations(self, request, pk=None):
         """Get all configurations for a specific device type"""
@@ -63,9 +177,7 @@ class DeviceTypeViewSet(viewsets.ModelViewSet):
     def parameters(self, request, pk=None):
         """Get all parameters for a specific device type"""
         device_type = self.get_object()
-        parameters = device_type.parameters.all()
-        serializer = DeviceParameterSerializer(parameters, many=True)
-        return Response(serializer.data)
+        return Response(get_device_parameters(device_type.pk))
 
 
 class DeviceParameterViewSet(viewsets.ModelViewSet):
@@ -90,6 +202,21 @@ class DeviceParameterViewSet(viewsets.ModelViewSet):
         
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """List parameters, served from the per-device-type cache when filtered by device type"""
+        device_type_id = request.query_params.get('device_type', None)
+        if not device_type_id or not device_type_id.isdigit():
+            return super().list(request, *args, **kwargs)
+        
+        data = get_device_parameters(int(device_type_id))
+        parameter_type = request.query_params.get('type', None)
+        if parameter_type:
+            data = [parameter for parameter in data if parameter['parameter_type'] == parameter_type]
+        page = self.paginate_queryset(data)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(data)
+
 
 class DeviceConfigurationViewSet(viewsets.ModelViewSet):
     """ViewSet for managing device configurations"""
@@ -103,6 +230,29 @@ class DeviceConfigurationViewSet(viewsets.ModelViewSet):
             return DeviceConfigurationDetailSerializer
         return DeviceConfigurationSerializer
     
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Retrieve a configuration, with its serialization served from the cache.
+        
+        The object is always looked up first, so queryset filtering and
+        object permissions apply to cache hits as well. The nested device
+        type is taken from the device type list cache, whose counts are
+        refreshed whenever any configuration of the type changes.
+        """
+        device_config = self.get_object()
+        data = get_or_compute(
+            'DEVICE_CONFIG_DETAIL',
+            lambda: dict(self.get_serializer(device_config).data),
+            pk=device_config.pk
+        )
+        device_type = next(
+            (device_type for device_type in get_device_types() if device_type['id'] == device_config.device_type_id),
+            None
+        )
+        if device_type is not None:
+            data['device_type'] = device_type
+        return Response(data)
+    
     def get_queryset(self):
         """Filter queryset based on query parameters"""
         queryset = DeviceConfiguration.objects.all()
@@ -180,48 +330,96 @@ class DeviceConfigurationViewSet(viewsets.ModelViewSet):
     def sync(self, request, pk=None):
         """Sync device configuration with the actual device"""
         device_config = self.get_object()
+        sync_log = SyncEngine().sync_one(device_config)
         
-        try:
-            # Simulate device sync (in real implementation, this would communicate with the device)
-            sync_started = timezone.now()
-            
-            # Create sync log entry
-            sync_log = DeviceSyncLog.objects.create(
-                device_config=device_config,
-                sync_status='success',
-                sync_started=sync_started,
-                sync_completed=timezone.now(),
-                duration_ms=100,  # Simulated duration
-                data_sent=device_config.config_data,
-                data_received={'status': 'synced', 'timestamp': timezone.now().isoformat()},
-                device_ip=request.META.get('REMOTE_ADDR'),
-                device_version=device_config.version
-            )
-            
-            # Update last sync timestamp
-            device_config.last_sync = sync_started
-            device_config.save()
-            
+        if sync_log.sync_status != 'success':
             return Response({
-                'status': 'success',
-                'message': 'Device configuration synced successfully',
+                'status': 'error',
+                'message': f'Sync failed: {sync_log.error_message}',
                 'sync_log_id': sync_log.id
-            })
-            
-        except Exception as e:
-            # Create failed sync log entry
-            DeviceSyncLog.objects.create(
-                device_config=device_config,
-                sync_status='failed',
-                sync_started=timezone.now(),
-                error_message=str(e),
-                device_ip=request.META.get('REMOTE_ADDR')
-            )
-            
+            }, status=status.HTTP_502_BAD_GATEWAY)
+        
+        return Response({
+            'status': 'success',
+            'message': 'Device configuration synced successfully',
+            'sync_log_id': sync_log.id
+        })
+
+    @action(detail=False, methods=['post'])
+    def bulk_sync(self, request):
+        """Sync many device configurations concurrently"""
+        serializer = DeviceConfigurationBulkSyncSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        device_configs = DeviceConfiguration.objects.filter(is_enabled=True).only(*SYNC_FIELDS)
+        if 'device_ids' in serializer.validated_data:
+            device_configs = device_configs.filter(device_id__in=serializer.validated_data['device_ids'])
+        device_configs = list(device_configs)
+        # Created up front, so a missing device endpoint fails the request
+        engine = SyncEngine()
+        
+        if PERFORMANCE_SETTINGS['ENABLE_ASYNC_PROCESSING']:
+            start_background_sync(engine, device_configs)
             return Response({
-                'status': 'error',
-                'message': f'Sync failed: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                'status': 'accepted',
+                'message': f'Syncing {len(device_configs)} devices',
+                'total': len(device_configs)
+            }, status=status.HTTP_202_ACCEPTED)
+        
+        summary = engine.run(device_configs)
+        return Response(dict(summary, status='success', message=get_success_message('DEVICE_SYNCED')))
+
+    @action(detail=False, methods=['get'], url_path=r'pull/(?P<device_id>[a-zA-Z0-9_-]+)')
+    def pull(self, request, device_id=None):
+        """
+        Device-facing configuration pull, for staff and the configuration's
+        creator or assignee.
+        
+        Devices send the ETag of the configuration they hold in If-None-Match.
+        An unchanged configuration is answered with 304 Not Modified from the
+        cache, without a query. Otherwise only the keys changed since the
+        device's state are returned, or the full config_data when that state
+        cannot be reconstructed from the history.
+        """
+        state = get_configuration_state(device_id)
+        if state is None:
+            return Response({'error': get_error_message('CONFIGURATION_NOT_FOUND')}, status=status.HTTP_404_NOT_FOUND)
+        # Same rule as the activity stream: staff, or the configuration's creator or assignee
+        if not request.user.is_staff and request.user.pk not in state.get('user_ids', []):
+            return Response({'error': get_error_message('PERMISSION_DENIED')}, status=status.HTTP_403_FORBIDDEN)
+        
+        # If-None-Match uses the weak comparison
+        etags = [etag.removeprefix('W/') for etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]
+        if state['etag'] in etags or '*' in etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': state['etag']})
+        
+        device_config = DeviceConfiguration.objects.only(
+            'id', 'device_id', 'config_data', 'version', 'updated_at'
+        ).get(pk=state['pk'])
+        data = {
+            'device_id': device_config.device_id,
+            'version': device_config.version,
+            'updated_at': device_config.updated_at,
+            'delta': False
+        }
+        
+        base = None
+        held = parse_configuration_etag(etags[0]) if etags else None
+        if held is not None and held[0] == device_config.pk:
+            base = get_config_snapshot(*held)
+        
+        if base is None:
+            data['config_data'] = device_config.config_data
+        else:
+            current = device_config.config_data
+            data.update(
+                delta=True,
+                changed={key: value for key, value in current.items() if key not in base or base[key] != value},
+                removed=[key for key in base if key not in current]
+            )
+        etag = configuration_etag(device_config.pk, device_config.version, device_config.updated_at)
+        return Response(data, headers={'ETag': etag})
 
     @action(detail=False, methods=['post'])
     def bulk_update(self, request):
@@ -234,39 +432,78 @@ class DeviceConfigurationViewSet(viewsets.ModelViewSet):
         config_updates = serializer.validated_data['config_updates']
         force_update = serializer.validated_data['force_update']
         
-        updated_count = 0
-        errors = []
+        batch_size = DEVICE_CONFIG_SETTINGS['SYNC_BATCH_SIZE']
+        changed_fields = list(config_updates.keys())
+        ip_address = self.get_client_ip()
+        now = timezone.now()
         
-        with transaction.atomic():
-            for device_id in device_ids:
-                try:
-                    device_config = DeviceConfiguration.objects.get(device_id=device_id)
-                    
-                    # Validate updates if not forcing
-                    if not force_update:
-                        # Here you would add validation logic
-                        pass
-                    
-                    # Update configuration data
-                    device_config.config_data.update(config_updates)
-                    device_config.save()
-                    
-                    # Create history entry
-                    DeviceConfigurationHistory.objects.create(
-                        device_config=device_config,
-                        action='updated',
-                        new_values=DeviceConfigurationSerializer(device_config).data,
-                        changed_fields=list(config_updates.keys()),
-                        changed_by=request.user,
-                        ip_address=self.get_client_ip()
-                    )
-                    
-                    updated_count += 1
-                    
-                except DeviceConfiguration.DoesNotExist:
-                    errors.append(f"Device {device_id} not found")
-                except Exception as e:
-                    errors.append(f"Error updating device {device_id}: {str(e)}")
+        # One query for all targets; only the fields that are written or
+        # recorded in the history are loaded
+        device_configs = list(
+            DeviceConfiguration.objects
+            .filter(device_id__in=device_ids)
+            .order_by('pk')
+            .only('id', 'device_id', 'device_type_id', 'config_data', 'version')
+        )
+        found_ids = {device_config.device_id for device_config in device_configs}
+        errors = [f"Device {device_id} not found" for device_id in device_ids if device_id not in found_ids]
+        
+        # The updates are the same for every device, so they are validated
+        # once per device type, against parameters loaded in one query
+        if not force_update:
+            invalid = defaultdict(list)
+            parameters = DeviceParameter.objects.filter(
+                device_type_id__in={device_config.device_type_id for device_config in device_configs},
+                name__in=changed_fields
+            )
+            for param in parameters:
+                is_valid, error_msg = param.validate_value(config_updates[param.name])
+                if not is_valid:
+                    invalid[param.device_type_id].append(f"Parameter '{param.display_name}': {error_msg}")
+            for device_config in device_configs:
+                for error in invalid.get(device_config.device_type_id, []):
+                    errors.append(f"Device {device_config.device_id}: {error}")
+            device_configs = [
+                device_config for device_config in device_configs
+                if device_config.device_type_id not in invalid
+            ]
+        
+        # Each chunk is written in its own short transaction, so a large
+        # rollout never holds the write lock for long
+        updated_count = 0
+        for start in range(0, len(device_configs), batch_size):
+            chunk = device_configs[start:start + batch_size]
+            history = []
+            for device_config in chunk:
+                old_values = {key: device_config.config_data.get(key) for key in changed_fields}
+                device_config.config_data.update(config_updates)
+                device_config.updated_at = now
+                history.append(DeviceConfigurationHistory(
+                    device_config=device_config,
+                    action='updated',
+                    old_values=old_values,
+                    new_values={
+                        'config_data': device_config.config_data,
+                        'version': device_config.version,
+                        'updated_at': now.isoformat()
+                    },
+                    changed_fields=changed_fields,
+                    changed_by=request.user,
+                    ip_address=ip_address
+                ))
+            
+            try:
+                with transaction.atomic():
+                    DeviceConfiguration.objects.bulk_update(chunk, ['config_data', 'updated_at'])
+                    DeviceConfigurationHistory.objects.bulk_create(history)
+            except Exception as e:
+                errors.append(
+                    f"Error updating devices {chunk[0].device_id} to {chunk[-1].device_id}: {str(e)}"
+                )
+                continue
+            # bulk_update() sends no post_save signals
+            invalidate_configurations(chunk)
+            updated_count += len(chunk)
         
         return Response({
             'updated_count': updated_count,
@@ -292,56 +529,25 @@ class DeviceConfigurationViewSet(viewsets.ModelViewSet):
         else:
             configurations = DeviceConfiguration.objects.all()
         
-        if export_format == 'json':
-            data = DeviceConfigurationSerializer(configurations, many=True).data
-            
-            if include_history:
-                for config_data in data:
-                    config_obj = configurations.get(id=config_data['id'])
-                    config_data['history'] = DeviceConfigurationHistorySerializer(
-                        config_obj.history.all(), many=True
-                    ).data
-            
-            if include_sync_logs:
-                for config_data in data:
-                    config_obj = configurations.get(id=config_data['id'])
-                    config_data['sync_logs'] = DeviceSyncLogSerializer(
-                        config_obj.sync_logs.all(), many=True
-                    ).data
-            
-            return Response(data)
-        
-        elif export_format == 'csv':
-            # Generate CSV export
-            output = StringIO()
-            writer = csv.writer(output)
-            
-            # Write headers
-            headers = ['Device ID', 'Name', 'Device Type', 'Status', 'Version', 'Created At']
-            writer.writerow(headers)
-            
-            # Write data
-            for config in configurations:
-                writer.writerow([
-                    config.device_id,
-                    config.name,
-                    config.device_type.name if config.device_type else '',
-                    config.status,
-                    config.version,
-                    config.created_at.strftime('%Y-%m-%d %H:%M:%S')
-                ])
-            
-            output.seek(0)
-            response = Response(output.getvalue())
-            response['Content-Type'] = 'text/csv'
-            response['Content-Disposition'] = 'attachment; filename="device_configurations.csv"'
-            return response
+        if export_format not in get_supported_formats():
+            return Response(
+                {'error': get_error_message('UNSUPPORTED_FORMAT')}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        else:
+        # Checked up front, since a streamed response cannot fail halfway
+        max_records = DEVICE_CONFIG_SETTINGS['MAX_EXPORT_RECORDS']
+        total = configurations.count()
+        if total > max_records:
             return Response(
-                {'error': 'Unsupported export format'}, 
+                {'error': f'{total} configurations match; at most {max_records} can be exported at once'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        return streaming_export(
+            configurations, export_format, include_history, include_sync_logs,
+            asynchronous=isinstance(request._request, ASGIRequest)
+        )
 
     def get_client_ip(self):
         """Get client IP address from request"""
@@ -411,3 +617,50 @@ class DeviceSyncLogViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(sync_started__date__lte=end_date)
         
         return queryset
+
+
+class ActivityPredictionView(APIView):
+    """Classify windows of wearable IMU readings into activities"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        """
+        Expects {"windows": [[[channel, ...], ...], ...]}: a list of windows of
+        seq_length readings with one value per sensor channel
+        """
+        try:
+            batcher = get_activity_batcher()
+        except ImportError as e:
+            batcher = None
+            error = str(e)
+        else:
+            error = 'Activity model is not deployed'
+        if batcher is None:
+            return Response({'error': error}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        classifier = batcher.classifier
+        windows = None
+        if isinstance(request.data, dict):
+            try:
+                windows = np.asarray(request.data.get('windows'), dtype=np.float32)
+            except (TypeError, ValueError):
+                pass
+        if windows is None or windows.ndim != 3 or windows.shape[1:] != (classifier.seq_length, classifier.n_channels):
+            return Response({
+                'error': f'windows must be a list of {classifier.seq_length} x {classifier.n_channels} readings'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(windows) > ACTIVITY_INFERENCE_SETTINGS['MAX_WINDOWS_PER_REQUEST']:
+            return Response({
+                'error': f"At most {ACTIVITY_INFERENCE_SETTINGS['MAX_WINDOWS_PER_REQUEST']} windows per request"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            probabilities = batcher.predict(windows, timeout=ACTIVITY_INFERENCE_SETTINGS['REQUEST_TIMEOUT'])
+        except FutureTimeoutError:
+            return Response({'error': get_error_message('TIMEOUT')}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        return Response({
+            'classes': classifier.classes,
+            'predictions': classifier.describe(probabilities)
+        })
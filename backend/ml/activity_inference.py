@@ -0,0 +1,324 @@
+# backend/ml/activity_inference.py
+"""
+Server-side activity recognition with the TFLite sensor model.
+
+The model exported by lstm-model.py (sensor_model.tflite) is loaded once
+per worker. Requests submit windows of IMU readings to a MicroBatcher,
+which gathers the windows of concurrent requests for a few milliseconds
+and runs them through the interpreter in one invocation.
+
+The interpreter comes from tflite_runtime when it is installed and from
+TensorFlow otherwise. A JSON file next to the model (sensor_model.json,
+written by lstm-model.py) holds the activity id of each output class, the
+expected window shape and the channel normalisation used in training,
+which is applied to the raw readings before inference.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from .sensor_pipeline import ACTIVITY_NAMES, ChannelNormalizer
+
+logger = logging.getLogger(__name__)
+
+
+def _load_interpreter(model_path: str, num_threads: Optional[int]):
+    """Create a TFLite interpreter from tflite_runtime, or TensorFlow as a fallback."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tensorflow.lite import Interpreter
+        except ImportError:
+            raise ImportError("tflite_runtime or TensorFlow is required for activity inference") from None
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
+
+def model_metadata_path(model_path: str) -> str:
+    """Path of the metadata file stored next to a .tflite model."""
+    return os.path.splitext(model_path)[0] + '.json'
+
+
+class ActivityClassifier:
+    """
+    TFLite activity model with batched, thread-safe inference.
+
+    Models with a dynamic batch dimension are resized to power-of-two batch
+    sizes (padding the windows), so the interpreter is reallocated only
+    when a larger bucket is first needed. Models with a fixed batch size
+    are invoked once per chunk of that size. Quantised (int8) models get
+    their inputs quantised and outputs dequantised with the tensors' scale
+    and zero point, so callers always pass and receive floats.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        num_threads: Optional[int] = None,
+        max_batch_size: int = 64,
+        normalize: bool = True
+    ):
+        """
+        Args:
+            model_path (str): Path of the .tflite model
+            num_threads (Optional[int]): Interpreter threads (defaults to
+                TFLite's choice)
+            max_batch_size (int): Largest batch passed to one invocation
+            normalize (bool): Standardise windows with the normaliser stored
+                in the model's metadata (disable for windows that are
+                already normalised)
+        """
+        self.model_path = model_path
+        self.max_batch_size = max_batch_size
+        self.interpreter = _load_interpreter(model_path, num_threads)
+        self.interpreter.allocate_tensors()
+        self._lock = threading.Lock()
+
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        signature = self._input.get('shape_signature', self._input['shape'])
+        self.dynamic_batch = signature[0] == -1
+        self.seq_length = int(self._input['shape'][1])
+        self.n_channels = int(self._input['shape'][2])
+        self._batch_size = int(self._input['shape'][0])
+
+        metadata = {}
+        if os.path.exists(model_metadata_path(model_path)):
+            with open(model_metadata_path(model_path)) as f:
+                metadata = json.load(f)
+        n_classes = int(self._output['shape'][-1])
+        self.classes = metadata.get('classes', list(range(n_classes)))
+        self.normalizer = None
+        if normalize and metadata.get('normalizer'):
+            self.normalizer = ChannelNormalizer.from_dict(metadata['normalizer'])
+
+    def _resize(self, batch_size: int) -> None:
+        """Reallocate the interpreter for a new batch size; the caller holds the lock."""
+        self.interpreter.resize_tensor_input(self._input['index'], [batch_size, self.seq_length, self.n_channels])
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    @property
+    def quantized(self) -> bool:
+        """Whether the model takes integer (quantised) inputs."""
+        return bool(self._input['quantization'][0])
+
+    def _quantize(self, windows: np.ndarray) -> np.ndarray:
+        """Convert float windows to the model's input type and quantisation."""
+        scale, zero_point = self._input['quantization']
+        if not scale:
+            return np.ascontiguousarray(windows, dtype=self._input['dtype'])
+        limits = np.iinfo(self._input['dtype'])
+        quantized = np.round(windows / scale) + zero_point
+        return np.clip(quantized, limits.min, limits.max).astype(self._input['dtype'])
+
+    def _dequantize(self, output: np.ndarray) -> np.ndarray:
+        """Convert the model's output back to float probabilities."""
+        scale, zero_point = self._output['quantization']
+        if not scale:
+            return output.astype(np.float32)
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def _invoke(self, windows: np.ndarray) -> np.ndarray:
+        """Run one batch of at most _batch_size windows; the caller holds the lock."""
+        n = len(windows)
+        if n < self._batch_size:
+            windows = np.concatenate([windows, np.zeros((self._batch_size - n,) + windows.shape[1:], dtype=windows.dtype)])
+        self.interpreter.set_tensor(self._input['index'], windows)
+        self.interpreter.invoke()
+        return self._dequantize(self.interpreter.get_tensor(self._output['index'])[:n])
+
+    def predict(self, windows: np.ndarray) -> np.ndarray:
+        """
+        Activity probabilities for a batch of windows.
+
+        Args:
+            windows (np.ndarray): Raw IMU windows of shape (n_windows,
+                seq_length, n_channels)
+
+        Returns:
+            np.ndarray: Probabilities of shape (n_windows, len(classes))
+        """
+        windows = np.asarray(windows, dtype=np.float32)
+        if windows.ndim != 3 or windows.shape[1:] != (self.seq_length, self.n_channels):
+            raise ValueError(
+                f"Expected windows of shape (n, {self.seq_length}, {self.n_channels}), got {windows.shape}"
+            )
+        if self.normalizer is not None:
+            windows = self.normalizer.transform(windows)
+        windows = self._quantize(windows)
+
+        results = []
+        with self._lock:
+            for start in range(0, len(windows), self.max_batch_size):
+                chunk = windows[start:start + self.max_batch_size]
+                if self.dynamic_batch:
+                    bucket = min(1 << (len(chunk) - 1).bit_length(), self.max_batch_size)
+                    if bucket > self._batch_size:
+                        self._resize(bucket)
+                for offset in range(0, len(chunk), self._batch_size):
+                    results.append(self._invoke(chunk[offset:offset + self._batch_size]))
+
+        if not results:
+            return np.empty((0, len(self.classes)), dtype=np.float32)
+        return np.concatenate(results)
+
+    def describe(self, probabilities: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Turn probabilities into per-window predictions.
+
+        Args:
+            probabilities (np.ndarray): Output of predict()
+
+        Returns:
+            List[Dict[str, Any]]: 'activity_id', 'activity', 'confidence'
+            and 'probabilities' of each window
+        """
+        best = probabilities.argmax(axis=1)
+        return [
+            {
+                'activity_id': self.classes[label],
+                'activity': ACTIVITY_NAMES.get(self.classes[label], 'unknown'),
+                'confidence': float(row[label]),
+                'probabilities': row.tolist()
+            }
+            for label, row in zip(best, probabilities)
+        ]
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent predict() calls into shared interpreter invocations.
+
+    A background thread waits for the first pending request, then keeps
+    collecting requests for up to max_wait_ms (or until max_batch_size
+    windows are pending) and runs them as one batch.
+    """
+
+    def __init__(self, classifier: ActivityClassifier, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        """
+        Args:
+            classifier (ActivityClassifier): Model to run
+            max_batch_size (int): Windows that end the collection early
+            max_wait_ms (float): Longest a request waits for others to join
+        """
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._n_pending = 0
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name='activity-micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, windows: np.ndarray) -> Future:
+        """
+        Queue windows for the next batch.
+
+        Args:
+            windows (np.ndarray): IMU windows of shape (n_windows,
+                seq_length, n_channels)
+
+        Returns:
+            Future: Resolves to the probabilities of the windows
+        """
+        windows = np.asarray(windows, dtype=np.float32)
+        if windows.ndim != 3 or windows.shape[1:] != (self.classifier.seq_length, self.classifier.n_channels):
+            raise ValueError(
+                f"Expected windows of shape (n, {self.classifier.seq_length}, "
+                f"{self.classifier.n_channels}), got {windows.shape}"
+            )
+
+        future = Future()
+        with self._condition:
+            self._pending.append((windows, future))
+            self._n_pending += len(windows)
+            self._condition.notify()
+        return future
+
+    def predict(self, windows: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        """Submit windows and wait for their probabilities."""
+        return self.submit(windows).result(timeout)
+
+    def _collect(self) -> List[Tuple[np.ndarray, Future]]:
+        """Wait for a request, then gather more until the batch is full or the wait is over."""
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.monotonic() + self.max_wait
+            while self._n_pending < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch, self._pending, self._n_pending = self._pending, [], 0
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self._run_batch(self._collect())
+            except Exception:
+                # Every prediction of the process depends on this thread
+                logger.exception("Activity micro-batch failed")
+
+    def _run_batch(self, batch: List[Tuple[np.ndarray, Future]]) -> None:
+        # Requests cancelled while queued (e.g. after a client timeout) are
+        # dropped; the others can no longer be cancelled once running
+        batch = [(windows, future) for windows, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            probabilities = self.classifier.predict(np.concatenate([windows for windows, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for windows, future in batch:
+            future.set_result(probabilities[offset:offset + len(windows)])
+            offset += len(windows)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_activity_batcher(
+    model_path: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    max_batch_size: int = 64,
+    max_wait_ms: float = 5.0
+) -> Optional[MicroBatcher]:
+    """
+    Return the worker's micro-batched activity model, loading it on first use.
+
+    Args:
+        model_path (Optional[str]): Path of the .tflite model
+        num_threads (Optional[int]): Interpreter threads
+        max_batch_size (int): Largest batch per invocation
+        max_wait_ms (float): Longest a request waits for others to join
+
+    Returns:
+        Optional[MicroBatcher]: The batcher, or None if there is no model
+    """
+    global _batcher
+
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None and model_path and os.path.exists(model_path):
+                classifier = ActivityClassifier(model_path, num_threads=num_threads, max_batch_size=max_batch_size)
+                _batcher = MicroBatcher(classifier, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+                logger.info("Loaded activity model %s", model_path)
+
+    return _batcher
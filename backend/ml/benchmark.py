@@ -0,0 +1,386 @@
+# backend/ml/benchmark.py
+"""
+Benchmark harness for the patient similarity engine.
+
+Builds synthetic cohorts of increasing size and times fit, single queries,
+batch queries and explanations, recording peak memory along the way. Results
+are written as JSON so runs from different commits can be compared:
+
+    python -m ml.benchmark --sizes 1000,10000,100000,1000000 --output new.json
+    python -m ml.benchmark --compare old.json new.json --threshold 0.2
+    python -m ml.benchmark --representations --sizes 1000000
+
+--representations reports accuracy against memory for float64, float32
+and int8-quantised storage instead of the timing benchmark.
+
+Run from the backend directory. Django is not needed.
+"""
+
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable
+
+import numpy as np
+
+from .patient_similarity import PatientSimilarity, synthetic_feature_encoder
+from .similarity_index import recall_at_k
+
+# (label, index backend, dtype) compared by --representations; the first is
+# the reference the others are measured against
+REPRESENTATIONS = [
+    ('float64', 'brute', 'float64'),
+    ('float32', 'brute', 'float32'),
+    ('int8', 'quantized', 'float32')
+]
+
+# Metrics compared by --compare; lower is better for all of them
+COMPARED_METRICS = [
+    'fit_s',
+    'single_query_ms.p50',
+    'single_query_ms.p95',
+    'batch_query_us_per_query',
+    'explain_ms.p50',
+    'fit_peak_mb',
+    'batch_peak_mb'
+]
+
+
+def _latency_ms(fn: Callable[[], Any], repeats: int) -> Dict[str, float]:
+    """Call fn repeatedly and summarise its latency in milliseconds."""
+    timings = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings[i] = time.perf_counter() - start
+    timings *= 1e3
+    return {
+        'mean': float(timings.mean()),
+        'p50': float(np.percentile(timings, 50)),
+        'p95': float(np.percentile(timings, 95)),
+        'max': float(timings.max())
+    }
+
+
+def _traced(fn: Callable[[], Any]) -> tuple:
+    """Run fn once, returning (result, seconds, peak traced MB)."""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def run_benchmark(
+    n_patients: int,
+    index: str = 'brute',
+    index_params: Optional[Dict[str, Any]] = None,
+    multi_modal: bool = False,
+    k: int = 10,
+    n_queries: int = 100,
+    batch_size: int = 1000,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """
+    Benchmark one cohort size.
+
+    Fit and the batch query run under tracemalloc to record their peak
+    allocations; the latency loops run without it so tracing does not skew
+    their timings.
+
+    Args:
+        n_patients (int): Cohort size
+        index (str): Neighbour index backend
+        index_params (Optional[Dict[str, Any]]): Index backend parameters
+        multi_modal (bool): Use the multi-modal feature encoder
+        k (int): Neighbours per query
+        n_queries (int): Number of timed single queries and explanations
+        batch_size (int): Number of targets in the batch query
+        seed (int): Seed for the synthetic cohort and queries
+
+    Returns:
+        Dict[str, Any]: Timings and memory peaks for this cohort size
+    """
+    model = PatientSimilarity(
+        n_neighbors=k,
+        index=index,
+        index_params=index_params,
+        auto_rebuild=False,
+        encoder=synthetic_feature_encoder() if multi_modal else None
+    )
+
+    start = time.perf_counter()
+    cohort = model.generate_synthetic_columns(n_patients, seed=seed)
+    generate_s = time.perf_counter() - start
+    targets = model.generate_synthetic_columns(max(batch_size, n_queries), seed=seed + 1, start_id=0)
+
+    _, fit_s, fit_peak_mb = _traced(lambda: model.fit(cohort, id_field='id'))
+    del cohort
+
+    queries = model.columns_to_records({name: column[:n_queries] for name, column in targets.items()})
+    model.find_similar_patients(queries[0])  # warm up
+
+    query_iter = iter(queries)
+    single_query_ms = _latency_ms(lambda: model.find_similar_patients(next(query_iter)), n_queries)
+
+    batch = {name: column[:batch_size] for name, column in targets.items()}
+    (neighbour_ids, _), batch_s, batch_peak_mb = _traced(lambda: model.find_similar_patients_batch(batch, k=k))
+
+    explain_iter = iter(zip(queries, neighbour_ids.tolist()))
+    explain_ms = _latency_ms(lambda: model.explain_similar_patients(*next(explain_iter)), n_queries)
+
+    return {
+        'n_patients': n_patients,
+        'index': index,
+        'index_params': model.index.params(),
+        'n_features': len(model.feature_names),
+        'k': k,
+        'generate_s': generate_s,
+        'fit_s': fit_s,
+        'fit_peak_mb': fit_peak_mb,
+        'single_query_ms': single_query_ms,
+        'batch_size': batch_size,
+        'batch_query_s': batch_s,
+        'batch_query_us_per_query': batch_s / batch_size * 1e6,
+        'batch_peak_mb': batch_peak_mb,
+        'explain_ms': explain_ms,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+def representation_report(
+    n_patients: int,
+    multi_modal: bool = False,
+    k: int = 10,
+    n_queries: int = 100,
+    seed: int = 0
+) -> List[Dict[str, Any]]:
+    """
+    Compare storage representations of the same cohort on accuracy and memory.
+
+    Every representation in REPRESENTATIONS is fitted on the same cohort and
+    queried with the same patients. Recall@k and score errors are measured
+    against the float64 exact results.
+
+    Args:
+        n_patients (int): Cohort size
+        multi_modal (bool): Use the multi-modal feature encoder
+        k (int): Neighbours per query
+        n_queries (int): Number of queries
+        seed (int): Seed for the synthetic cohort and queries
+
+    Returns:
+        List[Dict[str, Any]]: One row per representation
+    """
+    rows = []
+    reference = None
+    for label, index, dtype in REPRESENTATIONS:
+        model = PatientSimilarity(
+            n_neighbors=k,
+            index=index,
+            auto_rebuild=False,
+            encoder=synthetic_feature_encoder() if multi_modal else None,
+            dtype=dtype
+        )
+        model.fit(model.generate_synthetic_columns(n_patients, seed=seed), id_field='id')
+        queries = model.generate_synthetic_columns(n_queries, seed=seed + 1, start_id=0)
+        ids, scores = model.find_similar_patients_batch(queries, k=k)
+        if reference is None:
+            reference = (ids, scores)
+
+        records = model.columns_to_records(queries)
+        query_iter = iter(records)
+        memory = model.index.memory_usage()
+        rows.append({
+            'representation': label,
+            'index': index,
+            'n_patients': n_patients,
+            'index_mb': memory['total'] / 2 ** 20,
+            'scanned_mb': memory['scanned'] / 2 ** 20,
+            'raw_mb': model.raw.matrix.nbytes / 2 ** 20,
+            'recall': recall_at_k(ids, reference[0]),
+            'max_score_error': float(np.abs(scores - reference[1]).max()),
+            'single_query_ms': _latency_ms(lambda: model.find_similar_patients(next(query_iter)), len(records))
+        })
+    return rows
+
+
+def _environment() -> Dict[str, Any]:
+    """Describe the machine and commit a run was made on."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine()
+    }
+
+
+def _metric(result: Dict[str, Any], name: str) -> Optional[float]:
+    """Look up a dotted metric name such as 'single_query_ms.p50'."""
+    value = result
+    for part in name.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.2) -> List[Dict[str, Any]]:
+    """
+    Compare two benchmark runs metric by metric.
+
+    Runs are matched on (n_patients, index). A metric regresses when it is
+    more than threshold (relative) above the baseline.
+
+    Args:
+        baseline (Dict[str, Any]): Earlier benchmark output
+        current (Dict[str, Any]): Later benchmark output
+        threshold (float): Allowed relative slowdown
+
+    Returns:
+        List[Dict[str, Any]]: One row per compared metric with the baseline
+        and current values, their ratio and whether it regressed
+    """
+    baseline_results = {(r['n_patients'], r['index']): r for r in baseline['results']}
+    rows = []
+    for result in current['results']:
+        key = (result['n_patients'], result['index'])
+        if key not in baseline_results:
+            continue
+        for metric in COMPARED_METRICS:
+            before = _metric(baseline_results[key], metric)
+            after = _metric(result, metric)
+            if before is None or after is None or before <= 0:
+                continue
+            ratio = after / before
+            rows.append({
+                'n_patients': key[0],
+                'index': key[1],
+                'metric': metric,
+                'baseline': before,
+                'current': after,
+                'ratio': ratio,
+                'regressed': ratio > 1 + threshold
+            })
+    return rows
+
+
+def _parse_index_params(values: List[str]) -> Dict[str, Any]:
+    """Parse repeated key=value options, decoding values as JSON when possible."""
+    params = {}
+    for value in values:
+        key, _, raw = value.partition('=')
+        try:
+            params[key] = json.loads(raw)
+        except ValueError:
+            params[key] = raw
+    return params
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the patient similarity engine")
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help="Comma-separated cohort sizes")
+    parser.add_argument('--index', default='brute', help="Neighbour index backend")
+    parser.add_argument('--index-param', action='append', default=[], metavar='KEY=VALUE',
+                        help="Index backend parameter (repeatable)")
+    parser.add_argument('--multi-modal', action='store_true',
+                        help="Use the multi-modal feature encoder")
+    parser.add_argument('--k', type=int, default=10, help="Neighbours per query")
+    parser.add_argument('--queries', type=int, default=100, help="Timed single queries per size")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Targets in the batch query")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write JSON results to this file")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="Compare two result files instead of running")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown reported as a regression by --compare")
+    parser.add_argument('--representations', action='store_true',
+                        help="Report accuracy against memory of the storage representations")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        rows = compare_results(baseline, current, args.threshold)
+        for row in rows:
+            flag = 'REGRESSION' if row['regressed'] else ''
+            print(f"{row['n_patients']:>9} {row['index']:<6} {row['metric']:<26} "
+                  f"{row['baseline']:>12.4f} {row['current']:>12.4f} {row['ratio']:>7.2f}x {flag}")
+        return 1 if any(row['regressed'] for row in rows) else 0
+
+    if args.representations:
+        results = []
+        for size in (int(s) for s in args.sizes.split(',')):
+            for row in representation_report(size, multi_modal=args.multi_modal, k=args.k,
+                                             n_queries=args.queries, seed=args.seed):
+                results.append(row)
+                print(f"{size:>9} {row['representation']:<8} index {row['index_mb']:>8.1f} MB "
+                      f"(scanned {row['scanned_mb']:>7.1f} MB), raw {row['raw_mb']:>7.1f} MB, "
+                      f"recall@{args.k} {row['recall']:.4f}, max score error {row['max_score_error']:.2e}, "
+                      f"query p50 {row['single_query_ms']['p50']:.2f}ms", file=sys.stderr)
+        output = {'environment': _environment(), 'arguments': vars(args), 'representations': results}
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(output, f, indent=2)
+        else:
+            json.dump(output, sys.stdout, indent=2)
+        return 0
+
+    index_params = _parse_index_params(args.index_param)
+
+    # Discarded run so imports and first-call costs do not land on the first size
+    run_benchmark(1000, index=args.index, index_params=index_params, multi_modal=args.multi_modal,
+                  k=args.k, n_queries=5, batch_size=10, seed=args.seed)
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        result = run_benchmark(
+            size,
+            index=args.index,
+            index_params=index_params,
+            multi_modal=args.multi_modal,
+            k=args.k,
+            n_queries=args.queries,
+            batch_size=args.batch_size,
+            seed=args.seed
+        )
+        results.append(result)
+        print(f"{size:>9} patients: fit {result['fit_s']:.2f}s ({result['fit_peak_mb']:.0f} MB peak), "
+              f"query p50 {result['single_query_ms']['p50']:.2f}ms, "
+              f"batch {result['batch_query_us_per_query']:.1f}us/query, "
+              f"explain p50 {result['explain_ms']['p50']:.2f}ms", file=sys.stderr)
+
+    output = {'environment': _environment(), 'arguments': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,366 @@
+# backend/ml/engine.py
+"""
+Process-wide patient similarity engine used by the API views.
+
+The engine is loaded once per worker from the artifact configured by
+settings.SIMILARITY_INDEX_PATH and kept current incrementally as patients
+are registered, change or are removed. When no artifact has been built the
+helpers below are no-ops, so the rest of the API works without the ML stack.
+
+Incremental updates are shared through an append-only journal next to the
+artifact (updates-<model_version>.jsonl, one JSON entry per line). A
+committed change is appended to the journal and every worker applies the
+entries it has not seen before it searches, and replays the whole journal
+when it loads the artifact, so updates survive restarts and reach every
+worker. A newly built artifact (with a new model_version) starts a new
+journal. SIMILARITY_INDEX_PATH must be storage shared by all workers.
+
+Encoded patient features are cached in a PatientFeatureStore and top-k
+results in a ResultCache; both are invalidated, in every worker, as the
+journalled changes are applied.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import List, Dict, Any, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are not locked across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_engine = None
+_feature_store = None
+_result_cache = None
+_engine_lock = threading.Lock()
+
+# Journal of the loaded artifact, and how far this worker has applied it
+_journal_path = None
+_journal_offset = 0
+_journal_lock = threading.Lock()
+
+
+def get_similarity_engine():
+    """
+    Return the worker's PatientSimilarity instance, loading it on first use.
+    
+    Returns:
+        Optional[PatientSimilarity]: The engine, or None if no artifact exists
+    """
+    global _engine, _journal_path, _journal_offset
+    
+    if _engine is None:
+        with _engine_lock:
+            path = getattr(settings, 'SIMILARITY_INDEX_PATH', None)
+            if _engine is None and path and os.path.exists(os.path.join(path, 'manifest.json')):
+                from .patient_similarity import PatientSimilarity
+                engine = PatientSimilarity.load(path)
+                with _journal_lock:
+                    _journal_path = os.path.join(path, f'updates-{engine.model_version}.jsonl')
+                    _journal_offset = 0
+                _engine = engine
+                logger.info("Loaded patient similarity model %s from %s", engine.model_version, path)
+        apply_index_updates()
+    
+    return _engine
+
+
+def get_feature_store():
+    """
+    Return the worker's PatientFeatureStore, creating it on first use.
+    
+    The store encodes patients with the engine's feature schema (the numeric
+    similarity features when the engine has none) and loads patients it has
+    not cached yet from the database.
+    
+    Returns:
+        PatientFeatureStore: The feature store
+    """
+    global _feature_store
+    
+    if _feature_store is None:
+        engine = get_similarity_engine()
+        with _engine_lock:
+            if _feature_store is None:
+                from .feature_store import FeatureEncoder, PatientFeatureStore
+                from .patient_similarity import SIMILARITY_FEATURES
+                
+                encoder = getattr(engine, 'encoder', None) or FeatureEncoder(SIMILARITY_FEATURES)
+                _feature_store = PatientFeatureStore(encoder, loader=load_patient_records)
+    
+    return _feature_store
+
+
+def get_result_cache():
+    """
+    Return the worker's cache of top-k similarity results.
+    
+    Returns:
+        ResultCache: The result cache
+    """
+    global _result_cache
+    
+    if _result_cache is None:
+        with _engine_lock:
+            if _result_cache is None:
+                from .result_cache import ResultCache
+                
+                _result_cache = ResultCache(
+                    max_entries=getattr(settings, 'SIMILARITY_CACHE_SIZE', 10000),
+                    ttl=getattr(settings, 'SIMILARITY_CACHE_TTL', 300)
+                )
+    
+    return _result_cache
+
+
+def warm_up() -> None:
+    """
+    Load the engine, feature store and result cache ahead of the first request.
+    
+    Called from the patients app's ready(); failures are logged so a broken
+    artifact never stops the worker from starting.
+    """
+    try:
+        get_similarity_engine()
+        get_feature_store()
+        get_result_cache()
+    except Exception:
+        logger.exception("Failed to warm up the patient similarity engine")
+
+
+def find_similar_to_patient(patient_id: int, k: int = 10) -> Optional[Dict[str, Any]]:
+    """
+    Top-k most similar patients to a stored patient, served from the cache.
+    
+    Results are cached under (patient_id, model_version, k), so a rebuild
+    makes older entries unreachable. An index update drops only the entries
+    of the changed patient and the results listing them; a patient who
+    becomes a closer neighbour of someone only shows up once that entry
+    expires (SIMILARITY_CACHE_TTL). The patient is left out of their own
+    results.
+    
+    Args:
+        patient_id (int): Id of the target patient
+        k (int): Number of neighbours
+        
+    Returns:
+        Optional[Dict[str, Any]]: 'patient_id', 'model_version', 'k', 'cached'
+        and 'results' (a list of {'patient_id', 'score'}), or None when no
+        model has been built
+        
+    Raises:
+        KeyError: If the patient does not exist
+    """
+    engine = get_similarity_engine()
+    if engine is None:
+        return None
+    apply_index_updates()
+    
+    cache = get_result_cache()
+    key = (patient_id, engine.model_version, k)
+    results = cache.get(key)
+    cached = results is not None
+    
+    if not cached:
+        features = get_feature_store().get([patient_id])
+        ids, scores = engine.find_similar_patients_batch(features, k=k + 1)
+        results = [
+            {'patient_id': int(neighbour_id), 'score': float(score)}
+            for neighbour_id, score in zip(ids[0], scores[0])
+            if neighbour_id != patient_id
+        ][:k]
+        cache.set(key, results, related=[result['patient_id'] for result in results])
+    
+    return {
+        'patient_id': patient_id,
+        'model_version': engine.model_version,
+        'k': k,
+        'cached': cached,
+        'results': results
+    }
+
+
+def patient_record(patient) -> Dict[str, Any]:
+    """
+    Build the similarity feature record for a Patient.
+    
+    Features without a source in the database are left out and imputed with
+    the cohort means by the engine. Related rows are read through .all(), so
+    prefetched relations (see load_patient_records) cost no extra queries.
+    
+    Args:
+        patient: patients.models.Patient instance
+        
+    Returns:
+        Dict[str, Any]: Patient data keyed like the similarity features
+    """
+    record = {'id': patient.pk, 'age': patient.age, 'gender': patient.gender}
+    
+    # Latest MMSE score from a cognitive assessment
+    assessments = [r for r in patient.medical_records.all() if r.mmse_score is not None]
+    if assessments:
+        latest = max(assessments, key=lambda r: r.date_recorded)
+        record['cognitive_score'] = float(latest.mmse_score)
+    
+    profile = getattr(patient, 'profile', None)
+    if profile is not None:
+        record.update({
+            'smoking_history': profile.smoking_status,
+            'alcohol_consumption': profile.alcohol_consumption,
+            'exercise_frequency': profile.exercise_frequency
+        })
+        if profile.bmi is not None:
+            record['bmi'] = float(profile.bmi)
+    
+    record['medications'] = [m.name for m in patient.medications.all() if m.status == 'active']
+    
+    # Vital signs are ordered newest first
+    vitals = next(iter(patient.vital_signs.all()), None)
+    if vitals is not None:
+        record['blood_pressure_systolic'] = vitals.blood_pressure_systolic
+        record['blood_pressure_diastolic'] = vitals.blood_pressure_diastolic
+    
+    return record
+
+
+def load_patient_records(patient_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    Build feature records for many patients with a fixed number of queries.
+    
+    Args:
+        patient_ids (List[int]): Patient ids; unknown ids are left out
+        
+    Returns:
+        List[Dict[str, Any]]: One record per patient found
+    """
+    from patients.models import Patient
+    
+    patients = Patient.objects.filter(pk__in=patient_ids).select_related('profile').prefetch_related(
+        'medical_records', 'medications', 'vital_signs'
+    )
+    return [patient_record(patient) for patient in patients]
+
+
+def invalidate_patient_features(patient_id: Optional[int]) -> None:
+    """
+    Drop a patient's cached feature vector, their results and the results
+    listing them after their data changed.
+    
+    Args:
+        patient_id (Optional[int]): Id of the patient
+    """
+    if patient_id is None:
+        return
+    if _feature_store is not None:
+        _feature_store.invalidate([patient_id])
+    if _result_cache is not None:
+        _result_cache.invalidate(patient_id)
+
+
+def _append_index_update(entry: Dict[str, Any]) -> None:
+    """Append one entry to the journal, as a single locked write."""
+    line = json.dumps(entry) + '\n'
+    with open(_journal_path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def apply_index_updates() -> None:
+    """
+    Apply the journal entries this worker has not applied yet.
+    
+    Cheap when there are none (one stat() call), so it runs before every
+    search. A line still being written is left for the next call, and an
+    entry that cannot be applied is logged and skipped.
+    """
+    global _journal_offset
+    
+    engine = _engine
+    if engine is None or _journal_path is None:
+        return
+    try:
+        if os.path.getsize(_journal_path) <= _journal_offset:
+            return
+    except FileNotFoundError:
+        return
+    
+    changed = []
+    with _journal_lock:
+        with open(_journal_path, 'rb') as f:
+            f.seek(_journal_offset)
+            data = f.read()
+        complete = data.rfind(b'\n') + 1
+        
+        for line in data[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+                if entry['op'] == 'upsert':
+                    engine.upsert_patients([entry['record']])
+                    changed.append(entry['record']['id'])
+                else:
+                    engine.remove_patients([entry['id']])
+                    changed.append(entry['id'])
+            except Exception:
+                logger.exception("Failed to apply similarity index update %r", line)
+        _journal_offset += complete
+    
+    for patient_id in changed:
+        invalidate_patient_features(patient_id)
+
+
+def _publish_index_update(patient_id: int, remove: bool) -> None:
+    """Journal an upsert (from the committed rows) or removal, then apply it here."""
+    try:
+        engine = get_similarity_engine()
+        if engine is None:
+            return
+        if remove:
+            entry = {'op': 'remove', 'id': patient_id}
+        else:
+            records = load_patient_records([patient_id])
+            if not records:
+                # Deleted in the same transaction; its removal is journalled
+                return
+            entry = {'op': 'upsert', 'record': records[0]}
+        _append_index_update(entry)
+        apply_index_updates()
+    except Exception:
+        logger.exception("Failed to update patient %s in the similarity index", patient_id)
+
+
+def update_patient_index(patient_id: Optional[int]) -> None:
+    """
+    Add or update a patient in every worker's similarity index.
+    
+    Runs once the current transaction commits, with the patient's
+    committed data, so a rolled-back change never reaches the index.
+    Errors are logged rather than raised so an index problem never fails
+    the request that triggered the update.
+    
+    Args:
+        patient_id (Optional[int]): Id of the patient
+    """
+    if patient_id is not None:
+        transaction.on_commit(lambda: _publish_index_update(patient_id, remove=False))
+
+
+def remove_patient_from_index(patient_id: Optional[int]) -> None:
+    """
+    Remove a patient from every worker's similarity index once the current
+    transaction commits.
+    
+    Args:
+        patient_id (Optional[int]): Id of the patient to remove
+    """
+    if patient_id is not None:
+        transaction.on_commit(lambda: _publish_index_update(patient_id, remove=True))
@@ -0,0 +1,380 @@
+# backend/ml/feature_store.py
+"""
+Encoded patient feature vectors, cached per patient.
+
+FeatureEncoder turns patient records into fixed-width float32 vectors:
+numeric fields are kept as they are (NaN when missing), categorical fields
+are one-hot encoded and list fields such as conditions and medications are
+multi-hot encoded. PatientFeatureStore keeps the encoded vector of every
+patient in one compact matrix with an id -> row map, loads missing patients
+on demand and hands the matrix out in CSR form for sparse consumers.
+"""
+
+import json
+import os
+import threading
+from typing import List, Dict, Any, Optional, Callable, Iterable
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def _category_key(value: Any) -> str:
+    """Normalise a category so 'Male', 'male' and ' MALE ' match."""
+    return str(value).strip().lower()
+
+
+class FeatureEncoder:
+    """Fixed schema mapping patient records to float32 feature vectors."""
+
+    def __init__(
+        self,
+        numeric: List[str],
+        categorical: Optional[Dict[str, List[Any]]] = None,
+        multi_hot: Optional[Dict[str, List[str]]] = None
+    ):
+        """
+        Args:
+            numeric (List[str]): Numeric (or boolean) fields, one column each
+            categorical (Optional[Dict[str, List[Any]]]): Single-valued fields
+                and their categories, one-hot encoded
+            multi_hot (Optional[Dict[str, List[str]]]): List-valued fields and
+                their vocabularies, multi-hot encoded
+
+        Categories are matched case-insensitively. Unknown or missing
+        categories encode as all zeros.
+        """
+        self.numeric = list(numeric)
+        self.categorical = {name: [v for v in values if v is not None] for name, values in (categorical or {}).items()}
+        self.multi_hot = {name: list(values) for name, values in (multi_hot or {}).items()}
+
+        self.feature_names = list(self.numeric)
+        self._offsets = {}
+        self._lookups = {}
+        for name, values in list(self.categorical.items()) + list(self.multi_hot.items()):
+            self._offsets[name] = len(self.feature_names)
+            self._lookups[name] = {_category_key(v): j for j, v in enumerate(values)}
+            self.feature_names += [f'{name}={v}' for v in values]
+
+    @property
+    def n_features(self) -> int:
+        return len(self.feature_names)
+
+    @classmethod
+    def from_column_specs(cls, specs: Iterable[tuple], numeric: Optional[List[str]] = None) -> 'FeatureEncoder':
+        """
+        Build an encoder from synthetic data column specs.
+
+        Args:
+            specs (Iterable[tuple]): (name, kind, spec) column specs as used by
+                PatientSimilarity's synthetic generator
+            numeric (Optional[List[str]]): Numeric fields to put first
+
+        Returns:
+            FeatureEncoder: Encoder covering every spec'd column
+        """
+        numeric = list(numeric or [])
+        categorical, multi_hot = {}, {}
+        for name, kind, spec in specs:
+            if kind in ('int', 'float') or (kind == 'choice' and all(isinstance(v, bool) for v in spec)):
+                numeric.append(name)
+            elif kind == 'choice':
+                categorical[name] = list(spec)
+            elif kind == 'sample':
+                multi_hot[name] = list(spec[0])
+        return cls(numeric, categorical, multi_hot)
+
+    def encode(self, patients_data: Any) -> np.ndarray:
+        """
+        Encode patients into a feature matrix.
+
+        Args:
+            patients_data: List of patient data dictionaries, or a dict of
+                column arrays. Multi-hot columns may be given as lists of
+                items or, in column form, as (n, vocabulary size) bool arrays
+                in the encoder's vocabulary order.
+
+        Returns:
+            np.ndarray: float32 matrix of shape (n_patients, n_features)
+        """
+        if isinstance(patients_data, dict):
+            return self._encode_columns(patients_data)
+
+        n = len(patients_data)
+        X = np.zeros((n, self.n_features), dtype=np.float32)
+        if self.numeric:
+            # None becomes NaN
+            X[:, :len(self.numeric)] = np.array(
+                [[patient.get(name) for name in self.numeric] for patient in patients_data],
+                dtype=np.float64
+            ).reshape(n, len(self.numeric))
+
+        rows, cols = [], []
+        for i, patient in enumerate(patients_data):
+            for name in self.categorical:
+                j = self._lookups[name].get(_category_key(patient.get(name)))
+                if j is not None:
+                    rows.append(i)
+                    cols.append(self._offsets[name] + j)
+            for name in self.multi_hot:
+                for item in patient.get(name) or ():
+                    j = self._lookups[name].get(_category_key(item))
+                    if j is not None:
+                        rows.append(i)
+                        cols.append(self._offsets[name] + j)
+        X[rows, cols] = 1.0
+
+        return X
+
+    def _encode_columns(self, columns: Dict[str, Any]) -> np.ndarray:
+        """Encode a dict of column arrays."""
+        n = len(next(iter(columns.values())))
+        X = np.zeros((n, self.n_features), dtype=np.float32)
+
+        for j, name in enumerate(self.numeric):
+            X[:, j] = np.asarray(columns[name], dtype=np.float64) if name in columns else np.nan
+
+        for name in self.categorical:
+            if name not in columns:
+                continue
+            # Factorise once, then map the few distinct values to columns
+            codes, uniques = pd.factorize(np.asarray(columns[name], dtype=object), use_na_sentinel=True)
+            lookup = self._lookups[name]
+            mapped = np.array([lookup.get(_category_key(v), -1) for v in uniques] + [-1], dtype=np.int64)
+            cols = mapped[codes]
+            rows = np.flatnonzero(cols >= 0)
+            X[rows, self._offsets[name] + cols[rows]] = 1.0
+
+        for name, vocabulary in self.multi_hot.items():
+            if name not in columns:
+                continue
+            column = columns[name]
+            offset = self._offsets[name]
+            if isinstance(column, np.ndarray) and column.ndim == 2:
+                X[:, offset:offset + len(vocabulary)] = column
+            else:
+                lookup = self._lookups[name]
+                for i, items in enumerate(column):
+                    for item in items or ():
+                        j = lookup.get(_category_key(item))
+                        if j is not None:
+                            X[i, offset + j] = 1.0
+
+        return X
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serialisable schema."""
+        return {
+            'numeric': self.numeric,
+            'categorical': self.categorical,
+            'multi_hot': self.multi_hot
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> 'FeatureEncoder':
+        """Restore an encoder saved with to_dict()."""
+        return cls(state['numeric'], state['categorical'], state['multi_hot'])
+
+
+class PatientFeatureStore:
+    """
+    Cache of encoded feature vectors keyed by patient id.
+
+    Vectors live in one float32 matrix, with row_of mapping patient ids to
+    rows. Patients missing from the store are fetched through the loader and
+    encoded on first access; invalidate() drops rows so that their next
+    access reloads them.
+    """
+
+    def __init__(
+        self,
+        encoder: FeatureEncoder,
+        loader: Optional[Callable[[List[int]], List[Dict[str, Any]]]] = None
+    ):
+        """
+        Args:
+            encoder (FeatureEncoder): Schema used to encode patients
+            loader (Optional[Callable]): Returns patient records (with an 'id'
+                field) for a list of patient ids; ids it cannot find are left
+                out
+        """
+        self.encoder = encoder
+        self.loader = loader
+        self.row_of = {}
+        self._matrix = np.zeros((0, encoder.n_features), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._n = 0
+        self._csr = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __contains__(self, patient_id: int) -> bool:
+        return patient_id in self.row_of
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Encoded vectors of the stored patients, row i belongs to ids[i]."""
+        return self._matrix[:self._n]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._n]
+
+    def put(self, patients_data: Any, id_field: str = 'id') -> None:
+        """
+        Encode patients and store (or replace) their vectors.
+
+        Args:
+            patients_data: Patient records or columns, see FeatureEncoder.encode
+            id_field (str): Field holding the patient id
+        """
+        X = self.encoder.encode(patients_data)
+        if isinstance(patients_data, dict):
+            ids = np.asarray(patients_data[id_field], dtype=np.int64)
+        else:
+            ids = np.asarray([patient[id_field] for patient in patients_data], dtype=np.int64)
+
+        with self._lock:
+            self._csr = None
+            rows = np.empty(len(ids), dtype=np.int64)
+            n_new = 0
+            for i, patient_id in enumerate(ids.tolist()):
+                row = self.row_of.get(patient_id)
+                if row is None:
+                    row = self.row_of[patient_id] = self._n + n_new
+                    n_new += 1
+                rows[i] = row
+
+            self._reserve(self._n + n_new)
+            self._matrix[rows] = X
+            self._ids[rows] = ids
+            self._n += n_new
+
+    def get(self, patient_ids: Any) -> np.ndarray:
+        """
+        Encoded vectors for patients, loading the ones not yet stored.
+
+        Args:
+            patient_ids: Patient ids
+
+        Returns:
+            np.ndarray: float32 matrix with one row per id
+
+        Raises:
+            KeyError: If a patient is neither stored nor found by the loader
+        """
+        ids = np.atleast_1d(np.asarray(patient_ids, dtype=np.int64)).tolist()
+
+        with self._lock:
+            missing = [patient_id for patient_id in ids if patient_id not in self.row_of]
+            if missing and self.loader is not None:
+                records = self.loader(missing)
+                if records:
+                    self.put(records)
+
+            try:
+                rows = [self.row_of[patient_id] for patient_id in ids]
+            except KeyError as e:
+                raise KeyError(f"Unknown patient id: {e.args[0]}") from None
+            return self._matrix[rows]
+
+    def invalidate(self, patient_ids: Any) -> None:
+        """
+        Drop the vectors of patients whose data changed.
+
+        Args:
+            patient_ids: Patient ids; ids not in the store are ignored
+        """
+        ids = np.atleast_1d(np.asarray(patient_ids, dtype=np.int64)).tolist()
+
+        with self._lock:
+            for patient_id in ids:
+                row = self.row_of.pop(patient_id, None)
+                if row is None:
+                    continue
+                # Move the last row into the hole
+                last = self._n - 1
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self._ids[row] = self._ids[last]
+                    self.row_of[int(self._ids[row])] = row
+                self._n -= 1
+                self._csr = None
+
+    def clear(self) -> None:
+        """Drop every stored vector."""
+        with self._lock:
+            self.row_of = {}
+            self._n = 0
+            self._csr = None
+
+    def csr(self) -> sparse.csr_matrix:
+        """
+        The stored vectors as a CSR matrix, cached until the store changes.
+
+        One-hot and multi-hot columns are mostly zero, so this is the compact
+        form to hand to sparse-aware consumers. Missing numeric values (NaN)
+        are stored explicitly.
+        """
+        with self._lock:
+            if self._csr is None:
+                self._csr = sparse.csr_matrix(self.matrix)
+            return self._csr
+
+    def _reserve(self, n_rows: int) -> None:
+        """Grow the buffers (geometrically) to hold at least n_rows."""
+        if n_rows <= len(self._matrix) and self._matrix.flags.writeable:
+            return
+        capacity = max(n_rows, 2 * len(self._matrix), 64)
+        matrix = np.zeros((capacity, self.encoder.n_features), dtype=np.float32)
+        ids = np.zeros(capacity, dtype=np.int64)
+        matrix[:self._n] = self._matrix[:self._n]
+        ids[:self._n] = self._ids[:self._n]
+        self._matrix, self._ids = matrix, ids
+
+    def save(self, path: str) -> str:
+        """
+        Persist the store as a CSR matrix, ids and encoder schema.
+
+        Args:
+            path (str): Directory to write to
+
+        Returns:
+            str: Path to the directory
+        """
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            sparse.save_npz(os.path.join(path, 'features.npz'), self.csr())
+            np.save(os.path.join(path, 'feature_ids.npy'), self.ids)
+            with open(os.path.join(path, 'feature_encoder.json'), 'w') as f:
+                json.dump(self.encoder.to_dict(), f, indent=2)
+        return path
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        loader: Optional[Callable[[List[int]], List[Dict[str, Any]]]] = None
+    ) -> 'PatientFeatureStore':
+        """
+        Load a store written by save().
+
+        Args:
+            path (str): Directory written by save()
+            loader (Optional[Callable]): Loader for patients not in the store
+
+        Returns:
+            PatientFeatureStore: The restored store
+        """
+        with open(os.path.join(path, 'feature_encoder.json')) as f:
+            encoder = FeatureEncoder.from_dict(json.load(f))
+
+        store = cls(encoder, loader)
+        store._matrix = sparse.load_npz(os.path.join(path, 'features.npz')).toarray().astype(np.float32, copy=False)
+        store._ids = np.load(os.path.join(path, 'feature_ids.npy'))
+        store._n = len(store._ids)
+        store.row_of = {patient_id: row for row, patient_id in enumerate(store._ids.tolist())}
+        return store
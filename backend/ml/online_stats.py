@@ -0,0 +1,134 @@
+# backend/ml/online_stats.py
+"""
+Running per-column statistics that can be updated without re-reading history.
+
+Uses Welford's algorithm, generalised to batches with Chan et al.'s
+parallel update, so means and variances can be maintained over streams of
+rows and rows can be removed again.
+"""
+
+import numpy as np
+from typing import Dict, Any, Optional
+
+
+class RunningStats:
+    """Running count, mean and variance for each column of a stream of rows."""
+
+    def __init__(self, n_features: Optional[int] = None):
+        """
+        Args:
+            n_features (Optional[int]): Number of columns (inferred from the
+                first update when not given)
+        """
+        self.count = 0
+        self.mean = None if n_features is None else np.zeros(n_features)
+        self.m2 = None if n_features is None else np.zeros(n_features)
+
+    def update(self, X: np.ndarray) -> 'RunningStats':
+        """
+        Add a batch of rows.
+
+        Args:
+            X (np.ndarray): Rows of shape (n_rows, n_features) or a single row
+
+        Returns:
+            RunningStats: self, for chaining
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        n = len(X)
+        if n == 0:
+            return self
+        if self.mean is None:
+            self.mean = np.zeros(X.shape[1])
+            self.m2 = np.zeros(X.shape[1])
+
+        batch_mean = X.mean(axis=0)
+        batch_m2 = ((X - batch_mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = batch_mean - self.mean
+
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        return self
+
+    def remove(self, X: np.ndarray) -> 'RunningStats':
+        """
+        Remove a batch of rows that were previously added.
+
+        Args:
+            X (np.ndarray): Rows of shape (n_rows, n_features) or a single row
+
+        Returns:
+            RunningStats: self, for chaining
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        n = len(X)
+        if n == 0:
+            return self
+        if n >= self.count:
+            self.count = 0
+            self.mean = np.zeros_like(self.mean)
+            self.m2 = np.zeros_like(self.m2)
+            return self
+
+        batch_mean = X.mean(axis=0)
+        batch_m2 = ((X - batch_mean) ** 2).sum(axis=0)
+        remaining = self.count - n
+        remaining_mean = (self.mean * self.count - batch_mean * n) / remaining
+        delta = batch_mean - remaining_mean
+
+        self.m2 = np.maximum(self.m2 - batch_m2 - delta ** 2 * remaining * n / self.count, 0.0)
+        self.mean = remaining_mean
+        self.count = remaining
+        return self
+
+    def merge(self, other: 'RunningStats') -> 'RunningStats':
+        """
+        Combine the statistics of another stream into this one.
+
+        Args:
+            other (RunningStats): Statistics to merge in
+
+        Returns:
+            RunningStats: self, for chaining
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            return self
+
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / total
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / total
+        self.count = total
+        return self
+
+    @property
+    def var(self) -> np.ndarray:
+        """Population variance of each column."""
+        return self.m2 / max(self.count, 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        """Population standard deviation of each column."""
+        return np.sqrt(self.var)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serialisable state."""
+        return {
+            'count': int(self.count),
+            'mean': None if self.mean is None else self.mean.tolist(),
+            'm2': None if self.m2 is None else self.m2.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> 'RunningStats':
+        """Restore statistics saved with to_dict()."""
+        stats = cls()
+        stats.count = state['count']
+        stats.mean = None if state['mean'] is None else np.asarray(state['mean'], dtype=np.float64)
+        stats.m2 = None if state['m2'] is None else np.asarray(state['m2'], dtype=np.float64)
+        return stats
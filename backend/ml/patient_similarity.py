@@ -5,34 +5,212 @@ Scale and normalize the features
 Use cosine similarity to find the most similar patients
 Provide similarity scores and explanations
 Handle missing values automatically
-Generate synthetic patient data for testing and development
+Optionally encode categorical and list fields (one-hot / multi-hot)
+Generate synthetic patient data for testing and development, as records or
+as columnar arrays streamed in chunks
+Export patient data in bounded memory, including Parquet and Feather
+Persist the fitted scaler and neighbour index as a versioned artifact
+Add, update and remove patients incrementally, keyed by patient id
 """
 
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
 from sklearn.preprocessing import StandardScaler
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Iterable, Iterator, Union
 import pandas as pd
 import random
+import hashlib
+import json
+import os
+import threading
 from datetime import datetime, timedelta
 
+from .feature_store import FeatureEncoder
+from .online_stats import RunningStats
+from .similarity_index import BruteForceIndex, RowStore, create_index, normalize_rows, recall_at_k
+
+# Features used for similarity, in matrix column order
+SIMILARITY_FEATURES = [
+    'age',
+    'cognitive_score',
+    'mood_score',
+    'sleep_hours',
+    'medication_adherence',
+    'social_interaction_score'
+]
+
+# Bump whenever the on-disk artifact layout changes
+ARTIFACT_FORMAT_VERSION = 4
+ARTIFACT_MANIFEST = 'manifest.json'
+
+# Synthetic data vocabularies
+GENDERS = ['Male', 'Female']
+EDUCATION_LEVELS = ['Primary', 'Secondary', 'Bachelor', 'Master', 'PhD']
+MARITAL_STATUSES = ['Single', 'Married', 'Divorced', 'Widowed']
+LIVING_SITUATIONS = ['Independent', 'With Family', 'Assisted Living', 'Nursing Home']
+INCOME_LEVELS = ['Low', 'Medium', 'High']
+LOCATION_TYPES = ['Urban', 'Suburban', 'Rural']
+
+# Common conditions in elderly population
+MEDICAL_CONDITIONS = [
+    'Hypertension', 'Diabetes', 'Heart Disease', 'Arthritis',
+    'Osteoporosis', 'Depression', 'Anxiety', 'Sleep Apnea',
+    'Chronic Pain', 'Vision Problems', 'Hearing Loss'
+]
+MEDICATIONS = [
+    'Donepezil', 'Memantine', 'Rivastigmine', 'Galantamine',
+    'Sertraline', 'Escitalopram', 'Bupropion', 'Mirtazapine',
+    'Lorazepam', 'Zolpidem', 'Melatonin', 'Vitamin D',
+    'Calcium', 'Omega-3', 'B12', 'Folic Acid'
+]
+SMOKING_HISTORY = ['Never', 'Former', 'Current']
+ALCOHOL_CONSUMPTION = ['None', 'Occasional', 'Moderate', 'Heavy']
+EXERCISE_FREQUENCY = ['Never', 'Rarely', 'Sometimes', 'Regularly', 'Daily']
+FALL_INCIDENTS = [None, '1_month_ago', '3_months_ago', '6_months_ago', '1_year_ago']
+
+# Multi-hot columns and their vocabularies, in column order
+MULTI_HOT_VOCABULARIES = {
+    'medical_conditions': MEDICAL_CONDITIONS,
+    'medications': MEDICATIONS
+}
+
+# Synthetic column specs as (name, kind, spec), in generation order:
+#   'int'    -> (low, high), inclusive
+#   'float'  -> (low, high, decimals)
+#   'choice' -> vocabulary
+#   'sample' -> (vocabulary, weights of drawing 0, 1, 2, ... items)
+DEMOGRAPHIC_COLUMNS = [
+    ('gender', 'choice', GENDERS),
+    ('education_level', 'choice', EDUCATION_LEVELS),
+    ('marital_status', 'choice', MARITAL_STATUSES),
+    ('living_situation', 'choice', LIVING_SITUATIONS),
+    ('income_level', 'choice', INCOME_LEVELS),
+    ('location_type', 'choice', LOCATION_TYPES)
+]
+
+MEDICAL_HISTORY_COLUMNS = [
+    ('medical_conditions', 'sample', (MEDICAL_CONDITIONS, [0.2, 0.3, 0.25, 0.15, 0.1])),
+    ('medications', 'sample', (MEDICATIONS, [0.1, 0.2, 0.25, 0.2, 0.15, 0.1])),
+    ('years_since_diagnosis', 'int', (0, 15)),
+    ('family_history_alzheimer', 'choice', [True, False]),
+    ('smoking_history', 'choice', SMOKING_HISTORY),
+    ('alcohol_consumption', 'choice', ALCOHOL_CONSUMPTION),
+    ('exercise_frequency', 'choice', EXERCISE_FREQUENCY),
+    ('bmi', 'float', (18.5, 35.0, 1)),
+    ('blood_pressure_systolic', 'int', (90, 180)),
+    ('blood_pressure_diastolic', 'int', (60, 100)),
+    ('cholesterol_total', 'int', (150, 300)),
+    ('blood_sugar_fasting', 'int', (70, 200))
+]
+
+BEHAVIORAL_COLUMNS = [
+    # Daily activity patterns, minutes per day
+    ('reading', 'int', (0, 120)),
+    ('walking', 'int', (0, 60)),
+    ('social_media', 'int', (0, 90)),
+    ('tv_watching', 'int', (0, 240)),
+    ('puzzle_solving', 'int', (0, 60)),
+    ('cooking', 'int', (0, 90)),
+    ('gardening', 'int', (0, 120)),
+    ('music_listening', 'int', (0, 120)),
+    # Weekly patterns
+    ('doctor_visits_per_month', 'int', (0, 4)),
+    ('family_visits_per_week', 'int', (0, 7)),
+    ('social_events_per_month', 'int', (0, 8)),
+    ('hobby_activities_per_week', 'int', (0, 5)),
+    # Cognitive assessment scores
+    ('memory_test_score', 'float', (5.0, 25.0, 1)),
+    ('attention_test_score', 'float', (10.0, 30.0, 1)),
+    ('language_test_score', 'float', (15.0, 30.0, 1)),
+    ('visuospatial_test_score', 'float', (8.0, 25.0, 1)),
+    ('executive_function_score', 'float', (10.0, 30.0, 1)),
+    # Quality of life indicators
+    ('life_satisfaction', 'int', (1, 10)),
+    ('independence_level', 'int', (1, 10)),
+    ('social_support', 'int', (1, 10)),
+    ('financial_security', 'int', (1, 10)),
+    ('access_to_care', 'int', (1, 10)),
+    ('technology_comfort', 'int', (1, 10)),
+    ('caregiver_support', 'choice', [True, False]),
+    ('emergency_contacts', 'int', (0, 5)),
+    ('last_fall_incident', 'choice', FALL_INCIDENTS),
+    ('wandering_incidents', 'int', (0, 10)),
+    ('agitation_episodes', 'int', (0, 20)),
+    ('sleep_quality', 'int', (1, 10)),
+    ('appetite_level', 'int', (1, 10)),
+    ('energy_level', 'int', (1, 10))
+]
+
+
+def synthetic_feature_encoder() -> FeatureEncoder:
+    """
+    Multi-modal encoder covering every column of the synthetic generator.
+    
+    Returns:
+        FeatureEncoder: SIMILARITY_FEATURES first, then the remaining numeric
+        and boolean columns, one-hot categoricals and multi-hot conditions
+        and medications
+    """
+    return FeatureEncoder.from_column_specs(
+        DEMOGRAPHIC_COLUMNS + MEDICAL_HISTORY_COLUMNS + BEHAVIORAL_COLUMNS,
+        numeric=SIMILARITY_FEATURES
+    )
+
 class PatientSimilarity:
-    def __init__(self, n_neighbors: int = 5):
+    def __init__(
+        self,
+        n_neighbors: int = 5,
+        index: str = 'brute',
+        index_params: Optional[Dict[str, Any]] = None,
+        target_recall: Optional[float] = None,
+        drift_threshold: float = 0.1,
+        max_pending_fraction: float = 0.1,
+        auto_rebuild: bool = True,
+        encoder: Optional[FeatureEncoder] = None,
+        dtype: str = 'float32'
+    ):
         """
         Initialize the PatientSimilarity class.
         
         Args:
             n_neighbors (int): Number of nearest neighbors to find
+            index (str): Neighbour index backend ('brute' or 'sharded' for
+                exact search, 'ivf' or 'quantized' for approximate search)
+            index_params (Optional[Dict[str, Any]]): Index backend parameters
+            target_recall (Optional[float]): For approximate backends, recall@k
+                against exact search to tune the index for at fit time
+            drift_threshold (float): Scaler drift (see drift()) above which
+                incremental updates trigger a rebuild
+            max_pending_fraction (float): Fraction of rows waiting in an
+                approximate index's pending buffer above which a rebuild is
+                triggered
+            auto_rebuild (bool): Rebuild in a background thread when needed
+            encoder (Optional[FeatureEncoder]): Multi-modal feature schema
+                (see synthetic_feature_encoder()); when None only the numeric
+                SIMILARITY_FEATURES are used
+            dtype (str): Storage dtype of the raw feature matrix and, unless
+                index_params sets its own, of the index rows
         """
         self.n_neighbors = n_neighbors
-        self.model = NearestNeighbors(
-            n_neighbors=n_neighbors,
-            metric='cosine',
-            algorithm='brute'
-        )
+        self.encoder = encoder
+        self.dtype = dtype
+        self.index = create_index(index, **{'dtype': dtype, **(index_params or {})})
+        self.target_recall = target_recall
+        self.recall_report = None
         self.scaler = StandardScaler()
         self.feature_names = None
         self.is_fitted = False
+        self.model_version = None
+        
+        # Incremental updates
+        self.drift_threshold = drift_threshold
+        self.max_pending_fraction = max_pending_fraction
+        self.auto_rebuild = auto_rebuild
+        self.raw = RowStore(dtype=np.dtype(dtype))
+        self.stats = RunningStats()
+        self.revision = 0
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+        self._journal = None
 
     def generate_synthetic_data(
         self,
@@ -100,115 +278,195 @@ class PatientSimilarity:
         
         return patients_data
 
-    def _generate_demographics(self) -> Dict[str, Any]:
-        """Generate demographic information for a patient."""
-        genders = ['Male', 'Female']
-        education_levels = ['Primary', 'Secondary', 'Bachelor', 'Master', 'PhD']
-        marital_statuses = ['Single', 'Married', 'Divorced', 'Widowed']
+    def generate_synthetic_columns(
+        self,
+        num_patients: int = 100,
+        age_range: Tuple[int, int] = (60, 90),
+        cognitive_score_range: Tuple[float, float] = (10.0, 30.0),
+        mood_score_range: Tuple[float, float] = (1.0, 10.0),
+        sleep_hours_range: Tuple[float, float] = (4.0, 10.0),
+        medication_adherence_range: Tuple[float, float] = (0.5, 1.0),
+        social_interaction_range: Tuple[float, float] = (1.0, 10.0),
+        include_demographics: bool = True,
+        include_medical_history: bool = True,
+        include_behavioral_data: bool = True,
+        seed: Optional[Union[int, np.random.SeedSequence]] = None,
+        start_id: int = 1
+    ) -> Dict[str, np.ndarray]:
+        """
+        Generate synthetic patient data as columns, in one vectorised pass.
         
-        return {
-            'gender': random.choice(genders),
-            'education_level': random.choice(education_levels),
-            'marital_status': random.choice(marital_statuses),
-            'living_situation': random.choice(['Independent', 'With Family', 'Assisted Living', 'Nursing Home']),
-            'income_level': random.choice(['Low', 'Medium', 'High']),
-            'location_type': random.choice(['Urban', 'Suburban', 'Rural'])
-        }
-
-    def _generate_medical_history(self) -> Dict[str, Any]:
-        """Generate medical history for a patient."""
-        # Common conditions in elderly population
-        conditions = [
-            'Hypertension', 'Diabetes', 'Heart Disease', 'Arthritis', 
-            'Osteoporosis', 'Depression', 'Anxiety', 'Sleep Apnea',
-            'Chronic Pain', 'Vision Problems', 'Hearing Loss'
-        ]
+        Takes the same options as generate_synthetic_data() but returns a dict
+        of equal-length arrays instead of a list of dicts. Numeric columns are
+        int32/float64 arrays, boolean columns are bool arrays, categorical
+        columns are object arrays sharing the vocabulary strings, and the
+        multi-hot columns in MULTI_HOT_VOCABULARIES are (num_patients,
+        vocabulary size) bool arrays. The result can be passed to fit() and
+        the query methods directly, or converted with columns_to_records().
         
-        # Generate random number of conditions (0-4)
-        num_conditions = random.choices([0, 1, 2, 3, 4], weights=[0.2, 0.3, 0.25, 0.15, 0.1])[0]
-        selected_conditions = random.sample(conditions, num_conditions) if num_conditions > 0 else []
+        Args:
+            num_patients (int): Number of patients to generate
+            age_range (Tuple[int, int]): Range for patient ages
+            cognitive_score_range (Tuple[float, float]): Range for cognitive scores (MMSE)
+            mood_score_range (Tuple[float, float]): Range for mood scores (1-10 scale)
+            sleep_hours_range (Tuple[float, float]): Range for average sleep hours
+            medication_adherence_range (Tuple[float, float]): Range for medication adherence (0-1)
+            social_interaction_range (Tuple[float, float]): Range for social interaction scores (1-10)
+            include_demographics (bool): Whether to include demographic information
+            include_medical_history (bool): Whether to include medical history
+            include_behavioral_data (bool): Whether to include behavioral data
+            seed (Optional[Union[int, np.random.SeedSequence]]): Seed for the
+                NumPy generator; independent of the random module state
+            start_id (int): Id of the first generated patient
+            
+        Returns:
+            Dict[str, np.ndarray]: Column name to array of values
+        """
+        rng = np.random.default_rng(seed)
         
-        # Generate medication list
-        medications = [
-            'Donepezil', 'Memantine', 'Rivastigmine', 'Galantamine',
-            'Sertraline', 'Escitalopram', 'Bupropion', 'Mirtazapine',
-            'Lorazepam', 'Zolpidem', 'Melatonin', 'Vitamin D',
-            'Calcium', 'Omega-3', 'B12', 'Folic Acid'
+        specs = [
+            ('age', 'int', age_range),
+            ('cognitive_score', 'float', (*cognitive_score_range, 1)),
+            ('mood_score', 'float', (*mood_score_range, 1)),
+            ('sleep_hours', 'float', (*sleep_hours_range, 1)),
+            ('medication_adherence', 'float', (*medication_adherence_range, 2)),
+            ('social_interaction_score', 'float', (*social_interaction_range, 1))
         ]
+        if include_demographics:
+            specs += DEMOGRAPHIC_COLUMNS
+        if include_medical_history:
+            specs += MEDICAL_HISTORY_COLUMNS
+        if include_behavioral_data:
+            specs += BEHAVIORAL_COLUMNS
         
-        num_medications = random.choices([0, 1, 2, 3, 4, 5], weights=[0.1, 0.2, 0.25, 0.2, 0.15, 0.1])[0]
-        selected_medications = random.sample(medications, num_medications) if num_medications > 0 else []
+        columns = {'id': np.arange(start_id, start_id + num_patients, dtype=np.int64)}
+        for name, kind, spec in specs:
+            columns[name] = self._sample_column(rng, kind, spec, num_patients)
         
-        return {
-            'medical_conditions': selected_conditions,
-            'medications': selected_medications,
-            'years_since_diagnosis': random.randint(0, 15),
-            'family_history_alzheimer': random.choice([True, False]),
-            'smoking_history': random.choice(['Never', 'Former', 'Current']),
-            'alcohol_consumption': random.choice(['None', 'Occasional', 'Moderate', 'Heavy']),
-            'exercise_frequency': random.choice(['Never', 'Rarely', 'Sometimes', 'Regularly', 'Daily']),
-            'bmi': round(random.uniform(18.5, 35.0), 1),
-            'blood_pressure_systolic': random.randint(90, 180),
-            'blood_pressure_diastolic': random.randint(60, 100),
-            'cholesterol_total': random.randint(150, 300),
-            'blood_sugar_fasting': random.randint(70, 200)
-        }
+        return columns
 
-    def _generate_behavioral_data(self) -> Dict[str, Any]:
-        """Generate behavioral and lifestyle data for a patient."""
-        # Generate daily activity patterns
-        activities = {
-            'reading': random.randint(0, 120),  # minutes per day
-            'walking': random.randint(0, 60),
-            'social_media': random.randint(0, 90),
-            'tv_watching': random.randint(0, 240),
-            'puzzle_solving': random.randint(0, 60),
-            'cooking': random.randint(0, 90),
-            'gardening': random.randint(0, 120),
-            'music_listening': random.randint(0, 120)
-        }
+    def iter_synthetic_chunks(
+        self,
+        num_patients: int,
+        chunk_size: int = 100000,
+        seed: Optional[int] = None,
+        **kwargs
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Stream a large synthetic cohort as columnar chunks.
         
-        # Generate weekly patterns
-        weekly_patterns = {
-            'doctor_visits_per_month': random.randint(0, 4),
-            'family_visits_per_week': random.randint(0, 7),
-            'social_events_per_month': random.randint(0, 8),
-            'hobby_activities_per_week': random.randint(0, 5)
-        }
+        Each chunk gets its own child of np.random.SeedSequence(seed), so the
+        output for a given (seed, chunk_size) is reproducible and chunks can
+        be generated independently of one another. Ids continue across chunks.
         
-        # Generate cognitive assessment scores
-        cognitive_scores = {
-            'memory_test_score': round(random.uniform(5.0, 25.0), 1),
-            'attention_test_score': round(random.uniform(10.0, 30.0), 1),
-            'language_test_score': round(random.uniform(15.0, 30.0), 1),
-            'visuospatial_test_score': round(random.uniform(8.0, 25.0), 1),
-            'executive_function_score': round(random.uniform(10.0, 30.0), 1)
-        }
+        Args:
+            num_patients (int): Total number of patients to generate
+            chunk_size (int): Maximum number of patients per chunk
+            seed (Optional[int]): Root seed; fresh entropy when None
+            **kwargs: Further options for generate_synthetic_columns()
+            
+        Yields:
+            Dict[str, np.ndarray]: Columns for the next chunk of patients
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
         
-        # Generate quality of life indicators
-        quality_of_life = {
-            'life_satisfaction': random.randint(1, 10),
-            'independence_level': random.randint(1, 10),
-            'social_support': random.randint(1, 10),
-            'financial_security': random.randint(1, 10),
-            'access_to_care': random.randint(1, 10)
-        }
+        n_chunks = -(-num_patients // chunk_size)
+        children = np.random.SeedSequence(seed).spawn(n_chunks)
+        for i, child in enumerate(children):
+            start = i * chunk_size
+            yield self.generate_synthetic_columns(
+                num_patients=min(chunk_size, num_patients - start),
+                seed=child,
+                start_id=start + 1,
+                **kwargs
+            )
+
+    @staticmethod
+    def columns_to_records(columns: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+        """
+        Convert columnar synthetic data to the list-of-dicts format.
         
-        return {
-            **activities,
-            **weekly_patterns,
-            **cognitive_scores,
-            **quality_of_life,
-            'technology_comfort': random.randint(1, 10),
-            'caregiver_support': random.choice([True, False]),
-            'emergency_contacts': random.randint(0, 5),
-            'last_fall_incident': random.choice([None, '1_month_ago', '3_months_ago', '6_months_ago', '1_year_ago']),
-            'wandering_incidents': random.randint(0, 10),
-            'agitation_episodes': random.randint(0, 20),
-            'sleep_quality': random.randint(1, 10),
-            'appetite_level': random.randint(1, 10),
-            'energy_level': random.randint(1, 10)
-        }
+        Args:
+            columns (Dict[str, np.ndarray]): Output of generate_synthetic_columns()
+            
+        Returns:
+            List[Dict[str, Any]]: Patient dictionaries with Python values
+        """
+        values = {}
+        for name, column in columns.items():
+            if name in MULTI_HOT_VOCABULARIES and column.ndim == 2:
+                lists = PatientSimilarity._multi_hot_to_lists(column, MULTI_HOT_VOCABULARIES[name])
+                values[name] = [list(items) for items in lists]
+            else:
+                values[name] = column.tolist()
+        
+        names = list(values)
+        return [dict(zip(names, row)) for row in zip(*values.values())]
+
+    @staticmethod
+    def _multi_hot_to_lists(column: np.ndarray, vocabulary: List[str]) -> np.ndarray:
+        """
+        Decode a multi-hot bool matrix into an object array of name lists.
+        
+        Rows with the same items share one list object, so each distinct
+        pattern is decoded once; copy the lists before mutating them.
+        """
+        codes = column.astype(np.int64) @ (np.int64(1) << np.arange(column.shape[1], dtype=np.int64))
+        patterns, inverse = np.unique(codes, return_inverse=True)
+        decoded = np.empty(len(patterns), dtype=object)
+        for i, code in enumerate(patterns.tolist()):
+            decoded[i] = [item for j, item in enumerate(vocabulary) if code >> j & 1]
+        return decoded[inverse.reshape(-1)]
+
+    @staticmethod
+    def _sample_column(rng: np.random.Generator, kind: str, spec: Any, n: int) -> np.ndarray:
+        """Draw n values for one synthetic column spec."""
+        if kind == 'int':
+            return rng.integers(spec[0], spec[1], size=n, dtype=np.int32, endpoint=True)
+        if kind == 'float':
+            return np.round(rng.uniform(spec[0], spec[1], size=n), spec[2])
+        if kind == 'choice':
+            dtype = bool if all(isinstance(v, bool) for v in spec) else object
+            vocabulary = np.array(spec, dtype=dtype)
+            return vocabulary[rng.integers(0, len(spec), size=n)]
+        if kind == 'sample':
+            # Multi-hot draw of `count` distinct items per row: keep the items
+            # whose random keys are among the row's `count` smallest
+            vocabulary, weights = spec
+            p = np.asarray(weights, dtype=np.float64)
+            counts = rng.choice(len(p), size=n, p=p / p.sum())
+            keys = rng.random((n, len(vocabulary)))
+            kth = np.sort(keys, axis=1)[np.arange(n), np.maximum(counts - 1, 0)]
+            return (keys <= kth[:, None]) & (counts > 0)[:, None]
+        raise ValueError(f"Unknown synthetic column kind '{kind}'")
+
+    @staticmethod
+    def _sample_value(kind: str, spec: Any) -> Any:
+        """Draw one value for a synthetic column spec using the random module."""
+        if kind == 'int':
+            return random.randint(spec[0], spec[1])
+        if kind == 'float':
+            return round(random.uniform(spec[0], spec[1]), spec[2])
+        if kind == 'choice':
+            return random.choice(spec)
+        if kind == 'sample':
+            vocabulary, weights = spec
+            count = random.choices(range(len(weights)), weights=weights)[0]
+            return random.sample(vocabulary, count) if count > 0 else []
+        raise ValueError(f"Unknown synthetic column kind '{kind}'")
+
+    def _generate_demographics(self) -> Dict[str, Any]:
+        """Generate demographic information for a patient."""
+        return {name: self._sample_value(kind, spec) for name, kind, spec in DEMOGRAPHIC_COLUMNS}
+
+    def _generate_medical_history(self) -> Dict[str, Any]:
+        """Generate medical history for a patient."""
+        return {name: self._sample_value(kind, spec) for name, kind, spec in MEDICAL_HISTORY_COLUMNS}
+
+    def _generate_behavioral_data(self) -> Dict[str, Any]:
+        """Generate behavioral and lifestyle data for a patient."""
+        return {name: self._sample_value(kind, spec) for name, kind, spec in BEHAVIORAL_COLUMNS}
 
     def generate_clinical_scenarios(
         self,
@@ -320,11 +578,15 @@ class PatientSimilarity:
         Args:
             data (List[Dict[str, Any]]): Data to export
             filename (str): Output filename
-            format (str): Export format ('csv', 'json', 'excel')
+            format (str): Export format ('csv', 'json', 'excel', or any
+                format supported by export_data_stream())
             
         Returns:
             str: Path to the exported file
         """
+        if format.lower() in ('jsonl', 'parquet', 'feather'):
+            return self.export_data_stream([data], filename, format)
+        
         df = pd.DataFrame(data)
         
         if format.lower() == 'csv':
@@ -338,80 +600,719 @@ class PatientSimilarity:
         
         return filename
 
-    def _prepare_features(self, patients_data: List[Dict[str, Any]]) -> np.ndarray:
+    def export_data_stream(
+        self,
+        chunks: Iterable[Union[List[Dict[str, Any]], Dict[str, np.ndarray]]],
+        filename: str = 'generated_patient_data.csv',
+        format: str = 'csv',
+        compression: Optional[str] = None
+    ) -> str:
         """
-        Prepare patient features for similarity analysis.
+        Export patient data chunk by chunk, without holding the whole dataset.
+        
+        Only one chunk is converted and in memory at a time. Chunks may be
+        lists of patient dictionaries or columnar dicts from
+        iter_synthetic_chunks(). Multi-hot columns are written as lists of
+        names, as in the record format.
+        
+        Parquet and Feather need pyarrow. Parquet is zstd-compressed by
+        default. Feather is written uncompressed by default so it can be
+        memory-mapped and read without copying.
         
         Args:
-            patients_data (List[Dict]): List of patient data dictionaries
+            chunks (Iterable): Chunks of patient data, all with the same columns
+            filename (str): Output filename
+            format (str): Export format ('csv', 'json', 'jsonl', 'parquet', 'feather')
+            compression (Optional[str]): Parquet/Feather codec ('zstd', 'lz4',
+                'snappy' for Parquet only, or 'uncompressed'); format default when None
             
         Returns:
-            np.ndarray: Prepared feature matrix
+            str: Path to the exported file
         """
-        # Convert to DataFrame for easier processing
-        df = pd.DataFrame(patients_data)
-        
-        # Select relevant features for similarity
-        features = [
-            'age',
-            'cognitive_score',
-            'mood_score',
-            'sleep_hours',
-            'medication_adherence',
-            'social_interaction_score'
-        ]
+        format = format.lower()
+        if format not in ('csv', 'json', 'jsonl', 'parquet', 'feather'):
+            raise ValueError(f"Unsupported streaming format: {format}")
+        frames = (df for df in map(self._chunk_frame, chunks) if len(df))
+        
+        if format in ('parquet', 'feather'):
+            self._write_arrow_stream(frames, filename, format, compression)
+            return filename
         
+        with open(filename, 'w', newline='', encoding='utf-8') as f:
+            if format == 'csv':
+                for i, df in enumerate(frames):
+                    df.to_csv(f, header=(i == 0), index=False)
+            elif format == 'jsonl':
+                for df in frames:
+                    f.write(df.to_json(orient='records', lines=True).rstrip('\n') + '\n')
+            else:
+                # One JSON array, appending each chunk's records as they arrive
+                f.write('[')
+                first = True
+                for df in frames:
+                    if not first:
+                        f.write(',')
+                    f.write(df.to_json(orient='records')[1:-1])
+                    first = False
+                f.write(']')
+        
+        return filename
+
+    def export_synthetic_cohort(
+        self,
+        num_patients: int,
+        filename: str = 'generated_patient_data.parquet',
+        format: str = 'parquet',
+        chunk_size: int = 100000,
+        seed: Optional[int] = None,
+        compression: Optional[str] = None,
+        **kwargs
+    ) -> str:
+        """
+        Generate and export a synthetic cohort in bounded memory.
+        
+        Args:
+            num_patients (int): Number of patients to generate
+            filename (str): Output filename
+            format (str): Export format, see export_data_stream()
+            chunk_size (int): Patients generated and written per chunk
+            seed (Optional[int]): Root seed, see iter_synthetic_chunks()
+            compression (Optional[str]): Parquet/Feather codec
+            **kwargs: Further options for generate_synthetic_columns()
+            
+        Returns:
+            str: Path to the exported file
+        """
+        chunks = self.iter_synthetic_chunks(num_patients, chunk_size=chunk_size, seed=seed, **kwargs)
+        return self.export_data_stream(chunks, filename, format, compression=compression)
+
+    @staticmethod
+    def _chunk_frame(chunk: Union[List[Dict[str, Any]], Dict[str, np.ndarray]]) -> pd.DataFrame:
+        """Build a DataFrame for one export chunk."""
+        if not isinstance(chunk, dict):
+            return pd.DataFrame(chunk)
+        
+        columns = {}
+        for name, column in chunk.items():
+            if name in MULTI_HOT_VOCABULARIES and column.ndim == 2:
+                column = PatientSimilarity._multi_hot_to_lists(column, MULTI_HOT_VOCABULARIES[name])
+            columns[name] = column
+        return pd.DataFrame(columns, copy=False)
+
+    @staticmethod
+    def _write_arrow_stream(
+        frames: Iterator[pd.DataFrame],
+        filename: str,
+        format: str,
+        compression: Optional[str]
+    ) -> None:
+        """Write DataFrames to a single Parquet or Feather file as they arrive."""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError(
+                f"{format.capitalize()} export requires pyarrow (pip install pyarrow)"
+            ) from e
+        
+        writer = None
+        schema = None
+        try:
+            for df in frames:
+                table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    if format == 'parquet':
+                        writer = pq.ParquetWriter(filename, schema, compression=compression or 'zstd')
+                    else:
+                        codec = None if compression in (None, 'uncompressed') else compression
+                        options = pa.ipc.IpcWriteOptions(compression=codec)
+                        writer = pa.ipc.new_file(filename, schema, options=options)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        
+        if writer is None:
+            raise ValueError("No data to export")
+
+    def _extract_features(self, patients_data: Any) -> np.ndarray:
+        """
+        Extract the raw (unscaled) similarity features from patient data.
+        
+        Builds the feature matrix in a single pass without going through a
+        DataFrame, so batches of queries stay cheap.
+        
+        Args:
+            patients_data: List of patient data dictionaries, a dict of
+                per-feature column arrays, or an already extracted raw matrix
+                (such as vectors from a PatientFeatureStore)
+            
+        Returns:
+            np.ndarray: Raw feature matrix, NaN where a value is missing
+        """
         # Store feature names
-        self.feature_names = features
+        self.feature_names = list(SIMILARITY_FEATURES if self.encoder is None else self.encoder.feature_names)
         
-        # Extract features and handle missing values
-        X = df[features].fillna(df[features].mean())
+        if isinstance(patients_data, np.ndarray):
+            return patients_data.astype(float, copy=False)
+        
+        if self.encoder is not None:
+            return self.encoder.encode(patients_data).astype(float)
+        
+        if isinstance(patients_data, dict):
+            n_rows = len(next(iter(patients_data.values())))
+            return np.column_stack([
+                np.asarray(patients_data[feature], dtype=float) if feature in patients_data
+                else np.full(n_rows, np.nan)
+                for feature in self.feature_names
+            ])
+        
+        # Missing keys and None values become NaN rather than raising
+        return np.array(
+            [[patient.get(feature) for feature in self.feature_names] for patient in patients_data],
+            dtype=float
+        ).reshape(-1, len(self.feature_names))
+
+    def _extract_ids(self, patients_data: Any, id_field: Optional[str]) -> np.ndarray:
+        """
+        Extract the id of each patient.
+        
+        Args:
+            patients_data: Patient data in any form accepted by _extract_features
+            id_field (Optional[str]): Field holding the patient id, or None to
+                use the position of each patient
+            
+        Returns:
+            np.ndarray: int64 id of each patient
+        """
+        if isinstance(patients_data, dict):
+            if id_field is None:
+                return np.arange(len(next(iter(patients_data.values()))), dtype=np.int64)
+            return np.asarray(patients_data[id_field], dtype=np.int64)
+        if id_field is None:
+            return np.arange(len(patients_data), dtype=np.int64)
+        return np.asarray([patient[id_field] for patient in patients_data], dtype=np.int64)
+
+    def _prepare_features(self, patients_data: Any) -> np.ndarray:
+        """
+        Prepare patient features for similarity analysis and fit the scaler.
+        
+        Only used when fitting on a cohort; queries go through
+        _transform_features so the scaler is never refit on a single row.
+        
+        Args:
+            patients_data: Patient data in any form accepted by _extract_features
+            
+        Returns:
+            np.ndarray: Prepared feature matrix
+        """
+        X = self._extract_features(patients_data)
+        
+        # Handle missing values with the cohort means
+        X = np.where(np.isnan(X), np.nanmean(X, axis=0), X)
         
         # Scale features
         X_scaled = self.scaler.fit_transform(X)
         
         return X_scaled
 
-    def fit(self, patients_data: List[Dict[str, Any]]) -> None:
+    def _transform_features(self, patients_data: Any) -> np.ndarray:
+        """
+        Scale patient features with the already fitted scaler.
+        
+        Args:
+            patients_data: Patient data in any form accepted by _extract_features
+            
+        Returns:
+            np.ndarray: Scaled feature matrix
+        """
+        X = self._extract_features(patients_data)
+        
+        # Missing values fall back to the cohort means seen at fit time
+        X = np.where(np.isnan(X), self.scaler.mean_, X)
+        
+        return self._scale(X)
+
+    def _scale(self, X: np.ndarray) -> np.ndarray:
         """
-        Fit the KNN model on patient data.
+        Apply the fitted scaler to an imputed raw matrix.
+        
+        Same arithmetic as StandardScaler.transform, without its per-call
+        input validation, which dominates the cost of small query batches.
+        """
+        return (X - self.scaler.mean_) / self.scaler.scale_
+
+    def fit(self, patients_data: List[Dict[str, Any]], id_field: Optional[str] = None) -> None:
+        """
+        Fit the scaler and neighbour index on patient data.
         
         Args:
             patients_data (List[Dict]): List of patient data dictionaries
+            id_field (Optional[str]): Field holding the patient id that results
+                and incremental updates are keyed by; when None, patients are
+                keyed by their position in patients_data
+        """
+        raw = self._extract_features(patients_data)
+        raw = np.where(np.isnan(raw), np.nanmean(raw, axis=0), raw)
+        ids = self._extract_ids(patients_data, id_field)
+        
+        with self._lock:
+            X = self._prepare_features(raw)
+            self.index.build(X, ids)
+            self.raw.reset(raw.astype(self.dtype, copy=False), ids)
+            self.stats = RunningStats().update(raw)
+            self.model_version = self._compute_model_version(X)
+            self.revision = 0
+            self.is_fitted = True
+        
+        if self.target_recall is not None and hasattr(self.index, 'tune'):
+            queries, exact_ids = self._recall_sample(self.n_neighbors)
+            tuning = self.index.tune(queries, self.n_neighbors, self.target_recall, exact_ids)
+            self.recall_report = self.evaluate_recall()
+            self.recall_report['tuning'] = tuning
+
+    def _recall_sample(
+        self,
+        k: int,
+        n_queries: int = 200,
+        seed: int = 0
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Sample indexed rows as queries and compute their exact top-k ids."""
+        vectors, ids = self.index.snapshot()
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False)
+        queries = np.asarray(vectors[np.sort(rows)])
+        
+        exact = BruteForceIndex()
+        exact.store.reset(vectors, ids)
+        exact_ids, _ = exact.search(queries, k)
+        
+        return queries, exact_ids
+
+    def evaluate_recall(
+        self,
+        k: Optional[int] = None,
+        n_queries: int = 200,
+        seed: int = 0
+    ) -> Dict[str, Any]:
+        """
+        Measure recall@k of the configured index against exact search.
+        
+        Args:
+            k (Optional[int]): Number of neighbours (defaults to n_neighbors)
+            n_queries (int): Number of cohort rows sampled as queries
+            seed (int): Random seed for the query sample
+            
+        Returns:
+            Dict[str, Any]: Backend name, k, number of queries, recall@k and
+            the index memory usage in bytes
         """
-        X = self._prepare_features(patients_data)
-        self.model.fit(X)
-        self.is_fitted = True
+        if not self.is_fitted:
+            raise ValueError("Model must be fitted before recall can be evaluated")
+        
+        k = k or self.n_neighbors
+        with self._lock:
+            queries, exact_ids = self._recall_sample(k, n_queries, seed)
+            approx_ids, _ = self.index.search(queries, k)
+        
+        return {
+            'backend': self.index.name,
+            'k': k,
+            'n_queries': len(queries),
+            'recall': recall_at_k(approx_ids, exact_ids),
+            'memory': self.index.memory_usage()
+        }
+
+    def upsert_patients(self, patients_data: Any, id_field: str = 'id') -> None:
+        """
+        Add new patients or update existing ones without refitting.
+        
+        Running feature statistics are updated online (Welford), rows are
+        scaled with the current scaler and written to the index in place. A
+        rebuild is triggered when drift() exceeds drift_threshold.
+        
+        Args:
+            patients_data: Patient data in any form accepted by _extract_features
+            id_field (str): Field holding the patient id
+        """
+        if not self.is_fitted:
+            raise ValueError("Model must be fitted before patients can be upserted")
+        
+        raw = self._extract_features(patients_data)
+        ids = self._extract_ids(patients_data, id_field)
+        
+        with self._lock:
+            # Missing values fall back to the current cohort means
+            raw = np.where(np.isnan(raw), self.stats.mean, raw)
+            replaced = self.raw.upsert(raw, ids)
+            self.stats.remove(replaced).update(raw)
+            self.index.upsert(self._transform_features(raw), ids)
+            self.revision += 1
+            if self._journal is not None:
+                self._journal.append(('upsert', raw, ids))
+        
+        self._maybe_rebuild()
+
+    def remove_patients(self, patient_ids: Any) -> None:
+        """
+        Remove patients (e.g. discharged ones) from the index.
+        
+        Args:
+            patient_ids: Ids of the patients to remove; unknown ids are ignored
+        """
+        if not self.is_fitted:
+            raise ValueError("Model must be fitted before patients can be removed")
+        
+        ids = np.atleast_1d(np.asarray(patient_ids, dtype=np.int64))
+        
+        with self._lock:
+            removed = self.raw.remove(ids)
+            self.stats.remove(removed)
+            self.index.remove(ids)
+            self.revision += 1
+            if self._journal is not None:
+                self._journal.append(('remove', None, ids))
+        
+        self._maybe_rebuild()
+
+    def drift(self) -> float:
+        """
+        How far the cohort has moved away from the statistics the scaler was
+        fitted with.
+        
+        Returns:
+            float: Largest per-feature shift of the running mean or standard
+            deviation, in units of the fitted scale
+        """
+        if self.stats.count == 0:
+            return 0.0
+        
+        mean_shift = np.abs(self.stats.mean - self.scaler.mean_) / self.scaler.scale_
+        scale_shift = np.abs(self.stats.std / self.scaler.scale_ - 1)
+        
+        return float(max(mean_shift.max(), scale_shift.max()))
+
+    def needs_rebuild(self) -> bool:
+        """Whether scaler drift or pending index rows call for a rebuild."""
+        n_pending = getattr(self.index, 'n_pending', 0)
+        return (
+            self.drift() > self.drift_threshold
+            or n_pending > self.max_pending_fraction * max(len(self.index), 1)
+        )
+
+    def _maybe_rebuild(self) -> None:
+        """Start a background rebuild when one is needed and none is running."""
+        if not self.auto_rebuild or self._rebuild_lock.locked() or not self.needs_rebuild():
+            return
+        
+        threading.Thread(target=self.rebuild, name='patient-similarity-rebuild', daemon=True).start()
+
+    def rebuild(self) -> None:
+        """
+        Refit the scaler and rebuild the index from the stored raw features.
+        
+        The new index is built next to the live one, which keeps serving
+        queries. Updates made while building are journalled and replayed on
+        the new index before it is swapped in.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                raw = np.array(self.raw.matrix)
+                ids = np.array(self.raw.ids)
+                index = create_index(self.index.name, **self.index.params())
+                self._journal = []
+            
+            try:
+                scaler = StandardScaler().fit(raw)
+                X = scaler.transform(raw)
+                index.build(X, ids)
+            except Exception:
+                with self._lock:
+                    self._journal = None
+                raise
+            
+            with self._lock:
+                for operation, rows, op_ids in self._journal:
+                    if operation == 'upsert':
+                        index.upsert(scaler.transform(rows), op_ids)
+                    else:
+                        index.remove(op_ids)
+                self._journal = None
+                self.scaler = scaler
+                self.index = index
+                self.model_version = self._compute_model_version(X)
+                self.revision += 1
+
+    def _compute_model_version(self, X: np.ndarray) -> str:
+        """Content hash identifying a fitted scaler/index pair."""
+        digest = hashlib.sha1()
+        digest.update(json.dumps(self.feature_names).encode())
+        digest.update(np.ascontiguousarray(self.scaler.mean_).tobytes())
+        digest.update(np.ascontiguousarray(self.scaler.scale_).tobytes())
+        digest.update(json.dumps(self.index.params(), sort_keys=True).encode())
+        digest.update(np.ascontiguousarray(X).tobytes())
+        return digest.hexdigest()[:16]
+
+    def save(self, path: str) -> str:
+        """
+        Persist the fitted scaler and neighbour index to a versioned artifact.
+        
+        The artifact is a directory holding the index arrays as .npy files
+        (so they can be memory mapped on load) and a JSON manifest with the
+        scaler statistics, index backend and format/model versions. The
+        manifest is written last, so a partially written artifact is never
+        loaded.
+        
+        Args:
+            path (str): Artifact directory
+            
+        Returns:
+            str: Path to the artifact directory
+        """
+        if not self.is_fitted:
+            raise ValueError("Model must be fitted before it can be saved")
+        
+        with self._lock:
+            return self._save(path)
+
+    def _save(self, path: str) -> str:
+        """Write the artifact; the caller holds the lock."""
+        os.makedirs(path, exist_ok=True)
+        self.index.save(path)
+        np.save(os.path.join(path, 'raw_features.npy'), self.raw.matrix)
+        np.save(os.path.join(path, 'raw_ids.npy'), self.raw.ids)
+        
+        manifest = {
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'model_version': self.model_version,
+            'revision': self.revision,
+            'created_at': datetime.now().isoformat(),
+            'n_neighbors': self.n_neighbors,
+            'n_samples': len(self.index),
+            'dtype': self.dtype,
+            'feature_names': self.feature_names,
+            'encoder': None if self.encoder is None else self.encoder.to_dict(),
+            'index': {
+                'backend': self.index.name,
+                'params': self.index.params()
+            },
+            'target_recall': self.target_recall,
+            'recall_report': self.recall_report,
+            'drift_threshold': self.drift_threshold,
+            'max_pending_fraction': self.max_pending_fraction,
+            'running_stats': self.stats.to_dict(),
+            'scaler': {
+                'mean': self.scaler.mean_.tolist(),
+                'var': self.scaler.var_.tolist(),
+                'scale': self.scaler.scale_.tolist(),
+                'n_samples_seen': int(self.scaler.n_samples_seen_)
+            }
+        }
+        
+        manifest_path = os.path.join(path, ARTIFACT_MANIFEST)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        
+        return path
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = 'r') -> 'PatientSimilarity':
+        """
+        Load a fitted model from an artifact written by save().
+        
+        Args:
+            path (str): Artifact directory
+            mmap_mode (Optional[str]): Memory-map mode for the index arrays
+                ('r' by default, None to read them fully into memory)
+            
+        Returns:
+            PatientSimilarity: Fitted instance ready for queries
+        """
+        with open(os.path.join(path, ARTIFACT_MANIFEST)) as f:
+            manifest = json.load(f)
+        
+        if manifest.get('format_version') != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported artifact format version: {manifest.get('format_version')} "
+                f"(expected {ARTIFACT_FORMAT_VERSION})"
+            )
+        
+        index_state = manifest['index']
+        instance = cls(
+            n_neighbors=manifest['n_neighbors'],
+            index=index_state['backend'],
+            index_params=index_state['params'],
+            target_recall=manifest.get('target_recall'),
+            drift_threshold=manifest['drift_threshold'],
+            max_pending_fraction=manifest['max_pending_fraction'],
+            encoder=FeatureEncoder.from_dict(manifest['encoder']) if manifest['encoder'] else None,
+            dtype=manifest.get('dtype', 'float64')
+        )
+        instance.feature_names = manifest['feature_names']
+        
+        scaler_state = manifest['scaler']
+        instance.scaler.mean_ = np.asarray(scaler_state['mean'])
+        instance.scaler.var_ = np.asarray(scaler_state['var'])
+        instance.scaler.scale_ = np.asarray(scaler_state['scale'])
+        instance.scaler.n_samples_seen_ = scaler_state['n_samples_seen']
+        instance.scaler.n_features_in_ = len(instance.feature_names)
+        
+        instance.index = type(instance.index).load(path, index_state['params'], mmap_mode=mmap_mode)
+        instance.raw.reset(
+            np.load(os.path.join(path, 'raw_features.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'raw_ids.npy'), mmap_mode=mmap_mode)
+        )
+        instance.stats = RunningStats.from_dict(manifest['running_stats'])
+        instance.recall_report = manifest.get('recall_report')
+        instance.model_version = manifest['model_version']
+        instance.revision = manifest['revision']
+        instance.is_fitted = True
+        
+        return instance
 
     def find_similar_patients(
         self,
         patient_data: Dict[str, Any],
-        patients_data: List[Dict[str, Any]]
+        patients_data: Optional[List[Dict[str, Any]]] = None
     ) -> List[Tuple[int, float]]:
         """
-        Find similar patients using KNN with cosine similarity.
+        Find similar patients using the neighbour index with cosine similarity.
+        
+        The model is only fitted if it has not been fitted (or loaded)
+        before; the query itself is only transformed with the fitted scaler.
         
         Args:
             patient_data (Dict): Data of the target patient
-            patients_data (List[Dict]): List of all patients' data
+            patients_data (Optional[List[Dict]]): List of all patients' data,
+                only needed when the model has not been fitted yet
             
         Returns:
-            List[Tuple[int, float]]: List of (patient_index, similarity_score) tuples
+            List[Tuple[int, float]]: List of (patient_index, similarity_score)
+            tuples; the index is the patient id when fitted with an id_field
         """
         if not self.is_fitted:
+            if patients_data is None:
+                raise ValueError("Model is not fitted and no patients data was provided")
             self.fit(patients_data)
         
-        # Prepare single patient data
-        X = self._prepare_features([patient_data])
+        with self._lock:
+            # Prepare single patient data
+            X = self._transform_features([patient_data])
+            
+            # Find nearest neighbors
+            indices, scores = self.index.search(X, self.n_neighbors)
         
-        # Find nearest neighbors
-        distances, indices = self.model.kneighbors(X)
+        # Approximate backends pad results they could not fill with id -1
+        found = indices[0] != -1
+        indices, distances = indices[0][found], 1 - scores[0][found].astype(np.float64)
         
-        # Convert distances to similarity scores (1 - normalized distance)
-        similarities = 1 - (distances[0] / distances[0].max())
+        # Convert distances to similarity scores (1 - normalized distance);
+        # when every hit is an exact match (float32 self-matches can score a
+        # little above 1) there is nothing to normalise by
+        max_distance = distances.max() if len(distances) else 0.0
+        if max_distance > 0:
+            similarities = 1 - distances / max_distance
+        else:
+            similarities = np.ones(len(distances))
         
         # Return list of (index, similarity) tuples
-        return list(zip(indices[0], similarities))
+        return list(zip(indices, similarities))
+
+    def find_similar_patients_batch(
+        self,
+        patients_data: Any,
+        k: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find similar patients for many target patients in one call.
+        
+        Features for all targets are extracted into a single matrix, scaled
+        once and searched with one blocked matrix multiply over the
+        L2-normalised index (argpartition top-k per block).
+        
+        Args:
+            patients_data: Target patients, as a list of patient data
+                dictionaries or a dict of per-feature column arrays
+            k (Optional[int]): Number of neighbours (defaults to n_neighbors)
+            
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (indices, scores) arrays of shape
+            (n_targets, k), sorted by descending raw cosine similarity
+        """
+        if not self.is_fitted:
+            raise ValueError("Model must be fitted before querying in batch")
+        
+        with self._lock:
+            X = self._transform_features(patients_data)
+            indices, scores = self.index.search(X, k or self.n_neighbors)
+        
+        return indices, scores.astype(np.float32, copy=False)
+
+    def explain_similar_patients(
+        self,
+        patient_data: Dict[str, Any],
+        neighbour_ids: Optional[Any] = None,
+        k: Optional[int] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Explain the similarity of a patient to all of its neighbours at once.
+        
+        Neighbour features are read from the stored raw matrix by id, so no
+        neighbour dictionaries are needed. Two explanations are returned, one
+        row per neighbour and one column per feature in feature_names:
+        
+        - feature_similarity: get_similarity_explanation()'s per-feature
+          similarity, 1 - |a - b| / max(|a|, |b|, 1), on raw values
+        - contributions: each feature's term of the cosine score between
+          the L2-normalised scaled vectors; rows sum to score
+        
+        Missing values are imputed with the fitted means, as for queries.
+        
+        Args:
+            patient_data (Dict): Data of the target patient
+            neighbour_ids (Optional[Any]): Ids of the patients to explain;
+                when None, the k nearest neighbours are searched for
+            k (Optional[int]): Number of neighbours to search for (defaults
+                to n_neighbors); ignored when neighbour_ids is given
+            
+        Returns:
+            Dict[str, np.ndarray]: 'ids' (k,), 'score' (k,) cosine similarity,
+            'feature_similarity' (k, n_features) and 'contributions'
+            (k, n_features)
+        """
+        if not self.is_fitted:
+            raise ValueError("Model must be fitted before explaining similarities")
+        
+        with self._lock:
+            query = self._extract_features([patient_data])
+            query = np.where(np.isnan(query), self.scaler.mean_, query)
+            
+            if neighbour_ids is None:
+                ids, _ = self.index.search(self._scale(query), k or self.n_neighbors)
+                ids = ids[0]
+            else:
+                ids = np.asarray(neighbour_ids, dtype=np.int64).ravel()
+            
+            neighbours, found = self.raw.get(ids)
+            if not found.all():
+                raise ValueError(f"Unknown patient ids: {ids[~found].tolist()}")
+            
+            q = normalize_rows(self._scale(query))
+            V = normalize_rows(self._scale(neighbours))
+        
+        feature_similarity = 1 - np.abs(query - neighbours) / np.maximum(
+            np.maximum(np.abs(query), np.abs(neighbours)), 1
+        )
+        contributions = q * V
+        
+        return {
+            'ids': ids,
+            'score': contributions.sum(axis=1),
+            'feature_similarity': feature_similarity,
+            'contributions': contributions
+        }
 
     def get_similarity_explanation(
         self,
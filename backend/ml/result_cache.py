@@ -0,0 +1,125 @@
+# backend/ml/result_cache.py
+"""
+In-process LRU cache with a time-to-live for similarity search results.
+
+Entries are keyed by a tuple whose first element is the patient id, and
+may list the other patients they mention (e.g. the neighbours in a top-k
+result). When a patient's features change, invalidate() drops the entries
+of that patient and every entry listing them; anything else is bounded by
+the time-to-live.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class ResultCache:
+    """Least-recently-used cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0):
+        """
+        Args:
+            max_entries (int): Entries kept before the least recently used
+                one is evicted
+            ttl (float): Seconds an entry stays valid
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Patient id -> keys of the entries about or listing that patient
+        self._keys_of = {}
+        # Key -> patient ids the entry is registered under in _keys_of
+        self._ids_of = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[Any]:
+        """
+        Look up an entry, marking it as recently used.
+
+        Args:
+            key (Tuple): Cache key; key[0] is the patient id
+
+        Returns:
+            Optional[Any]: The cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                self._discard(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Tuple[Hashable, ...], value: Any, related: Iterable[Hashable] = ()) -> None:
+        """
+        Store an entry, evicting the least recently used ones when full.
+
+        Args:
+            key (Tuple): Cache key; key[0] is the patient id
+            value (Any): Value to cache
+            related (Iterable[Hashable]): Other patients the value lists;
+                a change to any of them drops the entry too
+        """
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            ids = {key[0], *related}
+            self._ids_of[key] = ids
+            for patient_id in ids:
+                self._keys_of.setdefault(patient_id, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+
+    def invalidate(self, patient_id: Hashable) -> None:
+        """
+        Drop every entry of a patient and every entry listing them.
+
+        Args:
+            patient_id (Hashable): Id of the patient
+        """
+        with self._lock:
+            for key in list(self._keys_of.get(patient_id, ())):
+                self._discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_of.clear()
+            self._ids_of.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Entry count and hit/miss counters."""
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def _discard(self, key: Tuple[Hashable, ...]) -> None:
+        """Remove one entry; the lock must be held."""
+        self._entries.pop(key, None)
+        for patient_id in self._ids_of.pop(key, ()):
+            keys = self._keys_of.get(patient_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_of[patient_id]
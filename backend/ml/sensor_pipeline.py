@@ -0,0 +1,898 @@
+# backend/ml/sensor_pipeline.py
+"""
+Preprocessing for the PAMAP2 activity recognition data used by the sensor
+LSTM (see dataset-process.ipynb and lstm-model.py).
+
+Subject files are loaded into one DataFrame, cleaned and normalised, then
+cut into fixed-length windows. Windows are strided views of the sensor
+matrix (numpy sliding_window_view), so creating them copies nothing; only
+the windows that are kept are materialised. A window is kept when its
+activity label does not change, which is decided for all windows at once
+from the run-length boundaries of the label column.
+
+For cohorts that do not fit in memory as a DataFrame, ingest_subject()
+parses each .dat file once, in chunks, into a float32 .npy cache next to a
+JSON metadata file. load_dataset() then works one memory-mapped subject at
+a time, so text is never parsed twice and only one subject is in RAM.
+
+For training without materialising the windows at all, WindowDataset
+serves shuffled batches sliced lazily from one memory-mapped matrix of
+prepared (interpolated and normalised) rows, either as a plain batch
+iterator with background prefetching or as a tf.data pipeline.
+
+Channels are standardised by a ChannelNormalizer whose running statistics
+are cached per subject and merged, so a new subject only costs a pass
+over its own rows. Its state is stored with the prepared windows and
+shipped with the exported model, so live inference scales readings
+exactly as training did.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .online_stats import RunningStats
+
+# Column names (based on the PAMAP2 dataset documentation)
+COLUMN_NAMES = [
+    'timestamp', 'ActivityID', 'HeartRate',
+    'IMU_hand_temp', 'IMU_hand_acc_x', 'IMU_hand_acc_y', 'IMU_hand_acc_z',
+    'IMU_hand_gyro_x', 'IMU_hand_gyro_y', 'IMU_hand_gyro_z',
+    'IMU_hand_mag_x', 'IMU_hand_mag_y', 'IMU_hand_mag_z',
+    'IMU_chest_temp', 'IMU_chest_acc_x', 'IMU_chest_acc_y', 'IMU_chest_acc_z',
+    'IMU_chest_gyro_x', 'IMU_chest_gyro_y', 'IMU_chest_gyro_z',
+    'IMU_chest_mag_x', 'IMU_chest_mag_y', 'IMU_chest_mag_z',
+    'IMU_ankle_temp', 'IMU_ankle_acc_x', 'IMU_ankle_acc_y', 'IMU_ankle_acc_z',
+    'IMU_ankle_gyro_x', 'IMU_ankle_gyro_y', 'IMU_ankle_gyro_z',
+    'IMU_ankle_mag_x', 'IMU_ankle_mag_y', 'IMU_ankle_mag_z'
+]
+
+LABEL_COLUMN = 'ActivityID'
+
+# Activity of each ActivityID (PAMAP2 protocol and optional activities)
+ACTIVITY_NAMES = {
+    0: 'other',
+    1: 'lying',
+    2: 'sitting',
+    3: 'standing',
+    4: 'walking',
+    5: 'running',
+    6: 'cycling',
+    7: 'nordic_walking',
+    9: 'watching_tv',
+    10: 'computer_work',
+    11: 'car_driving',
+    12: 'ascending_stairs',
+    13: 'descending_stairs',
+    16: 'vacuum_cleaning',
+    17: 'ironing',
+    18: 'folding_laundry',
+    19: 'house_cleaning',
+    20: 'playing_soccer',
+    24: 'rope_jumping'
+}
+
+# Accelerometer and gyroscope channels fed to the model
+SENSOR_COLUMNS = [col for col in COLUMN_NAMES if 'acc' in col or 'gyro' in col]
+
+# Column added by load_subjects(); windows never span two subjects
+SUBJECT_COLUMN = 'subject'
+
+# Bumped when the layout of ingest_subject()'s cache changes
+CACHE_FORMAT_VERSION = 1
+
+
+def load_subjects(files: List[str]) -> pd.DataFrame:
+    """
+    Load and concatenate PAMAP2 subject files.
+
+    Args:
+        files (List[str]): Paths of the space-separated subjectNNN.dat files
+
+    Returns:
+        pd.DataFrame: All rows, with a 'subject' column holding the position
+        of the file each row came from
+    """
+    frames = []
+    for subject, path in enumerate(files):
+        frame = pd.read_csv(path, sep=' ', header=None, names=COLUMN_NAMES)
+        frame[SUBJECT_COLUMN] = subject
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def preprocess(df: pd.DataFrame, sensor_cols: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Clean and normalise loaded sensor data.
+
+    Rows without an activity are dropped, sensor gaps are filled by linear
+    interpolation and the sensor columns are z-score normalised.
+
+    Args:
+        df (pd.DataFrame): Data from load_subjects()
+        sensor_cols (Optional[List[str]]): Columns to normalise (defaults to
+            SENSOR_COLUMNS)
+
+    Returns:
+        pd.DataFrame: Preprocessed data
+    """
+    sensor_cols = sensor_cols or SENSOR_COLUMNS
+
+    df = df.dropna(subset=[LABEL_COLUMN])
+    df = df.interpolate(method='linear')
+    df[sensor_cols] = (df[sensor_cols] - df[sensor_cols].mean()) / df[sensor_cols].std()
+    return df
+
+
+def sliding_windows(values: np.ndarray, seq_length: int, stride: int = 1) -> np.ndarray:
+    """
+    View a (n_rows, n_channels) matrix as overlapping windows without copying.
+
+    Args:
+        values (np.ndarray): Row-major sensor matrix
+        seq_length (int): Rows per window
+        stride (int): Rows between the starts of consecutive windows
+
+    Returns:
+        np.ndarray: Read-only view of shape (n_windows, seq_length, n_channels)
+    """
+    if len(values) < seq_length:
+        return np.empty((0, seq_length) + values.shape[1:], dtype=values.dtype)
+    # sliding_window_view puts the window axis last; move it next to the window index
+    return sliding_window_view(values, seq_length, axis=0)[::stride].swapaxes(1, 2)
+
+
+def consistent_windows(
+    labels: np.ndarray,
+    seq_length: int,
+    stride: int = 1,
+    groups: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Find the windows whose label (and group) stays the same throughout.
+
+    Rows are numbered by the run of equal labels they belong to; a window
+    is consistent when its first and last rows are in the same run.
+
+    Args:
+        labels (np.ndarray): Label of each row
+        seq_length (int): Rows per window
+        stride (int): Rows between the starts of consecutive windows
+        groups (Optional[np.ndarray]): Group (e.g. subject) of each row; a
+            change of group also ends a run
+
+    Returns:
+        np.ndarray: Boolean mask with one entry per window of sliding_windows()
+    """
+    if len(labels) < seq_length:
+        return np.zeros(0, dtype=bool)
+
+    boundaries = labels[1:] != labels[:-1]
+    if groups is not None:
+        boundaries |= groups[1:] != groups[:-1]
+    run = np.concatenate([[0], np.cumsum(boundaries)])
+
+    return (run[:len(run) - seq_length + 1] == run[seq_length - 1:])[::stride]
+
+
+def build_windows(
+    data: pd.DataFrame,
+    seq_length: int = 50,
+    stride: int = 1,
+    sensor_cols: Optional[List[str]] = None,
+    dtype=np.float32
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Cut preprocessed data into windows without materialising them.
+
+    Args:
+        data (pd.DataFrame): Preprocessed data
+        seq_length (int): Rows per window
+        stride (int): Rows between the starts of consecutive windows
+        sensor_cols (Optional[List[str]]): Channels of each window (defaults
+            to SENSOR_COLUMNS)
+        dtype: dtype of the sensor matrix the windows view
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (windows view of shape
+        (n_windows, seq_length, n_channels), label of each window's last
+        row, mask of the label-consistent windows)
+    """
+    sensor_cols = sensor_cols or SENSOR_COLUMNS
+    values = data[sensor_cols].to_numpy(dtype=dtype)
+    labels = data[LABEL_COLUMN].to_numpy()
+    groups = data[SUBJECT_COLUMN].to_numpy() if SUBJECT_COLUMN in data else None
+
+    windows = sliding_windows(values, seq_length, stride)
+    window_labels = labels[seq_length - 1::stride][:len(windows)].astype(np.int64)
+    keep = consistent_windows(labels, seq_length, stride, groups)
+    return windows, window_labels, keep
+
+
+def create_sequences(
+    data: pd.DataFrame,
+    seq_length: int = 50,
+    stride: int = 1,
+    sensor_cols: Optional[List[str]] = None,
+    dtype=np.float32
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build the label-consistent training windows and their labels.
+
+    Args:
+        data (pd.DataFrame): Preprocessed data
+        seq_length (int): Rows per window
+        stride (int): Rows between the starts of consecutive windows
+        sensor_cols (Optional[List[str]]): Channels of each window (defaults
+            to SENSOR_COLUMNS)
+        dtype: dtype of the returned windows
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (windows of shape (n_windows,
+        seq_length, n_channels), activity label of each window)
+    """
+    windows, labels, keep = build_windows(data, seq_length, stride, sensor_cols, dtype)
+    return windows[keep], labels[keep]
+
+
+def _cache_paths(path: str, cache_dir: str) -> Tuple[str, str]:
+    """
+    Array and metadata paths of a subject file's cache.
+
+    The stem carries a hash of the absolute source path, since PAMAP2 ships
+    files of the same name (Protocol/ and Optional/subject101.dat).
+    """
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    stem = f'{os.path.splitext(os.path.basename(path))[0]}-{digest}'
+    return os.path.join(cache_dir, stem + '.npy'), os.path.join(cache_dir, stem + '.json')
+
+
+def _source_signature(path: str) -> Dict[str, Any]:
+    """Size and modification time identifying the version of a source file."""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _count_lines(path: str, block_size: int = 1 << 24) -> int:
+    """Number of lines in a text file, read in binary blocks."""
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            lines += block.count(b'\n')
+            last = block[-1:]
+    return lines + (last != b'\n')
+
+
+def ingest_subject(path: str, cache_dir: str, chunksize: int = 200000, force: bool = False) -> Dict[str, Any]:
+    """
+    Parse a PAMAP2 .dat file into a float32 .npy cache, unless it is current.
+
+    The file is read in chunks of chunksize rows and each chunk is written
+    straight into a memory-mapped .npy file, so memory use does not depend
+    on the file size. The cache is reused while the source file's size and
+    modification time are unchanged.
+
+    Args:
+        path (str): Path of the space-separated subjectNNN.dat file
+        cache_dir (str): Directory for the cached arrays
+        chunksize (int): Rows parsed per chunk
+        force (bool): Re-parse even when the cache is current
+
+    Returns:
+        Dict[str, Any]: Cache metadata: 'source', 'columns', 'dtype',
+        'n_rows', 'array' (path of the .npy file) and 'format_version'
+    """
+    array_path, meta_path = _cache_paths(path, cache_dir)
+    source = _source_signature(path)
+
+    if not force and os.path.exists(meta_path) and os.path.exists(array_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('format_version') == CACHE_FORMAT_VERSION and meta.get('source') == source:
+            return meta
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Sized from the line count; blank lines (skipped by the parser) leave unused rows
+    capacity = _count_lines(path)
+    out = np.lib.format.open_memmap(array_path + '.tmp', mode='w+', dtype=np.float32,
+                                    shape=(capacity, len(COLUMN_NAMES)))
+    n_rows = 0
+    for chunk in pd.read_csv(path, sep=' ', header=None, names=COLUMN_NAMES,
+                             dtype=np.float32, chunksize=chunksize):
+        out[n_rows:n_rows + len(chunk)] = chunk.to_numpy()
+        n_rows += len(chunk)
+    out.flush()
+    del out
+    os.replace(array_path + '.tmp', array_path)
+
+    meta = {
+        'format_version': CACHE_FORMAT_VERSION,
+        'source': source,
+        'columns': COLUMN_NAMES,
+        'dtype': 'float32',
+        'n_rows': n_rows,
+        'array': array_path
+    }
+    # Metadata is written last, so an interrupted ingest is redone next time
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    return meta
+
+
+def load_subject(path: str, cache_dir: str, mmap_mode: Optional[str] = 'r') -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Memory-map a subject's cached array, ingesting the .dat file if needed.
+
+    Args:
+        path (str): Path of the subjectNNN.dat file
+        cache_dir (str): Directory for the cached arrays
+        mmap_mode (Optional[str]): Memory-map mode (None reads the array)
+
+    Returns:
+        Tuple[np.ndarray, Dict[str, Any]]: (float32 array of shape
+        (n_rows, len(columns)), cache metadata)
+    """
+    meta = ingest_subject(path, cache_dir)
+    return np.load(meta['array'], mmap_mode=mmap_mode)[:meta['n_rows']], meta
+
+
+def interpolate_columns(values: np.ndarray) -> np.ndarray:
+    """
+    Fill NaN gaps in each column by linear interpolation over row position, in place.
+
+    Matches DataFrame.interpolate(method='linear') for interior gaps; gaps
+    at either end are held at the nearest value. Columns without any value
+    are left as NaN.
+
+    Args:
+        values (np.ndarray): Float matrix of shape (n_rows, n_columns)
+
+    Returns:
+        np.ndarray: values, filled
+    """
+    rows = np.arange(len(values))
+    for column in range(values.shape[1]):
+        series = values[:, column]
+        missing = np.isnan(series)
+        if missing.any() and not missing.all():
+            series[missing] = np.interp(rows[missing], rows[~missing], series[~missing])
+    return values
+
+
+def prepare_subject(
+    path: str,
+    cache_dir: str,
+    sensor_cols: Optional[List[str]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load one subject's labelled sensor rows with their gaps interpolated.
+
+    Only the labelled rows of the label and sensor columns are copied out
+    of the memory-mapped cache.
+
+    Args:
+        path (str): Path of the subjectNNN.dat file
+        cache_dir (str): Directory for the cached arrays
+        sensor_cols (Optional[List[str]]): Channels to load (defaults to
+            SENSOR_COLUMNS)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (float32 sensor matrix of shape
+        (n_rows, n_channels), int64 activity label of each row)
+    """
+    sensor_cols = sensor_cols or SENSOR_COLUMNS
+    array, meta = load_subject(path, cache_dir)
+    columns = [meta['columns'].index(col) for col in sensor_cols]
+
+    labels = array[:, meta['columns'].index(LABEL_COLUMN)]
+    labelled = ~np.isnan(labels)
+    values = interpolate_columns(array[labelled][:, columns])
+    return values, labels[labelled].astype(np.int64)
+
+
+def iter_subjects(
+    files: List[str],
+    cache_dir: str,
+    sensor_cols: Optional[List[str]] = None
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yield prepare_subject() for each file, one subject in memory at a time."""
+    for path in files:
+        yield prepare_subject(path, cache_dir, sensor_cols)
+
+
+class ChannelNormalizer:
+    """
+    Per-channel standardisation backed by persisted running statistics.
+
+    The statistics are accumulated in a streaming pass (RunningStats), so
+    new rows or subjects are merged in without re-reading the ones already
+    seen. The same JSON state is stored with the prepared windows and next
+    to the exported model, so training and live inference scale readings
+    identically.
+    """
+
+    def __init__(self, stats: Optional[RunningStats] = None, sensor_cols: Optional[List[str]] = None):
+        """
+        Args:
+            stats (Optional[RunningStats]): Statistics of the channels
+                (empty when not given)
+            sensor_cols (Optional[List[str]]): Channel names, in column order
+                (defaults to SENSOR_COLUMNS)
+        """
+        self.stats = stats if stats is not None else RunningStats()
+        self.sensor_cols = list(sensor_cols or SENSOR_COLUMNS)
+        self._scaling = None
+
+    def update(self, values: np.ndarray) -> 'ChannelNormalizer':
+        """
+        Add rows of sensor readings to the statistics.
+
+        Args:
+            values (np.ndarray): Readings of shape (n_rows, n_channels)
+
+        Returns:
+            ChannelNormalizer: self, for chaining
+        """
+        self.stats.update(values)
+        self._scaling = None
+        return self
+
+    def merge(self, stats: RunningStats) -> 'ChannelNormalizer':
+        """Merge in the statistics of another stream (e.g. a new subject)."""
+        self.stats.merge(stats)
+        self._scaling = None
+        return self
+
+    @property
+    def scaling(self) -> Tuple[np.ndarray, np.ndarray]:
+        """float32 (mean, std) of each channel; std is floored to stay non-zero."""
+        if self._scaling is None:
+            if not self.stats.count:
+                raise ValueError("ChannelNormalizer has no statistics")
+            self._scaling = (
+                self.stats.mean.astype(np.float32),
+                np.maximum(self.stats.std, np.finfo(np.float32).tiny).astype(np.float32)
+            )
+        return self._scaling
+
+    def transform(self, values: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Standardise readings; the last axis holds the channels.
+
+        Args:
+            values (np.ndarray): Rows (n_rows, n_channels) or windows
+                (n_windows, seq_length, n_channels)
+            out (Optional[np.ndarray]): Array to write into (may be values
+                itself for in-place scaling)
+
+        Returns:
+            np.ndarray: float32 standardised readings
+        """
+        mean, std = self.scaling
+        if values.shape[-1] != len(mean):
+            raise ValueError(f"Expected {len(mean)} channels, got {values.shape[-1]}")
+        out = np.subtract(values, mean, out=out, dtype=np.float32)
+        out /= std
+        return out
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serialisable state."""
+        return {'sensor_cols': self.sensor_cols, 'stats': self.stats.to_dict()}
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> 'ChannelNormalizer':
+        """Restore a normaliser saved with to_dict()."""
+        return cls(RunningStats.from_dict(state['stats']), state['sensor_cols'])
+
+
+def subject_statistics(path: str, cache_dir: str, sensor_cols: Optional[List[str]] = None) -> RunningStats:
+    """
+    Per-channel statistics of one subject, cached next to its sensor cache.
+
+    The statistics are reused while the subject file and channels are
+    unchanged, so adding a subject only costs a pass over that subject.
+
+    Args:
+        path (str): Path of the subjectNNN.dat file
+        cache_dir (str): Directory for the cached arrays
+        sensor_cols (Optional[List[str]]): Channels (defaults to SENSOR_COLUMNS)
+
+    Returns:
+        RunningStats: Statistics of the subject's labelled rows
+    """
+    sensor_cols = sensor_cols or SENSOR_COLUMNS
+    stats_path = os.path.splitext(_cache_paths(path, cache_dir)[0])[0] + '.stats.json'
+    key = {
+        'format_version': CACHE_FORMAT_VERSION,
+        'source': _source_signature(path),
+        'sensor_cols': sensor_cols
+    }
+    if os.path.exists(stats_path):
+        with open(stats_path) as f:
+            cached = json.load(f)
+        if all(cached.get(name) == value for name, value in key.items()):
+            return RunningStats.from_dict(cached['stats'])
+
+    values, _ = prepare_subject(path, cache_dir, sensor_cols)
+    stats = RunningStats().update(values)
+    with open(stats_path + '.tmp', 'w') as f:
+        json.dump(dict(key, stats=stats.to_dict()), f)
+    os.replace(stats_path + '.tmp', stats_path)
+    return stats
+
+
+def sensor_statistics(files: List[str], cache_dir: str, sensor_cols: Optional[List[str]] = None) -> ChannelNormalizer:
+    """
+    Per-channel normaliser over all subjects, merged from per-subject statistics.
+
+    Args:
+        files (List[str]): Subject .dat files
+        cache_dir (str): Directory for the cached arrays
+        sensor_cols (Optional[List[str]]): Channels (defaults to SENSOR_COLUMNS)
+
+    Returns:
+        ChannelNormalizer: Normaliser over every sensor channel
+    """
+    normalizer = ChannelNormalizer(sensor_cols=sensor_cols)
+    for path in files:
+        normalizer.merge(subject_statistics(path, cache_dir, sensor_cols))
+    return normalizer
+
+
+def load_dataset(
+    files: List[str],
+    cache_dir: str,
+    seq_length: int = 50,
+    stride: int = 1,
+    sensor_cols: Optional[List[str]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build normalised, label-consistent windows from cached subject files.
+
+    Equivalent to load_subjects() + preprocess() + create_sequences(), but
+    each .dat file is parsed only once (see ingest_subject()) and only one
+    subject's rows are held in memory besides the windows kept.
+
+    Args:
+        files (List[str]): Subject .dat files
+        cache_dir (str): Directory for the cached arrays
+        seq_length (int): Rows per window
+        stride (int): Rows between the starts of consecutive windows
+        sensor_cols (Optional[List[str]]): Channels of each window (defaults
+            to SENSOR_COLUMNS)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (float32 windows of shape (n_windows,
+        seq_length, n_channels), activity label of each window)
+    """
+    normalizer = sensor_statistics(files, cache_dir, sensor_cols)
+
+    X_parts, y_parts = [], []
+    for values, labels in iter_subjects(files, cache_dir, sensor_cols):
+        normalizer.transform(values, out=values)
+        windows = sliding_windows(values, seq_length, stride)
+        keep = consistent_windows(labels, seq_length, stride)
+        X_parts.append(windows[keep])
+        y_parts.append(labels[seq_length - 1::stride][:len(windows)][keep])
+
+    return np.concatenate(X_parts), np.concatenate(y_parts)
+
+
+def prepare_windows(
+    files: List[str],
+    cache_dir: str,
+    seq_length: int = 50,
+    stride: int = 1,
+    sensor_cols: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Write the prepared rows of all subjects and their window index to the cache.
+
+    The rows of every subject (interpolated and normalised as in
+    load_dataset()) are stored back to back in one float32 .npy file, and
+    the label-consistent windows are recorded only by their first row and
+    label. The result is reused while the subject files, window settings
+    and channels are unchanged.
+
+    Args:
+        files (List[str]): Subject .dat files
+        cache_dir (str): Directory for the cached arrays
+        seq_length (int): Rows per window
+        stride (int): Rows between the starts of consecutive windows
+        sensor_cols (Optional[List[str]]): Channels of each window (defaults
+            to SENSOR_COLUMNS)
+
+    Returns:
+        Dict[str, Any]: Metadata with the paths of the 'values', 'starts'
+        and 'labels' arrays, the channels, the ChannelNormalizer state
+        ('normalizer') and the sorted activity 'classes'
+    """
+    sensor_cols = sensor_cols or SENSOR_COLUMNS
+    key = {
+        'format_version': CACHE_FORMAT_VERSION,
+        'sources': [_source_signature(path) for path in files],
+        'seq_length': seq_length,
+        'stride': stride,
+        'sensor_cols': sensor_cols
+    }
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    directory = os.path.join(cache_dir, 'windows-' + digest)
+    meta_path = os.path.join(directory, 'windows.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        # Caches written before the normaliser was stored are rebuilt
+        if 'normalizer' in meta:
+            return meta
+
+    os.makedirs(directory, exist_ok=True)
+    normalizer = sensor_statistics(files, cache_dir, sensor_cols)
+    n_rows = normalizer.stats.count
+
+    paths = {name: os.path.join(directory, name + '.npy') for name in ('values', 'starts', 'labels')}
+    out = np.lib.format.open_memmap(paths['values'], mode='w+', dtype=np.float32,
+                                    shape=(n_rows, len(sensor_cols)))
+    starts, labels = [], []
+    offset = 0
+    for values, row_labels in iter_subjects(files, cache_dir, sensor_cols):
+        normalizer.transform(values, out=out[offset:offset + len(values)])
+        keep = consistent_windows(row_labels, seq_length, stride)
+        window_starts = np.arange(0, len(keep) * stride, stride, dtype=np.int64)
+        starts.append(window_starts[keep] + offset)
+        labels.append(row_labels[window_starts[keep] + seq_length - 1])
+        offset += len(values)
+    out.flush()
+    del out
+
+    np.save(paths['starts'], np.concatenate(starts))
+    labels = np.concatenate(labels)
+    np.save(paths['labels'], labels)
+
+    meta = dict(key, **paths, normalizer=normalizer.to_dict(), classes=np.unique(labels).tolist())
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    return meta
+
+
+class WindowDataset:
+    """
+    Batches of sensor windows sliced lazily from a memory-mapped row matrix.
+
+    Only the start row and label of each window are held in memory; a batch
+    is gathered from the rows when it is requested, so the full set of
+    windows never exists as one dense array. Labels are encoded as the
+    position of the activity in classes, ready for a sparse categorical
+    loss.
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        starts: np.ndarray,
+        labels: np.ndarray,
+        seq_length: int,
+        classes: Optional[np.ndarray] = None,
+        batch_size: int = 32,
+        shuffle: bool = True,
+        seed: Optional[int] = None,
+        normalizer: Optional[ChannelNormalizer] = None
+    ):
+        """
+        Args:
+            values (np.ndarray): Prepared rows, shape (n_rows, n_channels)
+            starts (np.ndarray): First row of each window
+            labels (np.ndarray): Activity label of each window
+            seq_length (int): Rows per window
+            classes (Optional[np.ndarray]): Sorted activity labels (defaults
+                to the distinct labels)
+            batch_size (int): Windows per batch
+            shuffle (bool): Shuffle the windows at the start of every epoch
+            seed (Optional[int]): Seed for shuffling
+            normalizer (Optional[ChannelNormalizer]): Scaling that was
+                applied to the rows, shipped with the trained model
+        """
+        self.values = values
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.labels = np.asarray(labels)
+        self.seq_length = seq_length
+        self.classes = np.unique(self.labels) if classes is None else np.asarray(classes)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.normalizer = normalizer
+        self.encoded = np.searchsorted(self.classes, self.labels).astype(np.int64)
+        self._offsets = np.arange(seq_length, dtype=np.int64)
+        self._order = np.arange(len(self.starts))
+
+    @classmethod
+    def from_files(
+        cls,
+        files: List[str],
+        cache_dir: str,
+        seq_length: int = 50,
+        stride: int = 1,
+        sensor_cols: Optional[List[str]] = None,
+        **kwargs
+    ) -> 'WindowDataset':
+        """
+        Dataset over the windows of subject files, prepared through the cache.
+
+        Args:
+            files (List[str]): Subject .dat files
+            cache_dir (str): Directory for the cached arrays
+            seq_length (int): Rows per window
+            stride (int): Rows between the starts of consecutive windows
+            sensor_cols (Optional[List[str]]): Channels of each window
+                (defaults to SENSOR_COLUMNS)
+            **kwargs: batch_size, shuffle and seed
+
+        Returns:
+            WindowDataset: Dataset over all label-consistent windows
+        """
+        meta = prepare_windows(files, cache_dir, seq_length, stride, sensor_cols)
+        return cls(
+            np.load(meta['values'], mmap_mode='r'),
+            np.load(meta['starts']),
+            np.load(meta['labels']),
+            seq_length,
+            classes=np.asarray(meta['classes']),
+            normalizer=ChannelNormalizer.from_dict(meta['normalizer']),
+            **kwargs
+        )
+
+    def __len__(self) -> int:
+        """Number of batches per epoch."""
+        return -(-len(self.starts) // self.batch_size)
+
+    @property
+    def n_windows(self) -> int:
+        return len(self.starts)
+
+    @property
+    def n_channels(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def n_classes(self) -> int:
+        return len(self.classes)
+
+    def subset(self, windows: np.ndarray, shuffle: Optional[bool] = None) -> 'WindowDataset':
+        """Dataset over some of the windows, sharing the row matrix."""
+        return WindowDataset(
+            self.values,
+            self.starts[windows],
+            self.labels[windows],
+            self.seq_length,
+            classes=self.classes,
+            batch_size=self.batch_size,
+            shuffle=self.shuffle if shuffle is None else shuffle,
+            seed=int(self.rng.integers(2 ** 32)),
+            normalizer=self.normalizer
+        )
+
+    def split(self, test_size: float = 0.2, seed: Optional[int] = None) -> Tuple['WindowDataset', 'WindowDataset']:
+        """
+        Randomly split the windows in two, like sklearn's train_test_split.
+
+        Args:
+            test_size (float): Fraction of windows in the second dataset
+            seed (Optional[int]): Seed for the split
+
+        Returns:
+            Tuple[WindowDataset, WindowDataset]: (train, test); the test
+            dataset is not shuffled
+        """
+        order = np.random.default_rng(seed).permutation(len(self.starts))
+        n_test = int(np.ceil(test_size * len(order)))
+        return self.subset(np.sort(order[n_test:])), self.subset(np.sort(order[:n_test]), shuffle=False)
+
+    def on_epoch_end(self) -> None:
+        """Reshuffle the window order (called between epochs)."""
+        if self.shuffle:
+            self._order = self.rng.permutation(len(self.starts))
+
+    def __getitem__(self, batch: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gather one batch of windows.
+
+        Args:
+            batch (int): Batch number in the current epoch order
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (float32 windows of shape
+            (batch_size, seq_length, n_channels), encoded labels)
+        """
+        windows = self._order[batch * self.batch_size:(batch + 1) * self.batch_size]
+        # Sorted reads keep memory-mapped access mostly sequential
+        windows = np.sort(windows)
+        rows = self.starts[windows, np.newaxis] + self._offsets
+        return self.values[rows], self.encoded[windows]
+
+    def iter_batches(self, prefetch: int = 2) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Iterate over one epoch of batches, gathering ahead in a background thread.
+
+        Args:
+            prefetch (int): Batches gathered ahead of the consumer (0 gathers
+                each batch on request)
+
+        Yields:
+            Tuple[np.ndarray, np.ndarray]: Batches as returned by __getitem__
+        """
+        self.on_epoch_end()
+        if prefetch <= 0:
+            for batch in range(len(self)):
+                yield self[batch]
+            return
+
+        batches = queue.Queue(maxsize=prefetch)
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for batch in range(len(self)):
+                    if stop.is_set():
+                        return
+                    batches.put(self[batch])
+            except Exception as e:
+                batches.put(e)
+            finally:
+                batches.put(done)
+
+        worker = threading.Thread(target=produce, daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            # Unblock the producer if it is waiting on a full queue
+            while worker.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    worker.join(0.01)
+
+    def to_tf_dataset(self, prefetch: Optional[int] = None):
+        """
+        Wrap the dataset as a repeatable tf.data pipeline.
+
+        Each pass over the returned dataset is one epoch, reshuffled, with
+        batches gathered from the memory-mapped rows as they are needed.
+
+        Args:
+            prefetch (Optional[int]): Batches prefetched by tf.data
+                (defaults to tf.data.AUTOTUNE)
+
+        Returns:
+            tf.data.Dataset: Dataset of (windows, labels) batches
+        """
+        try:
+            import tensorflow as tf
+        except ImportError:
+            raise ImportError("TensorFlow is required for tf.data pipelines") from None
+
+        signature = (
+            tf.TensorSpec(shape=(None, self.seq_length, self.n_channels), dtype=tf.float32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int64)
+        )
+        dataset = tf.data.Dataset.from_generator(lambda: self.iter_batches(prefetch=0), output_signature=signature)
+        return dataset.prefetch(tf.data.AUTOTUNE if prefetch is None else prefetch)
@@ -0,0 +1,234 @@
+# backend/ml/sensor_quantization.py
+"""
+Post-training quantisation and benchmarking of the TFLite sensor model.
+
+convert_model() exports the trained Keras activity model in one of
+QUANTIZATION_MODES:
+
+- 'float32': the default conversion, no optimisations
+- 'float16': weights stored as float16, roughly halving the model size
+- 'int8': full integer quantisation of weights and activations, calibrated
+  on a representative sample of prepared windows; inputs and outputs are
+  int8 and are (de)quantised by ml.activity_inference.ActivityClassifier
+
+benchmark_models() runs each exported variant through ActivityClassifier
+on the held-out windows and reports model size, per-window latency,
+throughput and accuracy relative to the first (reference) variant:
+
+    python -m ml.sensor_quantization --files ../dataset/subject101.dat \\
+        --cache-dir ../dataset/cache \\
+        --models sensor_model.tflite sensor_model_float16.tflite sensor_model_int8.tflite
+
+Run from the backend directory. Conversion needs TensorFlow; the benchmark
+only needs a TFLite interpreter.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from .activity_inference import ActivityClassifier, model_metadata_path
+from .benchmark import _environment, _latency_ms
+from .sensor_pipeline import WindowDataset
+
+QUANTIZATION_MODES = ('float32', 'float16', 'int8')
+
+
+def representative_windows(dataset: WindowDataset, n_samples: int = 200, seed: int = 0) -> np.ndarray:
+    """
+    Random sample of windows used to calibrate int8 quantisation.
+
+    Args:
+        dataset (WindowDataset): Windows to sample, normally the training set
+        n_samples (int): Windows in the sample
+        seed (int): Seed for sampling
+
+    Returns:
+        np.ndarray: float32 windows of shape (n_samples, seq_length, n_channels)
+    """
+    rng = np.random.default_rng(seed)
+    picked = np.sort(rng.choice(dataset.n_windows, min(n_samples, dataset.n_windows), replace=False))
+    rows = dataset.starts[picked, np.newaxis] + np.arange(dataset.seq_length)
+    return np.asarray(dataset.values[rows], dtype=np.float32)
+
+
+def convert_model(model, mode: str = 'float32', representative: Optional[np.ndarray] = None) -> bytes:
+    """
+    Convert a Keras model to TFLite with the given quantisation.
+
+    Args:
+        model (tf.keras.Model): Trained activity model
+        mode (str): One of QUANTIZATION_MODES
+        representative (Optional[np.ndarray]): Calibration windows from
+            representative_windows(); required for 'int8'
+
+    Returns:
+        bytes: The serialised .tflite model
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}'. Available: {', '.join(QUANTIZATION_MODES)}")
+    try:
+        import tensorflow as tf
+    except ImportError:
+        raise ImportError("TensorFlow is required to convert the sensor model") from None
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if mode == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        if representative is None or not len(representative):
+            raise ValueError("int8 quantization needs representative windows")
+
+        def calibration():
+            for window in representative:
+                yield [window[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = calibration
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+def save_model(tflite_model: bytes, path: str, metadata: Dict[str, Any]) -> None:
+    """
+    Write a .tflite model and its metadata file (read by ActivityClassifier).
+
+    Args:
+        tflite_model (bytes): Output of convert_model()
+        path (str): Path of the .tflite file
+        metadata (Dict[str, Any]): 'classes', 'seq_length', 'sensor_cols',
+            'normalizer' and 'quantization'
+    """
+    with open(path, 'wb') as f:
+        f.write(tflite_model)
+    with open(model_metadata_path(path), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+def benchmark_model(
+    model_path: str,
+    dataset: WindowDataset,
+    num_threads: Optional[int] = None,
+    batch_size: int = 64,
+    repeats: int = 200
+) -> Dict[str, Any]:
+    """
+    Measure one .tflite variant on CPU.
+
+    Accuracy and throughput come from one pass over the dataset in batches
+    of batch_size; per-window latency from repeated single-window calls.
+
+    Args:
+        model_path (str): Path of the .tflite model
+        dataset (WindowDataset): Labelled windows, normally the test set
+        num_threads (Optional[int]): Interpreter threads
+        batch_size (int): Windows per invocation for the throughput pass
+        repeats (int): Timed single-window calls
+
+    Returns:
+        Dict[str, Any]: Size, latency, throughput, accuracy and the
+        predicted class of every window ('predictions')
+    """
+    # The dataset's rows are already normalised
+    classifier = ActivityClassifier(model_path, num_threads=num_threads, max_batch_size=batch_size, normalize=False)
+    dataset = dataset.subset(np.arange(dataset.n_windows), shuffle=False)
+    dataset.batch_size = batch_size
+
+    predictions = np.empty(dataset.n_windows, dtype=np.int64)
+    elapsed = 0.0
+    offset = 0
+    for windows, _ in dataset.iter_batches():
+        start = time.perf_counter()
+        probabilities = classifier.predict(windows)
+        elapsed += time.perf_counter() - start
+        predictions[offset:offset + len(windows)] = probabilities.argmax(axis=1)
+        offset += len(windows)
+
+    single = dataset[0][0][:1]
+    classifier.predict(single)
+    return {
+        'model': model_path,
+        'quantized': classifier.quantized,
+        'size_kb': os.path.getsize(model_path) / 2 ** 10,
+        'window_latency_ms': _latency_ms(lambda: classifier.predict(single), repeats),
+        'throughput_windows_s': dataset.n_windows / elapsed if elapsed else None,
+        'accuracy': float((predictions == dataset.encoded).mean()),
+        'predictions': predictions
+    }
+
+
+def benchmark_models(model_paths: List[str], dataset: WindowDataset, **kwargs) -> List[Dict[str, Any]]:
+    """
+    Benchmark several variants against the first one.
+
+    Args:
+        model_paths (List[str]): .tflite models; the first is the reference
+        dataset (WindowDataset): Labelled windows, normally the test set
+        **kwargs: num_threads, batch_size and repeats for benchmark_model()
+
+    Returns:
+        List[Dict[str, Any]]: One row per model, adding 'accuracy_delta'
+        and 'agreement' (fraction of windows predicted as by the reference)
+        and the 'size_ratio' to the reference
+    """
+    rows = []
+    for path in model_paths:
+        rows.append(benchmark_model(path, dataset, **kwargs))
+
+    reference = rows[0]
+    for row in rows:
+        row['accuracy_delta'] = row['accuracy'] - reference['accuracy']
+        row['agreement'] = float((row['predictions'] == reference['predictions']).mean())
+        row['size_ratio'] = row['size_kb'] / reference['size_kb']
+    for row in rows:
+        del row['predictions']
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark quantised variants of the TFLite sensor model")
+    parser.add_argument('--models', nargs='+', required=True,
+                        help=".tflite models to compare; the first is the reference")
+    parser.add_argument('--files', nargs='+', required=True, help="Subject .dat files")
+    parser.add_argument('--cache-dir', required=True, help="Sensor cache directory")
+    parser.add_argument('--seq-length', type=int, default=50)
+    parser.add_argument('--test-size', type=float, default=0.2,
+                        help="Held-out fraction, as in lstm-model.py")
+    parser.add_argument('--seed', type=int, default=42, help="Split seed, as in lstm-model.py")
+    parser.add_argument('--threads', type=int, help="Interpreter threads")
+    parser.add_argument('--batch-size', type=int, default=64, help="Windows per invocation")
+    parser.add_argument('--repeats', type=int, default=200, help="Timed single-window calls")
+    parser.add_argument('--output', help="Write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    dataset = WindowDataset.from_files(args.files, cache_dir=args.cache_dir, seq_length=args.seq_length, seed=args.seed)
+    _, test = dataset.split(test_size=args.test_size, seed=args.seed)
+
+    rows = benchmark_models(args.models, test, num_threads=args.threads,
+                            batch_size=args.batch_size, repeats=args.repeats)
+    for row in rows:
+        print(f"{os.path.basename(row['model']):<32} {row['size_kb']:>8.1f} KB ({row['size_ratio']:.2f}x), "
+              f"window p50 {row['window_latency_ms']['p50']:.3f}ms, "
+              f"{row['throughput_windows_s']:.0f} windows/s, "
+              f"accuracy {row['accuracy']:.4f} ({row['accuracy_delta']:+.4f}), "
+              f"agreement {row['agreement']:.4f}", file=sys.stderr)
+
+    output = {'environment': _environment(), 'arguments': vars(args), 'results': rows}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
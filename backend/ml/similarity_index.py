@@ -0,0 +1,1089 @@
+# backend/ml/similarity_index.py
+"""
+Nearest-neighbour index backends for patient similarity.
+
+All backends work on L2-normalised rows so that cosine similarity is a
+plain dot product. Four backends are available:
+- 'brute': exact search over the whole matrix
+- 'sharded': exact search with the matrix in shared memory, split into
+  shards scanned in parallel by a pool of worker processes
+- 'ivf': approximate inverted-file search; rows are clustered with
+  spherical k-means once at build time and a query only scans the
+  n_probe lists whose centroids are closest to it
+- 'quantized': int8 scalar-quantised rows pick candidates that are
+  re-ranked exactly against the float rows
+
+Rows are stored as float32 by default ('dtype' parameter).
+
+All backends support incremental upserts and removals keyed by id, so
+an index can follow the cohort without being rebuilt from scratch.
+"""
+
+import numpy as np
+from typing import Dict, Any, Tuple, Optional
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+def normalize_rows(X: np.ndarray, dtype=np.float64) -> np.ndarray:
+    """
+    L2-normalise the rows of a matrix.
+
+    Args:
+        X (np.ndarray): Input matrix
+        dtype: Output dtype
+
+    Returns:
+        np.ndarray: Matrix with unit-length rows (all-zero rows stay zero)
+    """
+    X = np.asarray(X, dtype=dtype)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.maximum(norms, np.finfo(dtype).tiny)
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Select the k highest scores of each row, sorted in descending order.
+
+    Args:
+        scores (np.ndarray): Score matrix of shape (n_queries, n_candidates)
+        k (int): Number of results per row
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (positions, scores), both (n_queries, k)
+    """
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    """
+    Fraction of the exact top-k neighbours that an approximate search found.
+
+    Args:
+        approx_ids (np.ndarray): Approximate result ids, shape (n_queries, k)
+        exact_ids (np.ndarray): Exact result ids, shape (n_queries, k)
+
+    Returns:
+        float: Mean recall@k over all queries
+    """
+    hits = sum(
+        len(np.intersect1d(approx, exact, assume_unique=True))
+        for approx, exact in zip(approx_ids, exact_ids)
+    )
+    return hits / max(exact_ids.size, 1)
+
+
+def merge_top_k(
+    ids_a: np.ndarray,
+    scores_a: np.ndarray,
+    ids_b: np.ndarray,
+    scores_b: np.ndarray,
+    k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge two per-query top-k result sets into one.
+
+    Args:
+        ids_a, scores_a (np.ndarray): First result set, shape (n_queries, k_a)
+        ids_b, scores_b (np.ndarray): Second result set, shape (n_queries, k_b)
+        k (int): Number of results to keep
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Merged (ids, scores), shape (n_queries, k)
+    """
+    ids = np.concatenate([ids_a, ids_b], axis=1)
+    pos, scores = top_k(np.concatenate([scores_a, scores_b], axis=1), k)
+    return np.take_along_axis(ids, pos, axis=1), scores
+
+
+def search_rows(
+    Q: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    block_size: int = 16384,
+    query_block_size: int = 512
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top-k dot-product search of normalised queries against rows.
+
+    Rows and queries are scored in blocks, so the temporary score matrix
+    never exceeds query_block_size x block_size. Rows of another dtype
+    (e.g. int8 codes) are cast to the query dtype one block at a time.
+
+    Args:
+        Q (np.ndarray): Normalised queries of shape (n_queries, n_features)
+        vectors (np.ndarray): Normalised rows of shape (n_rows, n_features)
+        k (int): Number of results per query
+        block_size (int): Number of rows scored per block
+        query_block_size (int): Number of queries scored per block
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (row positions, scores), both
+        (n_queries, min(k, n_rows))
+    """
+    k = min(k, len(vectors))
+    result_pos = np.empty((len(Q), k), dtype=np.int64)
+    result_scores = np.empty((len(Q), k), dtype=np.result_type(Q.dtype, vectors.dtype))
+
+    for q_start in range(0, len(Q), query_block_size):
+        q_block = Q[q_start:q_start + query_block_size]
+        best_pos, best_scores = None, None
+
+        for start in range(0, len(vectors), block_size):
+            # Casting a block of codes up front is much faster than mixed-type matmul
+            block = vectors[start:start + block_size].astype(Q.dtype, copy=False)
+            pos, scores = top_k(q_block @ block.T, k)
+            pos = pos + start
+            if best_pos is not None:
+                pos = np.concatenate([best_pos, pos], axis=1)
+                scores = np.concatenate([best_scores, scores], axis=1)
+                merged, scores = top_k(scores, k)
+                pos = np.take_along_axis(pos, merged, axis=1)
+            best_pos, best_scores = pos, scores
+
+        result_pos[q_start:q_start + len(q_block)] = best_pos
+        result_scores[q_start:q_start + len(q_block)] = best_scores
+
+    return result_pos, result_scores
+
+
+def find_positions(all_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """
+    Locate ids in an unsorted id array.
+
+    Args:
+        all_ids (np.ndarray): Ids to search in
+        ids (np.ndarray): Ids to look up
+
+    Returns:
+        np.ndarray: Position of each id in all_ids, or -1 when absent
+    """
+    ids = np.asarray(ids, dtype=np.int64).ravel()
+    if all_ids is None or len(all_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+
+    if len(ids) <= 32:
+        # A few linear scans beat sorting a large id array
+        positions = []
+        for id_ in ids:
+            hits = np.flatnonzero(all_ids == id_)
+            positions.append(hits[0] if len(hits) else -1)
+        return np.asarray(positions, dtype=np.int64)
+
+    order = np.argsort(all_ids, kind='stable')
+    sorted_ids = all_ids[order]
+    loc = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[loc] == ids, order[loc], -1)
+
+
+class RowStore:
+    """
+    Growable matrix of rows keyed by int64 id.
+
+    Appends are amortised O(1) and removals move the last row into the freed
+    slot, so row order is not preserved. Ids handed to reset() are copied,
+    since several stores are often reset with the same id array; matrices
+    (e.g. memory-mapped ones) are only copied on the first mutation.
+    """
+
+    def __init__(self, dtype=np.float64):
+        """
+        Args:
+            dtype: Row dtype
+        """
+        self.dtype = dtype
+        self._matrix = None
+        self._ids = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> Optional[np.ndarray]:
+        """Stored rows."""
+        return None if self._matrix is None else self._matrix[:self._size]
+
+    @property
+    def ids(self) -> Optional[np.ndarray]:
+        """Id of each stored row."""
+        return None if self._ids is None else self._ids[:self._size]
+
+    def reset(self, X: np.ndarray, ids: np.ndarray) -> None:
+        """Replace the contents, taking a private copy of the ids but not of X."""
+        self._matrix = X
+        self._ids = np.array(ids, dtype=np.int64)
+        self._size = len(ids)
+
+    def _reserve(self, n_rows: int, n_features: int) -> None:
+        """Make room for n_rows rows in writeable buffers."""
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        writeable = self._matrix is not None and self._matrix.flags.writeable and self._ids.flags.writeable
+        if capacity >= n_rows and writeable:
+            return
+
+        capacity = max(n_rows, 2 * capacity, 1024)
+        matrix = np.empty((capacity, n_features), dtype=self.dtype)
+        ids = np.empty(capacity, dtype=np.int64)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+
+    def positions(self, ids: np.ndarray) -> np.ndarray:
+        """Row position of each id, or -1 when absent."""
+        return find_positions(self.ids, ids)
+
+    def get(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up rows by id.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (rows of the ids that were found,
+            boolean mask of which ids were found)
+        """
+        pos = self.positions(ids)
+        found = pos >= 0
+        return np.array(self.matrix[pos[found]]), found
+
+    def upsert(self, X: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """
+        Insert rows, replacing the rows of ids that are already stored.
+
+        Args:
+            X (np.ndarray): Rows of shape (n_rows, n_features)
+            ids (np.ndarray): Unique id of each row
+
+        Returns:
+            np.ndarray: Previous rows of the ids that were replaced
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=self.dtype))
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        pos = self.positions(ids)
+        found = pos >= 0
+        new = ~found
+
+        self._reserve(self._size + int(new.sum()), X.shape[1])
+        replaced = self._matrix[pos[found]].copy()
+        self._matrix[pos[found]] = X[found]
+
+        end = self._size + int(new.sum())
+        self._matrix[self._size:end] = X[new]
+        self._ids[self._size:end] = ids[new]
+        self._size = end
+
+        return replaced
+
+    def remove(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Remove rows by id; unknown ids are ignored.
+
+        Args:
+            ids (np.ndarray): Ids to remove
+
+        Returns:
+            np.ndarray: The removed rows
+        """
+        pos = self.positions(ids)
+        pos = np.sort(pos[pos >= 0])[::-1]
+        if len(pos) == 0:
+            n_features = 0 if self._matrix is None else self._matrix.shape[1]
+            return np.empty((0, n_features), dtype=self.dtype)
+
+        removed = self._matrix[pos].copy()
+        self._reserve(self._size, self._matrix.shape[1])
+        # Descending order guarantees the last row is never one still to remove
+        for p in pos:
+            last = self._size - 1
+            if p != last:
+                self._matrix[p] = self._matrix[last]
+                self._ids[p] = self._ids[last]
+            self._size -= 1
+
+        return removed
+
+
+class BruteForceIndex:
+    """Exact cosine search over every indexed row."""
+
+    name = 'brute'
+
+    def __init__(self, block_size: int = 16384, query_block_size: int = 512, dtype: str = 'float32'):
+        """
+        Args:
+            block_size (int): Number of indexed rows scored per block
+            query_block_size (int): Number of queries scored per block; together
+                with block_size this bounds the temporary score matrix
+            dtype (str): Storage dtype of the normalised rows
+        """
+        self.block_size = block_size
+        self.query_block_size = query_block_size
+        self.dtype = dtype
+        self.store = RowStore(dtype=np.dtype(dtype))
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    @property
+    def vectors(self) -> Optional[np.ndarray]:
+        """Indexed L2-normalised rows."""
+        return self.store.matrix
+
+    @property
+    def ids(self) -> Optional[np.ndarray]:
+        """Id of each indexed row."""
+        return self.store.ids
+
+    def params(self) -> Dict[str, Any]:
+        """Constructor parameters, used to persist the index."""
+        return {'block_size': self.block_size, 'query_block_size': self.query_block_size, 'dtype': self.dtype}
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes held by the index arrays.
+
+        Returns:
+            Dict[str, int]: 'total' bytes and 'scanned' bytes, the part read
+            by every query
+        """
+        if not len(self):
+            return {'total': 0, 'scanned': 0}
+        return {'total': self.vectors.nbytes + self.ids.nbytes, 'scanned': self.vectors.nbytes}
+
+    def build(self, X: np.ndarray, ids: Optional[np.ndarray] = None) -> None:
+        """
+        Build the index.
+
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_samples, n_features)
+            ids (Optional[np.ndarray]): Id of each row (defaults to row position)
+        """
+        ids = np.arange(len(X), dtype=np.int64) if ids is None else np.array(ids, dtype=np.int64)
+        self.store.reset(normalize_rows(X, dtype=self.dtype), ids)
+
+    def upsert(self, X: np.ndarray, ids: np.ndarray) -> None:
+        """
+        Add rows, replacing the rows of ids that are already indexed.
+
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_rows, n_features)
+            ids (np.ndarray): Unique id of each row
+        """
+        self.store.upsert(normalize_rows(np.atleast_2d(X), dtype=self.dtype), ids)
+
+    def remove(self, ids: np.ndarray) -> None:
+        """
+        Remove rows by id; unknown ids are ignored.
+
+        Args:
+            ids (np.ndarray): Ids to remove
+        """
+        self.store.remove(ids)
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All indexed (normalised) rows and their ids."""
+        return self.vectors, self.ids
+
+    def search(self, Q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k most similar indexed rows for each query.
+
+        Args:
+            Q (np.ndarray): Query matrix of shape (n_queries, n_features)
+            k (int): Number of neighbours
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (ids, cosine similarities), both (n_queries, k)
+        """
+        Q = normalize_rows(Q, dtype=self.vectors.dtype)
+        pos, scores = search_rows(Q, self.vectors, k, self.block_size, self.query_block_size)
+        return self.ids[pos], scores
+
+    def save(self, path: str) -> None:
+        """Write the index arrays to the artifact directory."""
+        np.save(os.path.join(path, 'index_vectors.npy'), self.vectors)
+        np.save(os.path.join(path, 'index_ids.npy'), self.ids)
+
+    @classmethod
+    def load(cls, path: str, params: Dict[str, Any], mmap_mode: Optional[str] = 'r') -> 'BruteForceIndex':
+        """Load an index written by save()."""
+        index = cls(**params)
+        index.store.reset(
+            np.load(os.path.join(path, 'index_vectors.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'index_ids.npy'), mmap_mode=mmap_mode)
+        )
+        return index
+
+
+# Shared-memory segments attached by this (worker) process, keyed by name
+_attached_segments = {}
+
+# Process pools used by sharded indexes, keyed by number of workers
+_shard_pools = {}
+_shard_pools_lock = threading.Lock()
+
+
+def _shard_pool(n_workers: int) -> ProcessPoolExecutor:
+    """Process pool shared by all sharded indexes with the same worker count."""
+    with _shard_pools_lock:
+        pool = _shard_pools.get(n_workers)
+        if pool is None:
+            # spawn rather than fork: the parent may be a threaded web worker
+            pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'))
+            _shard_pools[n_workers] = pool
+        return pool
+
+
+def _search_shard(
+    segment: str,
+    shape: Tuple[int, int],
+    dtype: str,
+    start: int,
+    stop: int,
+    Q: np.ndarray,
+    k: int,
+    block_size: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search rows [start, stop) of a matrix published in shared memory.
+
+    Runs in a pool worker. The segment stays attached between calls; when a
+    newer segment is published the older ones are detached.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (row positions in the whole matrix,
+        scores) of the shard's top k
+    """
+    vectors = _attached_segments.get(segment, (None, None))[1]
+    if vectors is None:
+        for shm, _ in _attached_segments.values():
+            shm.close()
+        _attached_segments.clear()
+        shm = shared_memory.SharedMemory(name=segment)
+        vectors = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        _attached_segments[segment] = (shm, vectors)
+
+    pos, scores = search_rows(Q, vectors[start:stop], k, block_size, len(Q))
+    return pos + start, scores
+
+
+def _release_segment(shm: shared_memory.SharedMemory) -> None:
+    shm.close()
+    shm.unlink()
+
+
+class ShardedIndex(BruteForceIndex):
+    """
+    Exact cosine search split across a pool of worker processes.
+
+    The normalised rows are copied into a shared-memory segment once per
+    change and each worker scans a contiguous shard of it in place, so
+    shards are never pickled. The per-shard top k are merged with
+    merge_top_k. Small indexes are searched in-process, where the pool
+    round trip would cost more than the scan.
+    """
+
+    name = 'sharded'
+
+    def __init__(
+        self,
+        n_shards: Optional[int] = None,
+        min_shard_rows: int = 65536,
+        block_size: int = 16384,
+        query_block_size: int = 512,
+        dtype: str = 'float32'
+    ):
+        """
+        Args:
+            n_shards (Optional[int]): Number of shards and worker processes
+                (defaults to the number of CPUs)
+            min_shard_rows (int): Minimum rows per shard; fewer shards are
+                used for smaller indexes, and none below 2 * min_shard_rows
+            block_size (int): Number of indexed rows scored per block
+            query_block_size (int): Number of queries sent to the workers
+                per round
+            dtype (str): Storage dtype of the normalised rows
+        """
+        super().__init__(block_size=block_size, query_block_size=query_block_size, dtype=dtype)
+        self.n_shards = n_shards or os.cpu_count() or 1
+        self.min_shard_rows = min_shard_rows
+        self._segment = None
+        self._finalizer = None
+        self._published = False
+
+    def params(self) -> Dict[str, Any]:
+        """Constructor parameters, used to persist the index."""
+        return {
+            'n_shards': self.n_shards,
+            'min_shard_rows': self.min_shard_rows,
+            'block_size': self.block_size,
+            'query_block_size': self.query_block_size,
+            'dtype': self.dtype
+        }
+
+    def build(self, X: np.ndarray, ids: Optional[np.ndarray] = None) -> None:
+        super().build(X, ids)
+        self._published = False
+
+    def upsert(self, X: np.ndarray, ids: np.ndarray) -> None:
+        super().upsert(X, ids)
+        self._published = False
+
+    def remove(self, ids: np.ndarray) -> None:
+        super().remove(ids)
+        self._published = False
+
+    def _publish(self) -> None:
+        """Copy the current rows into a fresh shared-memory segment."""
+        vectors = self.vectors
+        shm = shared_memory.SharedMemory(create=True, size=max(vectors.nbytes, 1))
+        np.ndarray(vectors.shape, dtype=vectors.dtype, buffer=shm.buf)[:] = vectors
+        self.close()
+        self._segment = shm
+        self._finalizer = weakref.finalize(self, _release_segment, shm)
+        self._published = True
+
+    def close(self) -> None:
+        """Release the shared-memory segment (it is recreated on the next search)."""
+        if self._finalizer is not None:
+            self._finalizer()
+        self._segment = None
+        self._finalizer = None
+        self._published = False
+
+    def search(self, Q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k most similar indexed rows for each query.
+
+        Args:
+            Q (np.ndarray): Query matrix of shape (n_queries, n_features)
+            k (int): Number of neighbours
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (ids, cosine similarities), both (n_queries, k)
+        """
+        n_shards = min(self.n_shards, len(self) // max(self.min_shard_rows, 1))
+        if n_shards < 2:
+            return super().search(Q, k)
+
+        if not self._published:
+            self._publish()
+
+        Q = normalize_rows(Q, dtype=self.vectors.dtype)
+        bounds = np.linspace(0, len(self), n_shards + 1).astype(np.int64)
+        shape, dtype = self.vectors.shape, self.vectors.dtype.str
+        pool = _shard_pool(self.n_shards)
+
+        pos_blocks, score_blocks = [], []
+        for q_start in range(0, len(Q), self.query_block_size):
+            q_block = Q[q_start:q_start + self.query_block_size]
+            futures = [
+                pool.submit(_search_shard, self._segment.name, shape, dtype, int(start), int(stop),
+                            q_block, k, self.block_size)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            pos, scores = futures[0].result()
+            for future in futures[1:]:
+                pos, scores = merge_top_k(pos, scores, *future.result(), k)
+            pos_blocks.append(pos)
+            score_blocks.append(scores)
+
+        return self.ids[np.concatenate(pos_blocks)], np.concatenate(score_blocks)
+
+
+class IVFIndex:
+    """
+    Approximate cosine search with an inverted-file index.
+
+    Rows are stored grouped by their nearest centroid, so probing a list is
+    a contiguous slice of the vector matrix. Incremental changes do not touch
+    that layout: removed or replaced rows are tombstoned and upserted rows go
+    to a small exact pending index that is searched alongside the lists,
+    until the next build() folds them in.
+    """
+
+    name = 'ivf'
+
+    def __init__(
+        self,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        n_iter: int = 10,
+        train_size: int = 100000,
+        block_size: int = 8192,
+        seed: int = 0,
+        dtype: str = 'float32'
+    ):
+        """
+        Args:
+            n_lists (Optional[int]): Number of inverted lists (defaults to
+                sqrt(n_samples))
+            n_probe (int): Number of lists scanned per query
+            n_iter (int): Number of k-means iterations
+            train_size (int): Maximum number of rows used to train the centroids
+            block_size (int): Number of rows assigned to lists per block
+            seed (int): Random seed for centroid training
+            dtype (str): Storage dtype of the normalised rows
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.train_size = train_size
+        self.block_size = block_size
+        self.seed = seed
+        self.dtype = dtype
+        self.centroids = None
+        self.offsets = None
+        self.vectors = None
+        self.ids = None
+        self.deleted = None
+        self.pending = BruteForceIndex(dtype=dtype)
+
+    def __len__(self) -> int:
+        if self.ids is None:
+            return len(self.pending)
+        return len(self.ids) - int(self.deleted.sum()) + len(self.pending)
+
+    @property
+    def n_pending(self) -> int:
+        """Number of upserted rows not yet folded into the inverted lists."""
+        return len(self.pending)
+
+    def params(self) -> Dict[str, Any]:
+        """Constructor parameters, used to persist the index."""
+        return {
+            'n_lists': self.n_lists,
+            'n_probe': self.n_probe,
+            'n_iter': self.n_iter,
+            'train_size': self.train_size,
+            'block_size': self.block_size,
+            'seed': self.seed,
+            'dtype': self.dtype
+        }
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes held by the index arrays.
+
+        Returns:
+            Dict[str, int]: 'total' bytes and 'scanned' bytes, the part read
+            by every query (centroids and pending rows; probed lists are
+            read on top of that)
+        """
+        pending = self.pending.memory_usage()
+        if self.ids is None:
+            return pending
+        lists = self.vectors.nbytes + self.ids.nbytes + self.deleted.nbytes + self.offsets.nbytes
+        return {
+            'total': lists + self.centroids.nbytes + pending['total'],
+            'scanned': self.centroids.nbytes + pending['scanned']
+        }
+
+    def _assign(self, X: np.ndarray) -> np.ndarray:
+        """Nearest centroid of each row, computed in blocks."""
+        assignment = np.empty(len(X), dtype=np.int64)
+        for start in range(0, len(X), self.block_size):
+            block = X[start:start + self.block_size]
+            assignment[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignment
+
+    def _train_centroids(self, X: np.ndarray) -> None:
+        """Spherical k-means on a random sample of the rows."""
+        rng = np.random.default_rng(self.seed)
+        sample = X[rng.choice(len(X), size=min(len(X), self.train_size), replace=False)]
+        self.centroids = sample[rng.choice(len(sample), size=self.n_lists, replace=False)].copy()
+
+        for _ in range(self.n_iter):
+            labels = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=self.n_lists)
+            # Empty lists keep their previous centroid
+            filled = counts > 0
+            self.centroids[filled] = normalize_rows(sums[filled])
+
+    def build(self, X: np.ndarray, ids: Optional[np.ndarray] = None) -> None:
+        """
+        Build the index.
+
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_samples, n_features)
+            ids (Optional[np.ndarray]): Id of each row (defaults to row position)
+        """
+        X = normalize_rows(X, dtype=self.dtype)
+        ids = np.arange(len(X), dtype=np.int64) if ids is None else np.array(ids, dtype=np.int64)
+        if self.n_lists is None:
+            self.n_lists = max(1, int(np.sqrt(len(X))))
+        self.n_lists = min(self.n_lists, len(X))
+
+        self._train_centroids(X)
+        assignment = self._assign(X)
+
+        order = np.argsort(assignment, kind='stable')
+        self.vectors = X[order]
+        self.ids = ids[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=self.n_lists))])
+        self.deleted = np.zeros(len(X), dtype=bool)
+        self.pending = BruteForceIndex(dtype=self.dtype)
+
+    def upsert(self, X: np.ndarray, ids: np.ndarray) -> None:
+        """
+        Add rows, replacing the rows of ids that are already indexed.
+
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_rows, n_features)
+            ids (np.ndarray): Unique id of each row
+        """
+        self._tombstone(ids)
+        self.pending.upsert(X, ids)
+
+    def remove(self, ids: np.ndarray) -> None:
+        """
+        Remove rows by id; unknown ids are ignored.
+
+        Args:
+            ids (np.ndarray): Ids to remove
+        """
+        self._tombstone(ids)
+        self.pending.remove(ids)
+
+    def _tombstone(self, ids: np.ndarray) -> None:
+        """Mark the list rows of ids as deleted."""
+        if self.ids is None:
+            return
+        pos = find_positions(self.ids, ids)
+        self.deleted[pos[pos >= 0]] = True
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All live indexed (normalised) rows and their ids."""
+        alive = ~self.deleted
+        if not len(self.pending):
+            return self.vectors[alive], self.ids[alive]
+        return (
+            np.concatenate([self.vectors[alive], self.pending.vectors]),
+            np.concatenate([self.ids[alive], self.pending.ids])
+        )
+
+    def search(self, Q: np.ndarray, k: int, n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find (approximately) the k most similar indexed rows for each query.
+
+        Args:
+            Q (np.ndarray): Query matrix of shape (n_queries, n_features)
+            k (int): Number of neighbours
+            n_probe (Optional[int]): Lists to scan (defaults to self.n_probe)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (ids, cosine similarities), both
+            (n_queries, k); missing results are padded with id -1 and score -inf
+        """
+        Q = normalize_rows(Q, dtype=self.vectors.dtype)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        probes, _ = top_k(Q @ self.centroids.T, n_probe)
+
+        result_ids = np.full((len(Q), k), -1, dtype=np.int64)
+        result_scores = np.full((len(Q), k), -np.inf)
+
+        for i, query in enumerate(Q):
+            rows = np.concatenate([
+                np.arange(self.offsets[l], self.offsets[l + 1]) for l in probes[i]
+            ])
+            rows = rows[~self.deleted[rows]]
+            if len(rows) == 0:
+                continue
+            pos, scores = top_k((self.vectors[rows] @ query)[np.newaxis, :], k)
+            result_ids[i, :pos.shape[1]] = self.ids[rows[pos[0]]]
+            result_scores[i, :pos.shape[1]] = scores[0]
+
+        if len(self.pending):
+            pending_ids, pending_scores = self.pending.search(Q, k)
+            result_ids, result_scores = merge_top_k(
+                result_ids, result_scores, pending_ids, pending_scores, k
+            )
+
+        return result_ids, result_scores
+
+    def tune(self, Q: np.ndarray, k: int, target_recall: float, exact_ids: np.ndarray) -> Dict[str, Any]:
+        """
+        Raise n_probe until recall@k against exact results reaches the target.
+
+        Args:
+            Q (np.ndarray): Sample queries
+            k (int): Number of neighbours
+            target_recall (float): Required recall@k (0-1)
+            exact_ids (np.ndarray): Exact top-k ids for the sample queries
+
+        Returns:
+            Dict[str, Any]: Chosen n_probe and the recall measured at each step
+        """
+        curve = {}
+        n_probe = self.n_probe
+        while True:
+            approx_ids, _ = self.search(Q, k, n_probe=n_probe)
+            curve[n_probe] = recall_at_k(approx_ids, exact_ids)
+            if curve[n_probe] >= target_recall or n_probe >= self.n_lists:
+                break
+            n_probe = min(n_probe * 2, self.n_lists)
+
+        self.n_probe = n_probe
+        return {'n_probe': n_probe, 'recall': curve[n_probe], 'recall_by_n_probe': curve}
+
+    def save(self, path: str) -> None:
+        """Write the index arrays to the artifact directory."""
+        np.save(os.path.join(path, 'index_vectors.npy'), self.vectors)
+        np.save(os.path.join(path, 'index_ids.npy'), self.ids)
+        np.save(os.path.join(path, 'index_centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'index_offsets.npy'), self.offsets)
+        np.save(os.path.join(path, 'index_deleted.npy'), self.deleted)
+        if len(self.pending):
+            pending_vectors, pending_ids = self.pending.snapshot()
+        else:
+            pending_vectors = np.empty((0, self.vectors.shape[1]), dtype=self.vectors.dtype)
+            pending_ids = np.empty(0, dtype=np.int64)
+        np.save(os.path.join(path, 'index_pending_vectors.npy'), pending_vectors)
+        np.save(os.path.join(path, 'index_pending_ids.npy'), pending_ids)
+
+    @classmethod
+    def load(cls, path: str, params: Dict[str, Any], mmap_mode: Optional[str] = 'r') -> 'IVFIndex':
+        """Load an index written by save()."""
+        index = cls(**params)
+        index.vectors = np.load(os.path.join(path, 'index_vectors.npy'), mmap_mode=mmap_mode)
+        index.ids = np.load(os.path.join(path, 'index_ids.npy'), mmap_mode=mmap_mode)
+        index.centroids = np.load(os.path.join(path, 'index_centroids.npy'))
+        index.offsets = np.load(os.path.join(path, 'index_offsets.npy'))
+        index.deleted = np.load(os.path.join(path, 'index_deleted.npy'))
+        index.pending.store.reset(
+            np.load(os.path.join(path, 'index_pending_vectors.npy')),
+            np.load(os.path.join(path, 'index_pending_ids.npy'))
+        )
+        return index
+
+
+class QuantizedIndex:
+    """
+    Cosine search over int8 scalar-quantised rows with float re-ranking.
+
+    Every feature of the normalised rows is mapped onto 256 levels with its
+    own scale and offset. Queries scan the int8 codes to pick
+    k * rerank_factor candidates, which are then re-scored exactly against
+    the float rows. The scan reads a quarter of the bytes of a float32
+    index; the float rows are only touched at the candidates, so when the
+    index is loaded memory-mapped they mostly stay on disk.
+    """
+
+    name = 'quantized'
+
+    def __init__(
+        self,
+        rerank_factor: int = 4,
+        block_size: int = 16384,
+        query_block_size: int = 512,
+        dtype: str = 'float32'
+    ):
+        """
+        Args:
+            rerank_factor (int): Candidates re-ranked per requested neighbour
+            block_size (int): Number of codes scored per block
+            query_block_size (int): Number of queries scored per block
+            dtype (str): Storage dtype of the normalised rows used for
+                re-ranking
+        """
+        self.rerank_factor = rerank_factor
+        self.block_size = block_size
+        self.query_block_size = query_block_size
+        self.dtype = dtype
+        self.store = RowStore(dtype=np.dtype(dtype))
+        self.codes = RowStore(dtype=np.int8)
+        self.scale = None
+        self.offset = None
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    @property
+    def vectors(self) -> Optional[np.ndarray]:
+        """Indexed L2-normalised rows."""
+        return self.store.matrix
+
+    @property
+    def ids(self) -> Optional[np.ndarray]:
+        """Id of each indexed row."""
+        return self.store.ids
+
+    def params(self) -> Dict[str, Any]:
+        """Constructor parameters, used to persist the index."""
+        return {
+            'rerank_factor': self.rerank_factor,
+            'block_size': self.block_size,
+            'query_block_size': self.query_block_size,
+            'dtype': self.dtype
+        }
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes held by the index arrays.
+
+        Returns:
+            Dict[str, int]: 'total' bytes and 'scanned' bytes, the part read
+            by every query (the int8 codes)
+        """
+        if not len(self):
+            return {'total': 0, 'scanned': 0}
+        codes = self.codes.matrix.nbytes
+        return {'total': codes + self.vectors.nbytes + self.ids.nbytes, 'scanned': codes}
+
+    def _quantize(self, V: np.ndarray) -> np.ndarray:
+        """Map normalised rows onto int8 codes, clipping values outside the fitted range."""
+        codes = np.empty(V.shape, dtype=np.int8)
+        for start in range(0, len(V), self.block_size):
+            levels = np.rint((V[start:start + self.block_size] - self.offset) / self.scale)
+            codes[start:start + len(levels)] = np.clip(levels, 0, 255) - 128
+        return codes
+
+    def build(self, X: np.ndarray, ids: Optional[np.ndarray] = None) -> None:
+        """
+        Build the index, fitting the per-feature quantiser on X.
+
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_samples, n_features)
+            ids (Optional[np.ndarray]): Id of each row (defaults to row position)
+        """
+        V = normalize_rows(X, dtype=self.dtype)
+        ids = np.arange(len(V), dtype=np.int64) if ids is None else np.array(ids, dtype=np.int64)
+        self.offset = V.min(axis=0)
+        self.scale = np.maximum((V.max(axis=0) - self.offset) / 255, np.finfo(V.dtype).tiny)
+        self.store.reset(V, ids)
+        self.codes.reset(self._quantize(V), ids)
+
+    def upsert(self, X: np.ndarray, ids: np.ndarray) -> None:
+        """
+        Add rows, replacing the rows of ids that are already indexed.
+
+        The quantiser is not refitted; values outside its range are clipped,
+        which only affects candidate selection, not the re-ranked scores.
+
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_rows, n_features)
+            ids (np.ndarray): Unique id of each row
+        """
+        V = normalize_rows(np.atleast_2d(X), dtype=self.dtype)
+        self.store.upsert(V, ids)
+        self.codes.upsert(self._quantize(V), ids)
+
+    def remove(self, ids: np.ndarray) -> None:
+        """
+        Remove rows by id; unknown ids are ignored.
+
+        Args:
+            ids (np.ndarray): Ids to remove
+        """
+        self.store.remove(ids)
+        self.codes.remove(ids)
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All indexed (normalised) rows and their ids."""
+        return self.vectors, self.ids
+
+    def search(self, Q: np.ndarray, k: int, rerank_factor: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k most similar indexed rows for each query.
+
+        Args:
+            Q (np.ndarray): Query matrix of shape (n_queries, n_features)
+            k (int): Number of neighbours
+            rerank_factor (Optional[int]): Candidates re-ranked per neighbour
+                (defaults to self.rerank_factor)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (ids, cosine similarities), both (n_queries, k)
+        """
+        Q = normalize_rows(Q, dtype=self.dtype)
+        k = min(k, len(self))
+        n_candidates = min(k * (rerank_factor or self.rerank_factor), len(self))
+
+        # q . (scale * (c + 128) + offset) ranks rows like (q * scale) . c,
+        # since the remaining term is the same for every row
+        candidates, _ = search_rows(Q * self.scale, self.codes.matrix, n_candidates,
+                                    self.block_size, self.query_block_size)
+
+        exact = np.einsum('qcd,qd->qc', self.vectors[candidates], Q)
+        pos, scores = top_k(exact, k)
+        return self.ids[np.take_along_axis(candidates, pos, axis=1)], scores
+
+    def tune(self, Q: np.ndarray, k: int, target_recall: float, exact_ids: np.ndarray) -> Dict[str, Any]:
+        """
+        Raise rerank_factor until recall@k against exact results reaches the target.
+
+        Args:
+            Q (np.ndarray): Sample queries
+            k (int): Number of neighbours
+            target_recall (float): Required recall@k (0-1)
+            exact_ids (np.ndarray): Exact top-k ids for the sample queries
+
+        Returns:
+            Dict[str, Any]: Chosen rerank_factor and the recall measured at each step
+        """
+        curve = {}
+        rerank_factor = self.rerank_factor
+        while True:
+            approx_ids, _ = self.search(Q, k, rerank_factor=rerank_factor)
+            curve[rerank_factor] = recall_at_k(approx_ids, exact_ids)
+            if curve[rerank_factor] >= target_recall or k * rerank_factor >= len(self):
+                break
+            rerank_factor *= 2
+
+        self.rerank_factor = rerank_factor
+        return {'rerank_factor': rerank_factor, 'recall': curve[rerank_factor], 'recall_by_rerank_factor': curve}
+
+    def save(self, path: str) -> None:
+        """Write the index arrays to the artifact directory."""
+        np.save(os.path.join(path, 'index_vectors.npy'), self.vectors)
+        np.save(os.path.join(path, 'index_ids.npy'), self.ids)
+        np.save(os.path.join(path, 'index_codes.npy'), self.codes.matrix)
+        np.save(os.path.join(path, 'index_quantizer.npy'), np.stack([self.scale, self.offset]))
+
+    @classmethod
+    def load(cls, path: str, params: Dict[str, Any], mmap_mode: Optional[str] = 'r') -> 'QuantizedIndex':
+        """Load an index written by save()."""
+        index = cls(**params)
+        ids = np.load(os.path.join(path, 'index_ids.npy'))
+        index.store.reset(np.load(os.path.join(path, 'index_vectors.npy'), mmap_mode=mmap_mode), ids)
+        index.codes.reset(np.load(os.path.join(path, 'index_codes.npy'), mmap_mode=mmap_mode), ids)
+        index.scale, index.offset = np.load(os.path.join(path, 'index_quantizer.npy'))
+        return index
+
+
+# Available index backends, keyed by name
+INDEX_BACKENDS = {
+    BruteForceIndex.name: BruteForceIndex,
+    ShardedIndex.name: ShardedIndex,
+    IVFIndex.name: IVFIndex,
+    QuantizedIndex.name: QuantizedIndex,
+}
+
+
+def create_index(backend: str = 'brute', **params):
+    """
+    Create an index backend by name.
+
+    Args:
+        backend (str): Backend name ('brute', 'sharded', 'ivf' or 'quantized')
+        **params: Backend constructor parameters
+
+    Returns:
+        An unbuilt index instance
+    """
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unsupported index backend: {backend}")
+    return INDEX_BACKENDS[backend](**params)
@@ -0,0 +1,537 @@
+# backend/ml/tests.py
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+from .activity_inference import MicroBatcher
+from .online_stats import RunningStats
+from .patient_similarity import PatientSimilarity
+from .result_cache import ResultCache
+from .sensor_pipeline import (
+    COLUMN_NAMES, LABEL_COLUMN, SUBJECT_COLUMN, ChannelNormalizer, build_windows, consistent_windows, ingest_subject,
+    sliding_windows
+)
+from .trajectory import TrajectoryIndex, dtw_batch, envelope, lb_keogh
+from .similarity_index import INDEX_BACKENDS, BruteForceIndex, RowStore, create_index, normalize_rows, recall_at_k
+
+
+class RowStoreTests(unittest.TestCase):
+    def test_reset_copies_ids(self):
+        ids = np.arange(10, dtype=np.int64)
+        first, second = RowStore(), RowStore()
+        first.reset(np.eye(10), ids)
+        second.reset(np.eye(10) * 2, ids)
+
+        first.remove([3])
+
+        np.testing.assert_array_equal(ids, np.arange(10))
+        np.testing.assert_array_equal(second.ids, np.arange(10))
+        self.assertEqual(len(first), 9)
+        self.assertNotIn(3, first.ids)
+
+    def test_upsert_remove_round_trip(self):
+        store = RowStore()
+        store.reset(np.zeros((3, 2)), np.array([1, 2, 3]))
+
+        replaced = store.upsert(np.array([[1.0, 1.0], [4.0, 4.0]]), np.array([2, 4]))
+        np.testing.assert_array_equal(replaced, [[0.0, 0.0]])
+        removed = store.remove(np.array([1, 99]))
+        np.testing.assert_array_equal(removed, [[0.0, 0.0]])
+
+        rows, found = store.get(np.array([2, 4, 1]))
+        np.testing.assert_array_equal(found, [True, True, False])
+        np.testing.assert_array_equal(rows, [[1.0, 1.0], [4.0, 4.0]])
+        self.assertEqual(sorted(store.ids), [2, 3, 4])
+
+
+def synthetic_patients(n=200, seed=0):
+    """Synthetic cohort keyed by patient ids from 1000"""
+    patients = PatientSimilarity().generate_synthetic_data(num_patients=n, seed=seed)
+    for patient_id, patient in enumerate(patients, start=1000):
+        patient['id'] = patient_id
+    return patients
+
+
+class PatientSimilarityArtifactTests(unittest.TestCase):
+    def test_load_answers_like_the_fitted_model_without_refitting(self):
+        patients = synthetic_patients()
+        queries = synthetic_patients(20, seed=1)
+        for backend in INDEX_BACKENDS:
+            with self.subTest(backend=backend), tempfile.TemporaryDirectory() as path:
+                model = PatientSimilarity(n_neighbors=5, index=backend, auto_rebuild=False)
+                model.fit(patients, id_field='id')
+                expected_ids, expected_scores = model.find_similar_patients_batch(queries)
+                model.save(path)
+
+                with mock.patch.object(PatientSimilarity, 'fit', side_effect=AssertionError('refit')), \
+                        mock.patch.object(StandardScaler, 'fit', side_effect=AssertionError('refit')):
+                    loaded = PatientSimilarity.load(path)
+                    ids, scores = loaded.find_similar_patients_batch(queries)
+                    single = loaded.find_similar_patients(queries[0])
+
+                self.assertEqual(loaded.model_version, model.model_version)
+                np.testing.assert_array_equal(ids, expected_ids)
+                np.testing.assert_array_equal(scores, expected_scores)
+                self.assertEqual(len(single), 5)
+
+
+class IndexRecallTests(unittest.TestCase):
+    """Approximate and parallel backends against exact brute-force search"""
+    k = 10
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.X = rng.normal(size=(4000, 16))
+        self.ids = np.arange(len(self.X)) + 10
+        self.queries = rng.normal(size=(100, 16))
+        self.held_out = rng.normal(size=(100, 16))
+
+    def exact(self, queries):
+        index = BruteForceIndex()
+        index.build(self.X, self.ids)
+        return index.search(queries, self.k)
+
+    def built(self, backend, **params):
+        index = create_index(backend, **params)
+        index.build(self.X, self.ids)
+        return index
+
+    def test_ivf_recall(self):
+        exact_ids, exact_scores = self.exact(self.queries)
+        index = self.built('ivf')
+
+        # Probing every list is exhaustive
+        ids, scores = index.search(self.queries, self.k, n_probe=index.n_lists)
+        self.assertEqual(recall_at_k(ids, exact_ids), 1.0)
+        np.testing.assert_allclose(scores, exact_scores, atol=1e-5)
+
+        recalls = [recall_at_k(index.search(self.queries, self.k, n_probe=n)[0], exact_ids) for n in (1, 8, 32)]
+        self.assertEqual(recalls, sorted(recalls))
+        self.assertLess(recalls[0], 0.95)
+
+        # Tuned on one sample, the target holds (within sampling noise) on another
+        tuning = index.tune(self.queries, self.k, 0.95, exact_ids)
+        self.assertGreaterEqual(tuning['recall'], 0.95)
+        held_out_ids, _ = index.search(self.held_out, self.k)
+        self.assertGreaterEqual(recall_at_k(held_out_ids, self.exact(self.held_out)[0]), 0.9)
+
+    def test_sharded_search_is_exact(self):
+        exact_ids, exact_scores = self.exact(self.queries)
+        index = self.built('sharded', n_shards=4, min_shard_rows=500)
+        self.addCleanup(index.close)
+
+        ids, scores = index.search(self.queries, self.k)
+        self.assertEqual(recall_at_k(ids, exact_ids), 1.0)
+        np.testing.assert_allclose(scores, exact_scores, atol=1e-5)
+
+        # Changes after the rows were shared are searched too
+        index.remove(exact_ids[:, 0])
+        index.upsert(self.queries[:1], np.array([1]))
+        ids, _ = index.search(self.queries, self.k)
+        self.assertFalse(np.isin(exact_ids[:, 0], ids).any())
+        self.assertEqual(ids[0, 0], 1)
+
+    def test_quantized_recall(self):
+        exact_ids, exact_scores = self.exact(self.queries)
+        index = self.built('quantized')
+
+        ids, scores = index.search(self.queries, self.k)
+        self.assertGreaterEqual(recall_at_k(ids, exact_ids), 0.95)
+        # Re-ranked scores are exact cosine similarities
+        rows, _ = index.store.get(ids.ravel())
+        expected = np.einsum('qkd,qd->qk', rows.reshape(*ids.shape, -1), normalize_rows(self.queries))
+        np.testing.assert_allclose(scores, expected, atol=1e-5)
+
+        # Re-ranking every row is exhaustive
+        ids, scores = index.search(self.queries, self.k, rerank_factor=len(self.X) // self.k)
+        self.assertEqual(recall_at_k(ids, exact_ids), 1.0)
+        np.testing.assert_allclose(scores, exact_scores, atol=1e-5)
+
+        tuning = index.tune(self.queries, self.k, 0.99, exact_ids)
+        self.assertGreaterEqual(tuning['recall'], 0.99)
+        held_out_ids, _ = index.search(self.held_out, self.k)
+        self.assertGreaterEqual(recall_at_k(held_out_ids, self.exact(self.held_out)[0]), 0.95)
+
+    def test_target_recall_is_reported(self):
+        model = PatientSimilarity(n_neighbors=5, index='ivf', target_recall=0.95, auto_rebuild=False)
+        model.fit(synthetic_patients(1000), id_field='id')
+        self.assertGreaterEqual(model.recall_report['recall'], 0.95)
+        self.assertEqual(model.recall_report['backend'], 'ivf')
+        self.assertEqual(model.evaluate_recall()['recall'], model.recall_report['recall'])
+
+
+class PatientSimilarityQueryTests(unittest.TestCase):
+    def test_padded_results_are_dropped(self):
+        # One probed list of a few rows cannot fill 50 neighbours
+        model = PatientSimilarity(
+            n_neighbors=50, index='ivf', index_params={'n_lists': 50, 'n_probe': 1}, auto_rebuild=False
+        )
+        patients = synthetic_patients()
+        model.fit(patients, id_field='id')
+
+        results = model.find_similar_patients(patients[0])
+        self.assertLess(len(results), 50)
+        ids = [patient_id for patient_id, _ in results]
+        self.assertNotIn(-1, ids)
+        self.assertIn(patients[0]['id'], ids)
+        self.assertTrue(all(0.0 <= score <= 1.0 for _, score in results))
+
+    def test_batch_matches_single_queries(self):
+        # Small blocks so queries and rows span several of them
+        model = PatientSimilarity(
+            n_neighbors=5, index_params={'block_size': 64, 'query_block_size': 7}, auto_rebuild=False
+        )
+        model.fit(synthetic_patients(), id_field='id')
+        queries = synthetic_patients(30, seed=1)
+
+        ids, scores = model.find_similar_patients_batch(queries, k=8)
+        self.assertEqual(ids.shape, (30, 8))
+        self.assertEqual(scores.dtype, np.float32)
+        for i, query in enumerate(queries):
+            single_ids, single_scores = model.find_similar_patients_batch([query], k=8)
+            np.testing.assert_array_equal(ids[i], single_ids[0])
+            np.testing.assert_allclose(scores[i], single_scores[0], rtol=1e-6)
+
+        # Same ranking as a plain cosine similarity over the scaled features
+        X = model._transform_features(queries)
+        vectors, vector_ids = model.index.snapshot()
+        X /= np.linalg.norm(X, axis=1, keepdims=True)
+        expected = vector_ids[np.argsort(-(X @ np.asarray(vectors, dtype=np.float64).T), axis=1, kind='stable')[:, :8]]
+        np.testing.assert_array_equal(ids, expected)
+
+    def test_exact_matches_only(self):
+        model = PatientSimilarity(n_neighbors=1, auto_rebuild=False)
+        patients = synthetic_patients()
+        model.fit(patients, id_field='id')
+
+        [(patient_id, score)] = model.find_similar_patients(patients[3])
+        self.assertEqual(patient_id, patients[3]['id'])
+        self.assertEqual(score, 1.0)
+
+
+def naive_dtw(a, b, band=None):
+    """O(nm) DTW with squared Euclidean local cost, optionally within a Sakoe-Chiba band"""
+    n, m = len(a), len(b)
+    cost = np.full((n + 1, m + 1), np.inf)
+    cost[0, 0] = 0.0
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            if band is not None and abs(i - j) > band:
+                continue
+            local = float(((a[i - 1] - b[j - 1]) ** 2).sum())
+            cost[i, j] = local + min(cost[i - 1, j], cost[i, j - 1], cost[i - 1, j - 1])
+    return cost[n, m]
+
+
+class TrajectoryTests(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.series = rng.normal(size=(40, 12, 2)).cumsum(axis=1)
+        self.query = rng.normal(size=(12, 2)).cumsum(axis=0)
+
+    def test_dtw_matches_naive_reference(self):
+        # A band of length - 1 is no band at all
+        for band, reference_band in ((2, 2), (11, None)):
+            with self.subTest(band=band):
+                costs = dtw_batch(self.query, self.series, band)
+                expected = [naive_dtw(self.query, s, reference_band) for s in self.series]
+                np.testing.assert_allclose(costs, expected, rtol=1e-9)
+
+    def test_early_abandoning_only_drops_trajectories_above_the_cutoff(self):
+        expected = np.array([naive_dtw(self.query, s, 2) for s in self.series])
+        cutoff = np.median(expected)
+        costs = dtw_batch(self.query, self.series, 2, cutoff=cutoff)
+
+        abandoned = np.isinf(costs)
+        self.assertTrue(abandoned.any())
+        self.assertTrue((expected[abandoned] > cutoff).all())
+        np.testing.assert_allclose(costs[~abandoned], expected[~abandoned], rtol=1e-9)
+
+    def test_lb_keogh_is_a_lower_bound(self):
+        upper, lower = envelope(self.series, 2)
+        bounds = lb_keogh(self.query.ravel(), upper.reshape(40, -1), lower.reshape(40, -1))
+        expected = np.array([naive_dtw(self.query, s, 2) for s in self.series])
+        self.assertTrue((bounds <= expected + 1e-9).all())
+
+    def test_search_matches_exhaustive_dtw(self):
+        index = TrajectoryIndex(length=12, channels=['a', 'b'], band=2).build(self.series, ids=range(100, 140))
+        query = index._normalize(self.query[None])[0]
+        ids, distances = index.search(query, k=5)
+
+        expected = np.array([naive_dtw(query, s, 2) for s in index.series])
+        order = np.argsort(expected, kind='stable')[:5]
+        np.testing.assert_array_equal(ids, index.ids[order])
+        np.testing.assert_allclose(distances, np.sqrt(expected[order]), rtol=1e-5)
+
+
+class PatientSimilarityIncrementalTests(unittest.TestCase):
+    def setUp(self):
+        self.patients = synthetic_patients()
+
+    def fitted(self, backend):
+        model = PatientSimilarity(n_neighbors=5, index=backend, auto_rebuild=False)
+        model.fit(self.patients, id_field='id')
+        return model
+
+    def assert_removed(self, model, patient):
+        ids, _ = model.find_similar_patients_batch([patient], k=len(self.patients))
+        # Approximate backends pad results they could not fill with id -1
+        found = set(ids[0][ids[0] >= 0].tolist())
+        self.assertNotIn(patient['id'], found)
+        self.assertTrue(found <= {p['id'] for p in self.patients})
+        self.assertEqual(len(model.index), len(self.patients) - 1)
+        self.assertEqual(len(model.raw), len(self.patients) - 1)
+
+    def test_fit_remove_query(self):
+        for backend in INDEX_BACKENDS:
+            with self.subTest(backend=backend):
+                model = self.fitted(backend)
+                model.remove_patients([self.patients[5]['id']])
+                self.assert_removed(model, self.patients[5])
+
+    def test_upsert_then_query(self):
+        for backend in INDEX_BACKENDS:
+            with self.subTest(backend=backend):
+                model = self.fitted(backend)
+                patient = dict(self.patients[7], id=5000)
+                model.upsert_patients([patient])
+
+                ids, scores = model.find_similar_patients_batch([patient], k=2)
+                self.assertEqual(set(ids[0].tolist()), {5000, self.patients[7]['id']})
+                self.assertAlmostEqual(float(scores[0, 0]), 1.0, places=4)
+                self.assertEqual(len(model.index), len(self.patients) + 1)
+
+    def test_remove_after_load(self):
+        for backend in INDEX_BACKENDS:
+            with self.subTest(backend=backend), tempfile.TemporaryDirectory() as path:
+                self.fitted(backend).save(path)
+                model = PatientSimilarity.load(path)
+                model.remove_patients([self.patients[5]['id']])
+                self.assert_removed(model, self.patients[5])
+                # The saved artifact is not modified through the memory map
+                ids = np.load(os.path.join(path, 'raw_ids.npy'))
+                self.assertIn(self.patients[5]['id'], ids)
+
+
+class ResultCacheTests(unittest.TestCase):
+    def test_invalidate_drops_entries_of_and_listing_a_patient(self):
+        cache = ResultCache()
+        cache.set((1, 'v1', 10), [2, 3], related=[2, 3])
+        cache.set((4, 'v1', 10), [5], related=[5])
+        cache.set((3, 'v1', 10), [1], related=[1])
+
+        cache.invalidate(3)
+
+        self.assertIsNone(cache.get((1, 'v1', 10)))
+        self.assertIsNone(cache.get((3, 'v1', 10)))
+        self.assertEqual(cache.get((4, 'v1', 10)), [5])
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache._keys_of, {4: {(4, 'v1', 10)}, 5: {(4, 'v1', 10)}})
+
+    def test_replaced_and_evicted_entries_leave_no_references(self):
+        cache = ResultCache(max_entries=1)
+        cache.set((1, 'v1', 10), [2], related=[2])
+        cache.set((1, 'v1', 10), [3], related=[3])
+        self.assertEqual(cache._keys_of, {1: {(1, 'v1', 10)}, 3: {(1, 'v1', 10)}})
+
+        cache.set((4, 'v1', 10), [5], related=[5])
+        self.assertEqual(set(cache._keys_of), {4, 5})
+        self.assertEqual(list(cache._ids_of), [(4, 'v1', 10)])
+
+
+def loop_windows(values, labels, seq_length, stride, groups):
+    """Windows, last-row labels and consistency mask, one window at a time"""
+    windows, window_labels, keep = [], [], []
+    for start in range(0, len(values) - seq_length + 1, stride):
+        rows = slice(start, start + seq_length)
+        windows.append(values[rows])
+        window_labels.append(labels[start + seq_length - 1])
+        keep.append(len(set(labels[rows])) == 1 and len(set(groups[rows])) == 1)
+    return np.array(windows).reshape(-1, seq_length, values.shape[1]), np.array(window_labels), np.array(keep, dtype=bool)
+
+
+class WindowingTests(unittest.TestCase):
+    def test_windows_match_a_loop(self):
+        rng = np.random.default_rng(0)
+        n_rows = 60
+        values = rng.normal(size=(n_rows, 3)).astype(np.float32)
+        # Long runs, so that some windows are consistent, and a label that recurs after a change
+        labels = np.repeat(rng.choice([1, 2, 3], size=12), rng.integers(1, 10, size=12))[:n_rows]
+        labels = np.pad(labels, (0, n_rows - len(labels)), mode='edge')
+        groups = np.repeat([101, 102], n_rows // 2)
+        data = pd.DataFrame(values, columns=['a', 'b', 'c']).assign(**{LABEL_COLUMN: labels, SUBJECT_COLUMN: groups})
+
+        for seq_length in (1, 4, 7, n_rows, n_rows + 1):
+            for stride in (1, 2, 5):
+                with self.subTest(seq_length=seq_length, stride=stride):
+                    expected = loop_windows(values, labels, seq_length, stride, groups)
+                    np.testing.assert_array_equal(sliding_windows(values, seq_length, stride), expected[0])
+                    np.testing.assert_array_equal(consistent_windows(labels, seq_length, stride, groups), expected[2])
+
+                    windows, window_labels, keep = build_windows(data, seq_length, stride, ['a', 'b', 'c'])
+                    np.testing.assert_array_equal(windows, expected[0])
+                    np.testing.assert_array_equal(window_labels, expected[1])
+                    np.testing.assert_array_equal(keep, expected[2])
+
+        # Without groups only label changes end a run
+        expected = loop_windows(values, labels, 4, 1, np.zeros(n_rows))
+        np.testing.assert_array_equal(consistent_windows(labels, 4), expected[2])
+        self.assertTrue(0 < expected[2].sum() < len(expected[2]))
+
+
+class RunningStatsTests(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Large offset, where the naive sum-of-squares formula loses precision
+        self.X = rng.normal(loc=1e6, scale=3.0, size=(1000, 4))
+        self.batches = np.split(self.X, [1, 250, 251, 700])
+
+    def assert_matches(self, stats, X):
+        self.assertEqual(stats.count, len(X))
+        np.testing.assert_allclose(stats.mean, X.mean(axis=0), rtol=1e-12)
+        np.testing.assert_allclose(stats.var, X.var(axis=0), rtol=1e-9)
+        np.testing.assert_allclose(stats.std, X.std(axis=0), rtol=1e-9)
+
+    def test_updates_match_numpy(self):
+        stats = RunningStats()
+        for batch in self.batches:
+            stats.update(batch)
+        self.assert_matches(stats, self.X)
+
+        # Single rows and empty batches
+        stats = RunningStats(n_features=4)
+        for row in self.X[:10]:
+            stats.update(row)
+        stats.update(np.empty((0, 4)))
+        self.assert_matches(stats, self.X[:10])
+
+    def test_merge_matches_numpy(self):
+        merged = RunningStats()
+        for batch in self.batches:
+            merged.merge(RunningStats().update(batch))
+        merged.merge(RunningStats())
+        self.assert_matches(merged, self.X)
+
+    def test_remove_matches_numpy(self):
+        stats = RunningStats().update(self.X)
+        stats.remove(self.X[:300]).remove(self.X[300])
+        self.assert_matches(stats, self.X[301:])
+
+        stats.remove(self.X[301:])
+        self.assertEqual(stats.count, 0)
+
+    def test_normalizer_metadata_round_trips_through_json(self):
+        normalizer = ChannelNormalizer(sensor_cols=['a', 'b', 'c', 'd']).update(self.batches[0])
+        normalizer.merge(RunningStats().update(self.X[1:]))
+
+        restored = ChannelNormalizer.from_dict(json.loads(json.dumps(normalizer.to_dict())))
+        self.assertEqual(restored.sensor_cols, ['a', 'b', 'c', 'd'])
+        self.assert_matches(restored.stats, self.X)
+        windows = self.X[:20].reshape(5, 4, 4)
+        np.testing.assert_array_equal(restored.transform(windows), normalizer.transform(windows))
+        # transform() works in float32, where readings near 1e6 are only exact to ~0.06
+        np.testing.assert_allclose(restored.transform(self.X), (self.X - self.X.mean(axis=0)) / self.X.std(axis=0), atol=0.05)
+
+        with self.assertRaises(ValueError):
+            ChannelNormalizer().scaling
+
+
+class SensorCacheTests(unittest.TestCase):
+    def write_subject(self, directory, value):
+        os.makedirs(directory)
+        path = os.path.join(directory, 'subject101.dat')
+        with open(path, 'w') as f:
+            for _ in range(5):
+                f.write(' '.join([str(value)] * len(COLUMN_NAMES)) + '\n')
+        return path
+
+    def test_same_named_subjects_get_separate_caches(self):
+        with tempfile.TemporaryDirectory() as root:
+            protocol = self.write_subject(os.path.join(root, 'Protocol'), 1)
+            optional = self.write_subject(os.path.join(root, 'Optional'), 2)
+            cache_dir = os.path.join(root, 'cache')
+
+            metas = [ingest_subject(path, cache_dir) for path in (protocol, optional)]
+            self.assertNotEqual(metas[0]['array'], metas[1]['array'])
+
+            # Both caches are current, so ingesting again reuses them
+            mtimes = [os.path.getmtime(meta['array']) for meta in metas]
+            for path, meta, mtime in zip((protocol, optional), metas, mtimes):
+                self.assertEqual(ingest_subject(path, cache_dir), meta)
+                self.assertEqual(os.path.getmtime(meta['array']), mtime)
+            self.assertEqual(float(np.load(metas[1]['array'])[0, 0]), 2.0)
+
+
+class FakeClassifier:
+    """Stands in for ActivityClassifier: one probability per window, its first value"""
+    seq_length = 4
+    n_channels = 2
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+        self.fail = False
+
+    def predict(self, windows):
+        self.release.wait(5)
+        self.calls.append(len(windows))
+        if self.fail:
+            raise RuntimeError('interpreter failed')
+        return windows[:, 0, :1]
+
+
+def windows(value, n=1):
+    return np.full((n, FakeClassifier.seq_length, FakeClassifier.n_channels), value, dtype=np.float32)
+
+
+class MicroBatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.classifier = FakeClassifier()
+        self.batcher = MicroBatcher(self.classifier, max_batch_size=8, max_wait_ms=50)
+
+    def test_concurrent_requests_share_a_batch(self):
+        futures = [self.batcher.submit(windows(i)) for i in range(3)]
+        results = [future.result(5) for future in futures]
+        self.assertEqual([float(result[0, 0]) for result in results], [0.0, 1.0, 2.0])
+        self.assertEqual(self.classifier.calls, [3])
+
+    def test_cancelled_request_is_dropped(self):
+        cancelled = self.batcher.submit(windows(1))
+        self.assertTrue(cancelled.cancel())
+        kept = self.batcher.submit(windows(2, n=2))
+
+        np.testing.assert_array_equal(kept.result(5), [[2.0], [2.0]])
+        self.assertEqual(self.classifier.calls, [2])
+        # The worker is still serving requests
+        self.assertEqual(float(self.batcher.predict(windows(3), timeout=5)[0, 0]), 3.0)
+
+    def test_asyncio_timeout_does_not_stop_the_worker(self):
+        self.classifier.release.clear()
+
+        async def timed_out():
+            future = self.batcher.submit(windows(1))
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(asyncio.wrap_future(future), 0.01)
+
+        # The first batch is held in predict() while its request times out
+        # and a second one, cancelled while queued, is dropped
+        asyncio.run(timed_out())
+        asyncio.run(timed_out())
+        self.classifier.release.set()
+        self.assertEqual(float(self.batcher.predict(windows(4), timeout=5)[0, 0]), 4.0)
+
+    def test_failed_batch_sets_exception(self):
+        self.classifier.fail = True
+        with self.assertRaises(RuntimeError):
+            self.batcher.predict(windows(1), timeout=5)
+        self.classifier.fail = False
+        self.assertEqual(float(self.batcher.predict(windows(5), timeout=5)[0, 0]), 5.0)
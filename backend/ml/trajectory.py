@@ -0,0 +1,469 @@
+# backend/ml/trajectory.py
+"""
+Trajectory similarity over per-visit time series.
+
+Patients are compared on how their scores evolve across visits (e.g. the
+shape of a cognitive decline curve) rather than on a single snapshot. Each
+patient's visits are resampled onto a fixed-length time grid, giving an
+(length, n_channels) embedding, and trajectories are compared with dynamic
+time warping (DTW) constrained to a Sakoe-Chiba band.
+
+To keep queries over large cohorts interactive, TrajectoryIndex precomputes
+each stored trajectory's LB_Keogh envelope at build time. A query:
+1. takes the k-th smallest Euclidean distance as its starting cutoff (the
+   Euclidean distance is an upper bound of banded DTW),
+2. prunes every trajectory whose LB_Keogh lower bound exceeds the cutoff,
+3. runs DTW on the rest in ascending lower-bound order, in vectorised
+   batches, abandoning a trajectory as soon as its partial cost plus the
+   LB_Keogh bound of the remaining rows exceeds the current k-th best, and
+   stops once the next lower bound does.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import List, Dict, Any, Tuple, Optional, Sequence
+
+import numpy as np
+
+# Channels compared by default, in embedding column order
+TRAJECTORY_CHANNELS = ['cognitive_score', 'mood_score']
+
+
+def _visit_time(visit: Dict[str, Any], position: int) -> float:
+    """Time of a visit in days, falling back to its number or position."""
+    if visit.get('visit_date'):
+        return datetime.strptime(str(visit['visit_date'])[:10], '%Y-%m-%d').toordinal()
+    if visit.get('visit_number') is not None:
+        return float(visit['visit_number'])
+    return float(position)
+
+
+def resample_visits(
+    visits: Sequence[Dict[str, Any]],
+    length: int = 16,
+    channels: Sequence[str] = TRAJECTORY_CHANNELS
+) -> np.ndarray:
+    """
+    Resample one patient's visits onto a fixed-length time grid.
+
+    Visits are ordered by date (or visit number) and linearly interpolated
+    at `length` evenly spaced points between the first and last visit, so
+    patients with different numbers of visits or visit spacing become
+    directly comparable. Missing values are interpolated from the visits
+    that have them.
+
+    Args:
+        visits (Sequence[Dict[str, Any]]): Visit records of one patient
+        length (int): Number of resampled points
+        channels (Sequence[str]): Visit fields to resample
+
+    Returns:
+        np.ndarray: float32 array of shape (length, n_channels), NaN for a
+        channel without any value
+    """
+    times = np.array([_visit_time(visit, i) for i, visit in enumerate(visits)], dtype=np.float64)
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    span = times[-1] - times[0] if len(times) else 0.0
+    grid = np.linspace(times[0], times[-1], length) if span > 0 else None
+
+    out = np.full((length, len(channels)), np.nan, dtype=np.float32)
+    for c, channel in enumerate(channels):
+        values = np.array([visits[i].get(channel) for i in order], dtype=np.float64)
+        present = ~np.isnan(values)
+        if not present.any():
+            continue
+        if grid is None or present.sum() == 1:
+            out[:, c] = values[present].mean()
+        else:
+            out[:, c] = np.interp(grid, times[present], values[present])
+    return out
+
+
+def trajectories_from_visits(
+    visits: Sequence[Dict[str, Any]],
+    id_field: str = 'patient_id'
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Group a flat list of visits (as from generate_temporal_data) by patient.
+
+    Args:
+        visits (Sequence[Dict[str, Any]]): Visit records of many patients
+        id_field (str): Field holding the patient id
+
+    Returns:
+        Dict[int, List[Dict[str, Any]]]: Visits of each patient
+    """
+    grouped = {}
+    for visit in visits:
+        grouped.setdefault(visit[id_field], []).append(visit)
+    return grouped
+
+
+def envelope(series: np.ndarray, band: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    LB_Keogh envelope of trajectories.
+
+    Args:
+        series (np.ndarray): Trajectories of shape (n, length, n_channels)
+        band (int): Sakoe-Chiba band radius
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (upper, lower), each shaped like
+        series, the running max/min over a window of +-band points
+    """
+    padded = np.pad(series, ((0, 0), (band, band), (0, 0)), mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * band + 1, axis=1)
+    return windows.max(axis=-1), windows.min(axis=-1)
+
+
+def lb_keogh(query: np.ndarray, upper: np.ndarray, lower: np.ndarray) -> np.ndarray:
+    """
+    LB_Keogh lower bound of the squared DTW cost between query and series.
+
+    Trajectories and envelopes are passed flattened to length * n_channels
+    values, so the bound is a single reduction per pair.
+
+    Args:
+        query (np.ndarray): Flattened trajectory, or (n, length * n_channels)
+        upper (np.ndarray): Flattened envelope upper bound(s) of the other side
+        lower (np.ndarray): Flattened envelope lower bound(s) of the other side
+
+    Returns:
+        np.ndarray: Lower bound for each pair
+    """
+    excess = np.maximum(query - upper, 0) + np.maximum(lower - query, 0)
+    return np.einsum('...i,...i->...', excess, excess, dtype=np.float64)
+
+
+def dtw_batch(
+    query: np.ndarray,
+    series: np.ndarray,
+    band: int,
+    cutoff: float = np.inf,
+    remaining_bound: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Banded DTW between one query and a batch of trajectories, vectorised
+    over the batch, with early abandoning.
+
+    The local cost is the squared Euclidean distance across channels. After
+    each query row, a trajectory is dropped from the batch once its cheapest
+    partial path plus a lower bound on the rows still to come exceeds
+    `cutoff`.
+
+    Args:
+        query (np.ndarray): Trajectory of shape (length, n_channels)
+        series (np.ndarray): Trajectories of shape (n, length, n_channels)
+        band (int): Sakoe-Chiba band radius
+        cutoff (float): Squared cost above which a trajectory is abandoned
+        remaining_bound (Optional[np.ndarray]): (n, length) lower bound on the
+            cost of query rows i + 1 onwards (see row_bounds()); zero when None
+
+    Returns:
+        np.ndarray: Squared DTW cost per trajectory, inf where abandoned
+    """
+    n, length, _ = series.shape
+    result = np.full(n, np.inf)
+    alive = np.arange(n)
+    if remaining_bound is None:
+        remaining_bound = np.zeros((n, length))
+
+    # Local costs of the cells inside the band only: cell (i, j) is stored
+    # at [:, i, j - i + band]
+    offsets = np.arange(-band, band + 1)
+    cols = np.clip(np.arange(length)[:, None] + offsets, 0, length - 1)
+    diff = query[None, :, None, :] - series[:, cols, :]
+    local = (diff * diff).sum(axis=-1, dtype=np.float64)
+
+    prev = np.full((n, length), np.inf)
+    for i in range(length):
+        lo, hi = max(0, i - band), min(length, i + band + 1)
+        cur = np.full((len(alive), length), np.inf)
+        for j in range(lo, hi):
+            if i == 0 and j == 0:
+                best = 0.0
+            else:
+                best = prev[:, j]
+                if j > 0:
+                    best = np.minimum(best, np.minimum(prev[:, j - 1], cur[:, j - 1]))
+            cur[:, j] = local[:, i, j - i + band] + best
+
+        keep = cur[:, lo:hi].min(axis=1) + remaining_bound[:, i] <= cutoff
+        if not keep.all():
+            alive, cur, local, remaining_bound = alive[keep], cur[keep], local[keep], remaining_bound[keep]
+            if not len(alive):
+                return result
+        prev = cur
+
+    result[alive] = prev[:, -1]
+    return result
+
+
+def row_bounds(query: np.ndarray, upper: np.ndarray, lower: np.ndarray) -> np.ndarray:
+    """
+    Cumulative LB_Keogh bound on the DTW cost still to come after each row.
+
+    Args:
+        query (np.ndarray): Trajectory of shape (length, n_channels)
+        upper (np.ndarray): Envelope upper bounds (n, length, n_channels)
+        lower (np.ndarray): Envelope lower bounds (n, length, n_channels)
+
+    Returns:
+        np.ndarray: (n, length) array whose [:, i] bounds the cost of query
+        rows i + 1 onwards
+    """
+    excess = np.maximum(query - upper, 0) + np.maximum(lower - query, 0)
+    per_row = (excess * excess).sum(axis=-1, dtype=np.float64)
+    tail = np.cumsum(per_row[:, ::-1], axis=1)[:, ::-1]
+    return np.concatenate([tail[:, 1:], np.zeros((len(per_row), 1))], axis=1)
+
+
+class TrajectoryIndex:
+    """
+    DTW nearest-neighbour search over resampled patient trajectories.
+
+    Channels are standardised with the cohort's per-channel mean and
+    standard deviation before comparison, so cognitive (0-30) and mood
+    (1-10) scores weigh alike. With normalize='series' each trajectory is
+    instead z-normalised on its own, which compares curve shape only.
+    """
+
+    def __init__(
+        self,
+        length: int = 16,
+        channels: Sequence[str] = TRAJECTORY_CHANNELS,
+        band: Optional[int] = None,
+        normalize: str = 'cohort',
+        batch_size: int = 1024
+    ):
+        """
+        Args:
+            length (int): Points per resampled trajectory
+            channels (Sequence[str]): Visit fields compared
+            band (Optional[int]): Sakoe-Chiba band radius in points
+                (length // 8 by default, at least 1)
+            normalize (str): 'cohort' to standardise channels with cohort
+                statistics, 'series' to z-normalise each trajectory
+            batch_size (int): Trajectories per vectorised DTW batch
+        """
+        if normalize not in ('cohort', 'series'):
+            raise ValueError(f"Unknown normalization '{normalize}'")
+        self.length = length
+        self.channels = list(channels)
+        self.band = band if band is not None else max(1, length // 8)
+        self.normalize = normalize
+        self.batch_size = batch_size
+
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.series = np.zeros((0, length, len(self.channels)), dtype=np.float32)
+        self.upper = self.series
+        self.lower = self.series
+        self.sq_norms = np.zeros(0)
+        self.mean = np.zeros(len(self.channels))
+        self.std = np.ones(len(self.channels))
+        self.last_search_stats = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def params(self) -> Dict[str, Any]:
+        return {
+            'length': self.length,
+            'channels': self.channels,
+            'band': self.band,
+            'normalize': self.normalize,
+            'batch_size': self.batch_size
+        }
+
+    def embed(self, visits: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """
+        Resampled, normalised embedding of one patient's visits.
+
+        Args:
+            visits (Sequence[Dict[str, Any]]): Visit records of one patient
+
+        Returns:
+            np.ndarray: float32 array of shape (length, n_channels)
+        """
+        return self._normalize(resample_visits(visits, self.length, self.channels)[None])[0]
+
+    def _normalize(self, series: np.ndarray) -> np.ndarray:
+        """Impute and normalise raw resampled trajectories."""
+        if self.normalize == 'series':
+            mean = np.nanmean(series, axis=1, keepdims=True)
+            series = np.where(np.isnan(series), mean, series)
+            std = series.std(axis=1, keepdims=True)
+            return ((series - mean) / np.where(std > 1e-8, std, 1)).astype(np.float32)
+
+        series = np.where(np.isnan(series), self.mean, series)
+        return ((series - self.mean) / self.std).astype(np.float32)
+
+    def build(self, trajectories: Any, ids: Optional[Sequence[int]] = None) -> 'TrajectoryIndex':
+        """
+        Build the index.
+
+        Args:
+            trajectories: Dict of patient id -> visit records (see
+                trajectories_from_visits), or an array of already resampled
+                trajectories of shape (n, length, n_channels) with `ids`
+            ids (Optional[Sequence[int]]): Patient id of each trajectory when
+                an array is given
+
+        Returns:
+            TrajectoryIndex: self
+        """
+        if isinstance(trajectories, dict):
+            ids = list(trajectories)
+            raw = np.stack([resample_visits(trajectories[i], self.length, self.channels) for i in ids]) \
+                if ids else np.zeros((0, self.length, len(self.channels)), dtype=np.float32)
+        else:
+            raw = np.asarray(trajectories, dtype=np.float32)
+            if raw.shape[1:] != (self.length, len(self.channels)):
+                raise ValueError(f"Expected trajectories of shape (n, {self.length}, {len(self.channels)})")
+
+        self.ids = np.asarray(ids, dtype=np.int64)
+        if len(raw):
+            self.mean = np.nan_to_num(np.nanmean(raw, axis=(0, 1)))
+            std = np.nan_to_num(np.nanstd(raw, axis=(0, 1)))
+            self.std = np.where(std > 1e-8, std, 1.0)
+        self.series = np.ascontiguousarray(self._normalize(raw))
+        self.upper, self.lower = (np.ascontiguousarray(a) for a in envelope(self.series, self.band))
+        self.sq_norms = self._sq_norms(self.series)
+        return self
+
+    @staticmethod
+    def _sq_norms(series: np.ndarray) -> np.ndarray:
+        """Squared L2 norm of each flattened trajectory."""
+        flat = series.reshape(len(series), -1)
+        return np.einsum('ij,ij->i', flat, flat, dtype=np.float64)
+
+    def search(
+        self,
+        query: Any,
+        k: int = 10,
+        method: str = 'dtw',
+        exclude_ids: Optional[Sequence[int]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the patients with the most similar trajectories.
+
+        Args:
+            query: Visit records of the query patient, or an embedding of
+                shape (length, n_channels) from embed()
+            k (int): Number of neighbours
+            method (str): 'dtw' for exact banded DTW, 'euclidean' for the
+                (faster, warping-free) distance between embeddings
+            exclude_ids (Optional[Sequence[int]]): Ids to leave out, e.g. the
+                query patient itself
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (ids, distances), nearest first;
+            distances are square roots of the summed squared differences
+        """
+        q = query if isinstance(query, np.ndarray) else self.embed(query)
+        q = q.astype(np.float32, copy=False).ravel()
+        n = len(self.ids)
+        series = self.series.reshape(n, -1)
+
+        excluded = np.zeros(n, dtype=bool)
+        if exclude_ids is not None:
+            excluded = np.isin(self.ids, np.asarray(exclude_ids, dtype=np.int64))
+        k = min(k, n - int(excluded.sum()))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # Squared Euclidean distances from the precomputed norms in one pass
+        euclidean = self.sq_norms - 2 * (series @ q).astype(np.float64) + float(q @ q)
+        euclidean[excluded] = np.inf
+        nearest = np.argpartition(euclidean, k - 1)[:k]
+        # Recompute those k exactly: the expansion above can cancel badly
+        diff = series[nearest] - q
+        exact = np.einsum('ij,ij->i', diff, diff, dtype=np.float64)
+
+        if method == 'euclidean':
+            order = np.argsort(exact, kind='stable')
+            return self.ids[nearest[order]], np.sqrt(exact[order])
+        if method != 'dtw':
+            raise ValueError(f"Unknown trajectory distance '{method}'")
+
+        # Banded DTW <= Euclidean, so the k-th Euclidean distance bounds the
+        # k-th DTW distance and anything with a larger lower bound is out
+        # (with slack for the sums rounding differently)
+        cutoff = exact.max() * (1 + 1e-6) + 1e-9
+
+        # Cascade: the stored envelopes against the query first, then the
+        # query's envelope against the survivors
+        lower_bound = lb_keogh(q, self.upper.reshape(n, -1), self.lower.reshape(n, -1))
+        lower_bound[excluded] = np.inf
+        survivors = np.flatnonzero(lower_bound <= cutoff)
+        q_upper, q_lower = (a.ravel() for a in envelope(q.reshape(1, self.length, -1), self.band))
+        lower_bound[survivors] = np.maximum(
+            lower_bound[survivors],
+            lb_keogh(series[survivors], q_upper, q_lower)
+        )
+        survivors = survivors[lower_bound[survivors] <= cutoff]
+        survivors = survivors[np.argsort(lower_bound[survivors], kind='stable')]
+
+        q = q.reshape(self.length, -1)
+        best_pos = np.zeros(0, dtype=np.int64)
+        best_cost = np.zeros(0)
+        n_computed = n_abandoned = 0
+        start, batch_size = 0, min(64, self.batch_size)
+        while start < len(survivors):
+            if len(best_cost) == k:
+                cutoff = min(cutoff, best_cost[-1])
+            batch = survivors[start:start + batch_size]
+            batch = batch[lower_bound[batch] <= cutoff]
+            if not len(batch):
+                break
+            # Small first batches tighten the cutoff before the big ones
+            start += batch_size
+            batch_size = min(2 * batch_size, self.batch_size)
+
+            cost = dtw_batch(
+                q, self.series[batch], self.band, cutoff,
+                remaining_bound=row_bounds(q, self.upper[batch], self.lower[batch])
+            )
+            n_computed += len(batch)
+            n_abandoned += int(np.isinf(cost).sum())
+
+            pos = np.concatenate([best_pos, batch])
+            cost = np.concatenate([best_cost, cost])
+            order = np.argsort(cost, kind='stable')[:k]
+            finite = np.isfinite(cost[order])
+            best_pos, best_cost = pos[order][finite], cost[order][finite]
+
+        self.last_search_stats = {
+            'candidates': n - int(excluded.sum()),
+            'pruned_by_lower_bound': n - int(excluded.sum()) - n_computed,
+            'dtw_computed': n_computed,
+            'dtw_abandoned': n_abandoned
+        }
+        return self.ids[best_pos], np.sqrt(best_cost)
+
+    def save(self, path: str) -> None:
+        """Write the trajectories, envelopes and parameters to a directory."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'trajectory_ids.npy'), self.ids)
+        np.save(os.path.join(path, 'trajectory_series.npy'), self.series)
+        np.save(os.path.join(path, 'trajectory_upper.npy'), self.upper)
+        np.save(os.path.join(path, 'trajectory_lower.npy'), self.lower)
+        with open(os.path.join(path, 'trajectory.json'), 'w') as f:
+            json.dump({'params': self.params(), 'mean': self.mean.tolist(), 'std': self.std.tolist()}, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = 'r') -> 'TrajectoryIndex':
+        """Load an index written by save()."""
+        with open(os.path.join(path, 'trajectory.json')) as f:
+            state = json.load(f)
+        index = cls(**state['params'])
+        index.mean = np.asarray(state['mean'])
+        index.std = np.asarray(state['std'])
+        index.ids = np.load(os.path.join(path, 'trajectory_ids.npy'), mmap_mode=mmap_mode)
+        index.series = np.load(os.path.join(path, 'trajectory_series.npy'), mmap_mode=mmap_mode)
+        index.upper = np.load(os.path.join(path, 'trajectory_upper.npy'), mmap_mode=mmap_mode)
+        index.lower = np.load(os.path.join(path, 'trajectory_lower.npy'), mmap_mode=mmap_mode)
+        index.sq_norms = index._sq_norms(index.series)
+        return index
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class PatientsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'patients'
+
+    def ready(self):
+        import patients.signals
+
+        from django.conf import settings
+        if getattr(settings, 'SIMILARITY_WARM_ON_STARTUP', False):
+            from ml.engine import warm_up
+            warm_up()
@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from ml.engine import invalidate_patient_features, update_patient_index, remove_patient_from_index
+from .models import Patient, PatientProfile, MedicalRecord, Medication, VitalSigns
+
+
+def _invalidate_after_commit(patient_id):
+    """Invalidate once the change is committed, so a reload sees it"""
+    transaction.on_commit(lambda: invalidate_patient_features(patient_id))
+
+
+@receiver([post_save, post_delete], sender=Patient)
+def invalidate_patient(sender, instance, **kwargs):
+    """Drop cached similarity features and re-index (or remove) a patient when they change"""
+    _invalidate_after_commit(instance.pk)
+    if kwargs['signal'] is post_delete:
+        remove_patient_from_index(instance.pk)
+    else:
+        update_patient_index(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=PatientProfile)
+@receiver([post_save, post_delete], sender=MedicalRecord)
+@receiver([post_save, post_delete], sender=Medication)
+@receiver([post_save, post_delete], sender=VitalSigns)
+def invalidate_patient_related(sender, instance, **kwargs):
+    """Drop cached similarity features and re-index a patient when data they are derived from changes"""
+    _invalidate_after_commit(instance.patient_id)
+    update_patient_index(instance.patient_id)
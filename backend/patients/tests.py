@@ -1,3 +1,174 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import date
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+import ml.engine
+from caretakers.models import Caretaker, CaretakerPatientAssignment
+from clinics.models import Clinic, ClinicPatient
+from ml.engine import get_similarity_engine
+from ml.patient_similarity import PatientSimilarity
+from .models import Patient, MedicalRecord
+
+WORKER_STATE = ('_engine', '_feature_store', '_result_cache', '_journal_path', '_journal_offset')
+
+
+def new_worker():
+    """Module state of ml.engine in a worker that has not loaded anything yet"""
+    return {'_engine': None, '_feature_store': None, '_result_cache': None, '_journal_path': None, '_journal_offset': 0}
+
+
+class SimilarityIndexSyncTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.artifact = tempfile.mkdtemp()
+        patients = PatientSimilarity().generate_synthetic_data(num_patients=200, seed=0)
+        for patient_id, patient in enumerate(patients, start=100000):
+            patient['id'] = patient_id
+        model = PatientSimilarity(n_neighbors=5, auto_rebuild=False)
+        model.fit(patients, id_field='id')
+        cls.model = model
+        cls.addClassCleanup(shutil.rmtree, cls.artifact)
+
+    def setUp(self):
+        # A fresh artifact, and so a fresh journal, for every test
+        self.path = tempfile.mkdtemp(dir=self.artifact)
+        self.model.save(self.path)
+        settings_override = override_settings(SIMILARITY_INDEX_PATH=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.worker = new_worker()
+
+    @contextmanager
+    def as_worker(self, state):
+        """Run with ml.engine's module state swapped for another worker's"""
+        with mock.patch.multiple(ml.engine, **state):
+            yield
+            state.update({name: getattr(ml.engine, name) for name in WORKER_STATE})
+
+    def indexed_row(self, engine, patient_id):
+        rows, found = engine.raw.get(np.array([patient_id]))
+        return rows[0] if found[0] else None
+
+    def register(self, **fields):
+        with self.as_worker(self.worker), self.captureOnCommitCallbacks(execute=True):
+            return Patient.objects.create(email='p@example.com', first_name='P', last_name='T', **fields)
+
+    def test_registration_reaches_other_workers_and_restarts(self):
+        other = new_worker()
+        with self.as_worker(other):
+            get_similarity_engine()
+
+        patient = self.register(age=71)
+
+        # A worker that was already running applies the journal before searching
+        with self.as_worker(other):
+            ml.engine.find_similar_to_patient(patient.pk, k=3)
+            self.assertEqual(self.indexed_row(ml.engine._engine, patient.pk)[0], 71)
+        # A restarted worker replays it on load
+        with self.as_worker(new_worker()):
+            self.assertEqual(self.indexed_row(get_similarity_engine(), patient.pk)[0], 71)
+
+    def test_index_update_keeps_unrelated_cached_results(self):
+        first = self.register(age=71)
+        with self.as_worker(self.worker), self.captureOnCommitCallbacks(execute=True):
+            second = Patient.objects.create(email='q@example.com', first_name='Q', last_name='T', age=30)
+            third = Patient.objects.create(email='r@example.com', first_name='R', last_name='T', age=90)
+
+        with self.as_worker(self.worker):
+            results = {p.pk: ml.engine.find_similar_to_patient(p.pk, k=3)['results'] for p in (first, second, third)}
+            listing_third = {
+                patient_id for patient_id, neighbours in results.items()
+                if third.pk in [n['patient_id'] for n in neighbours]
+            }
+        with self.as_worker(self.worker), self.captureOnCommitCallbacks(execute=True):
+            third.age = 91
+            third.save()
+
+        with self.as_worker(self.worker):
+            for patient in (first, second, third):
+                cached = ml.engine.find_similar_to_patient(patient.pk, k=3)['cached']
+                self.assertEqual(cached, patient.pk != third.pk and patient.pk not in listing_third)
+
+    def test_rolled_back_registration_is_not_indexed(self):
+        with self.as_worker(self.worker), self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Patient.objects.create(email='gone@example.com', first_name='P', last_name='T', age=70)
+                raise RuntimeError('registration failed')
+
+        with self.as_worker(new_worker()):
+            self.assertEqual(len(get_similarity_engine().raw), 200)
+
+    def test_changes_to_related_rows_update_the_indexed_features(self):
+        patient = self.register(age=71)
+        with self.as_worker(self.worker), self.captureOnCommitCallbacks(execute=True):
+            MedicalRecord.objects.create(
+                patient=patient, record_type='cognitive_assessment', title='MMSE', description='',
+                date_recorded=date(2024, 1, 1), mmse_score=22
+            )
+            patient.age = 72
+            patient.save()
+
+        with self.as_worker(new_worker()):
+            row = self.indexed_row(get_similarity_engine(), patient.pk)
+        self.assertEqual((row[0], row[1]), (72, 22))
+
+    def test_deleted_patient_is_removed(self):
+        patient = self.register(age=71)
+        patient_id = patient.pk
+        with self.as_worker(self.worker), self.captureOnCommitCallbacks(execute=True):
+            patient.delete()
+
+        with self.as_worker(self.worker):
+            self.assertIsNone(self.indexed_row(ml.engine._engine, patient_id))
+        with self.as_worker(new_worker()):
+            engine = get_similarity_engine()
+            self.assertIsNone(self.indexed_row(engine, patient_id))
+            self.assertEqual(len(engine.raw), 200)
+
+
+@override_settings(SIMILARITY_INDEX_PATH='/nonexistent')
+class SimilarPatientsAccessTests(TestCase):
+    url = '/api/patients/similar/'
+
+    def setUp(self):
+        patcher = mock.patch.multiple(ml.engine, **new_worker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.patient = Patient.objects.create(email='p@example.com', first_name='P', last_name='T')
+        self.other = Patient.objects.create(email='o@example.com', first_name='O', last_name='T')
+
+    def get(self, user, patient_id):
+        self.client.force_authenticate(user)
+        return self.client.get(self.url, {'patient_id': patient_id}).status_code
+
+    def test_patients_see_only_themselves(self):
+        # Past the access check; no model is built in tests
+        self.assertEqual(self.get(self.patient, self.patient.pk), 503)
+        self.assertEqual(self.get(self.patient, self.other.pk), 403)
+
+    def test_linked_clinics_and_caretakers(self):
+        clinic = Clinic.objects.create(
+            email='c@example.com', clinic_name='C', phone='1', address='A', city='C', state='S',
+            zip_code='1', license_number='L'
+        )
+        caretaker = Caretaker.objects.create(email='k@example.com', first_name='K', last_name='T')
+        for user in (clinic, caretaker):
+            self.assertEqual(self.get(user, self.patient.pk), 403)
+
+        ClinicPatient.objects.create(clinic=clinic, patient=self.patient, patient_number='P1')
+        CaretakerPatientAssignment.objects.create(caretaker=caretaker, patient=self.patient)
+        for user in (clinic, caretaker):
+            self.assertEqual(self.get(user, self.patient.pk), 503)
+            self.assertEqual(self.get(user, self.other.pk), 403)
+
+        ClinicPatient.objects.update(is_active=False)
+        self.assertEqual(self.get(clinic, self.patient.pk), 403)
@@ -44,8 +44,9 @@ urlpatterns = [
     # Vital Signs endpoints
     path('vital-signs/trends/', views.vital_signs_trends, name='vital_signs_trends'),
     
-    # Search and Export endpoints
+    # Search, Similarity and Export endpoints
     path('search/', views.search_patients, name='search_patients'),
+    path('similar/', views.similar_patients, name='similar_patients'),
     path('export/', views.export_patient_data, name='export_patient_data'),
     
     # Include router URLs
@@ -27,6 +27,9 @@ from .serializers import (
     MedicalRecordSummarySerializer, AppointmentSummarySerializer,
     MedicationSummarySerializer, PatientExportSerializer
 )
+from clinics.models import Clinic, ClinicPatient
+from caretakers.models import Caretaker, CaretakerPatientAssignment
+from ml.engine import find_similar_to_patient
 
 # Authentication Views
 @api_view(['POST'])
@@ -509,6 +512,51 @@ def search_patients(request):
     serializer = PatientSummarySerializer(queryset[:50], many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
+def can_view_patient(user, patient_id):
+    """Whether a user may see a patient's data: the patient themself, or a clinic or caretaker actively linked to them"""
+    if isinstance(user, Patient):
+        return user.pk == patient_id
+    if isinstance(user, Clinic):
+        return ClinicPatient.objects.filter(clinic=user, patient_id=patient_id, is_active=True).exists()
+    if isinstance(user, Caretaker):
+        return CaretakerPatientAssignment.objects.filter(
+            caretaker=user, patient_id=patient_id, is_active=True
+        ).exists()
+    return False
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def similar_patients(request):
+    """Find the patients most similar to a patient (the current user by default)"""
+    try:
+        patient_id = int(request.query_params.get('patient_id', request.user.pk))
+        k = int(request.query_params.get('k', 10))
+    except ValueError:
+        return Response({'error': 'patient_id and k must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not 1 <= k <= 100:
+        return Response({'error': 'k must be between 1 and 100'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Neighbours and their scores are health information of the patient
+    if not can_view_patient(request.user, patient_id):
+        return Response(
+            {'error': 'You do not have access to this patient'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    try:
+        result = find_similar_to_patient(patient_id, k=k)
+    except KeyError:
+        return Response({'error': 'Patient not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    if result is None:
+        return Response(
+            {'error': 'Similarity model is not available'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    
+    return Response(result, status=status.HTTP_200_OK)
+
 # Export and Report Views
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -551,7 +599,7 @@ class PatientViewSet(viewsets.ModelViewSet):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
     permission_classes = [IsAuthenticated]
-
+    
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def dashboard_view(request):
@@ -1,29 +1,58 @@
-import tensorflow as tf
+import sys
+
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Dropout
 
+sys.path.insert(0, 'backend')
+from ml.sensor_pipeline import WindowDataset, SENSOR_COLUMNS
+from ml.sensor_quantization import QUANTIZATION_MODES, benchmark_models, convert_model, representative_windows, save_model
+
+# Windows are sliced lazily from the memory-mapped sensor cache, so the
+# training set never has to exist as one dense array
+files = ['dataset/subject101.dat', 'dataset/subject102.dat', 'dataset/subject103.dat']  # Add more if needed
+dataset = WindowDataset.from_files(files, cache_dir='dataset/cache', seq_length=50, batch_size=32, seed=42)
+train, test = dataset.split(test_size=0.2, seed=42)
+train, validation = train.split(test_size=0.2, seed=42)
+
 # Define model
 model = Sequential([
-    LSTM(64, input_shape=(X_train.shape[1], X_train.shape[2]), return_sequences=False),
+    LSTM(64, input_shape=(train.seq_length, train.n_channels), return_sequences=False),
     Dropout(0.5),
     Dense(32, activation='relu'),
-    Dense(len(np.unique(y_train)), activation='softmax')
+    Dense(train.n_classes, activation='softmax')
 ])
 
 model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
 model.summary()
 
-# Train
-model.fit(X_train, y_train, epochs=10, batch_size=32, validation_split=0.2)
+# Train (each pass over a tf.data pipeline is one reshuffled epoch, prefetched)
+model.fit(train.to_tf_dataset(), validation_data=validation.to_tf_dataset(), epochs=10)
+model.evaluate(test.to_tf_dataset())
 
 
 # Save model
 model.save('sensor_model.h5')
 
-# Convert to TFLite
-converter = tf.lite.TFLiteConverter.from_keras_model(model)
-tflite_model = converter.convert()
+# Convert to TFLite: the default float32 model plus float16 and int8
+# variants for the gateway devices; int8 is calibrated on training windows
+metadata = {
+    'classes': [int(c) for c in train.classes],
+    'seq_length': train.seq_length,
+    'sensor_cols': SENSOR_COLUMNS,
+    # Live readings are scaled with the training statistics
+    'normalizer': train.normalizer.to_dict()
+}
+representative = representative_windows(train, n_samples=200, seed=42)
+variants = []
+for mode in QUANTIZATION_MODES:
+    path = 'sensor_model.tflite' if mode == 'float32' else f'sensor_model_{mode}.tflite'
+    # The .json next to each model holds the metadata used by the backend's
+    # activity inference (ml.activity_inference)
+    save_model(convert_model(model, mode, representative), path, dict(metadata, quantization=mode))
+    variants.append(path)
 
-# Save the .tflite file
-with open('sensor_model.tflite', 'wb') as f:
-    f.write(tflite_model)
+# Compare size, latency and accuracy of the variants on the test windows
+for row in benchmark_models(variants, test):
+    print(f"{row['model']}: {row['size_kb']:.1f} KB, window p50 {row['window_latency_ms']['p50']:.3f}ms, "
+          f"{row['throughput_windows_s']:.0f} windows/s, accuracy {row['accuracy']:.4f} "
+          f"({row['accuracy_delta']:+.4f})")